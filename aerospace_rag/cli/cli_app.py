@@ -7,16 +7,21 @@ from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich.markdown import Markdown
-from rich.progress import Progress, SpinnerColumn, TextColumn
-from typing import Optional
+from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn
+from typing import List, Optional
+import multiprocessing
 import sys
 from pathlib import Path
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from aerospace_rag.core.rag_engine import RAGEngine
+from aerospace_rag.core.rag_engine import RAGEngine, CONTENT_TYPES
 from aerospace_rag.core.config import get_config
+from aerospace_rag.core.metrics import get_metrics, load_metrics_state, serve_prometheus
+from aerospace_rag.core.progress import format_rates
+from aerospace_rag.core.profiling import start_profiling, stop_profiling
+from aerospace_rag.core.watcher import IndexWatcher
 
 app = typer.Typer(
     name="aerospace-rag",
@@ -25,6 +30,36 @@ app = typer.Typer(
 )
 console = Console()
 
+snapshot_app = typer.Typer(help="Export or import a portable copy of the index")
+app.add_typer(snapshot_app, name="snapshot")
+
+
+@app.callback()
+def main_options(
+    ctx: typer.Context,
+    profile: bool = typer.Option(False, "--profile", help="Profile CPU and memory per stage for this command"),
+    profile_dir: Optional[Path] = typer.Option(None, "--profile-dir", help="Profile output directory (default: profiling.directory)"),
+    profile_sample_ms: Optional[float] = typer.Option(
+        None, "--profile-sample-ms", help="Also sample all threads' stacks every N ms (default: profiling.sample_interval_ms)"
+    )
+):
+    """Aerospace RAG CLI - AI-powered aerospace course assistant"""
+    if not profile:
+        return
+
+    start_profiling(
+        ctx.invoked_subcommand or "run",
+        directory=str(profile_dir) if profile_dir else None,
+        sample_interval_ms=profile_sample_ms
+    )
+
+    def write_profile():
+        output = stop_profiling()
+        if output is not None:
+            console.print(f"[dim]Profile written to {output} (run.prof, per-stage .prof, stats.txt, memory.txt)[/dim]")
+
+    ctx.call_on_close(write_profile)
+
 
 @app.command()
 def init():
@@ -50,7 +85,8 @@ def init():
 
 @app.command()
 def index(
-    course: Optional[str] = typer.Option(None, "--course", "-c", help="Specific course code to index")
+    course: Optional[str] = typer.Option(None, "--course", "-c", help="Specific course code to index"),
+    restart: bool = typer.Option(False, "--restart", help="Ignore checkpoints and re-index every file")
 ):
     """Index PDF documents into the database"""
     try:
@@ -59,8 +95,26 @@ def index(
         rag = RAGEngine()
         rag.initialize()
 
-        with console.status("[bold yellow]Indexing documents...[/bold yellow]"):
-            rag.index_documents(course_code=course)
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[bold yellow]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            TextColumn("[dim]{task.fields[rates]}"),
+            console=console
+        ) as progress:
+            task = progress.add_task("Indexing documents...", total=1.0, rates="")
+
+            def on_progress(snapshot):
+                files = f"{snapshot['files_done']}/{snapshot['total_files']} files"
+                progress.update(
+                    task,
+                    completed=snapshot['fraction'],
+                    description=f"Indexing {files}",
+                    rates=format_rates(snapshot)
+                )
+
+            rag.index_documents(course_code=course, resume=not restart, progress_callback=on_progress)
 
         console.print("\n[bold green]✓ Indexing completed successfully![/bold green]\n")
 
@@ -71,6 +125,261 @@ def index(
         raise typer.Exit(code=1)
 
 
+@app.command()
+def watch(
+    course: Optional[str] = typer.Option(None, "--course", "-c", help="Only watch this course"),
+    interval: Optional[float] = typer.Option(None, "--interval", help="Seconds between directory scans"),
+    debounce: Optional[float] = typer.Option(None, "--debounce", help="Seconds a file must stay unchanged")
+):
+    """Keep the index up to date as PDFs are added, replaced or deleted (Ctrl+C to stop)"""
+    try:
+        config = get_config()
+        courses = config.courses
+        if course:
+            if course not in courses:
+                raise ValueError(f"Unknown course code: {course}")
+            courses = {course: courses[course]}
+        watch_cfg = config.get('watch', {})
+
+        rag = RAGEngine()
+        rag.initialize()
+
+        def on_event(kind, info):
+            name = f"{info.get('course_code')}/{info.get('file_name')}"
+            if kind == 'indexing':
+                console.print(f"[yellow]… Indexing {name}[/yellow]")
+            elif kind == 'indexed':
+                console.print(f"[green]✓ Indexed {name} ({info['chunks']} new chunks)[/green]")
+            elif kind == 'unchanged':
+                console.print(f"[dim]✓ {name} unchanged[/dim]")
+            elif kind == 'retired':
+                console.print(f"[green]✓ Removed {name} ({info['chunks']} chunks)[/green]")
+            elif kind == 'refreshed':
+                console.print(f"[dim]Indexes refreshed for {', '.join(info['courses'])}[/dim]")
+            elif kind == 'error':
+                console.print(f"[bold red]✗ {name if info.get('file_name') else 'Refresh'} failed: "
+                              f"{info['error']}[/bold red]")
+
+        watcher = IndexWatcher(
+            rag,
+            Path(config.paths['data_dir']),
+            courses,
+            CONTENT_TYPES,
+            poll_interval=interval if interval is not None else watch_cfg.get('poll_interval', 2.0),
+            debounce_seconds=debounce if debounce is not None else watch_cfg.get('debounce_seconds', 5.0),
+            on_event=on_event
+        )
+
+        console.print(f"\n[bold cyan]Watching {len(courses)} course(s) under "
+                      f"{config.paths['data_dir']}[/bold cyan] [dim](Ctrl+C to stop)[/dim]\n")
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            console.print("\n[yellow]Stopping watcher (partly indexed files resume next time)...[/yellow]")
+
+        rag.close()
+        console.print("[bold green]✓ Watcher stopped[/bold green]\n")
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Watch failed: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def rollback(
+    course: str = typer.Option(..., "--course", "-c", help="Course to roll back")
+):
+    """Put a course's previous index generation back in service"""
+    try:
+        rag = RAGEngine()
+        rag.initialize()
+
+        table = rag.rollback_course(course)
+        console.print(f"[bold green]✓ {course} is now served from {table}[/bold green]")
+
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Rollback failed: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def generations(
+    course: Optional[str] = typer.Option(None, "--course", "-c", help="Filter by course code")
+):
+    """List index generations built by full re-index runs"""
+    try:
+        rag = RAGEngine()
+        rag.initialize()
+
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("ID", justify="right")
+        table.add_column("Course", style="cyan")
+        table.add_column("Table")
+        table.add_column("Status", style="yellow")
+        table.add_column("Chunks", justify="right")
+        table.add_column("Activated")
+
+        for g in rag.db.list_generations(course):
+            table.add_row(
+                str(g['id']), g['course_code'], g['table'], g['status'],
+                str(g['chunks']) if g['chunks'] is not None else "-",
+                g['activated_at'].strftime('%Y-%m-%d %H:%M') if g['activated_at'] else "-"
+            )
+
+        console.print(table)
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Error: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@app.command("migrate-embeddings")
+def migrate_embeddings(
+    model: str = typer.Option(..., "--model", "-m", help="Ollama embedding model to migrate to"),
+    cutover: bool = typer.Option(True, "--cutover/--no-cutover", help="Switch queries over once every chunk is embedded")
+):
+    """Re-embed the corpus with a new model while queries keep using the current one"""
+    try:
+        rag = RAGEngine()
+        rag.initialize()
+
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[bold yellow]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            TextColumn("[dim]{task.fields[rates]}"),
+            console=console
+        ) as progress:
+            task = progress.add_task(f"Embedding with {model}...", total=1.0, rates="")
+
+            def on_progress(snapshot):
+                progress.update(
+                    task,
+                    completed=snapshot['embedded'] / snapshot['total'] if snapshot['total'] else 1.0,
+                    description=f"Embedded {snapshot['embedded']}/{snapshot['total']} chunks",
+                    rates=f"{snapshot['rate']:.1f} emb/s"
+                )
+
+            result = rag.migrate_embeddings(model, cutover=cutover, progress_callback=on_progress)
+
+        if result['activated']:
+            console.print(f"\n[bold green]✓ Queries now use {model} ({result['column']})[/bold green]")
+            console.print("[dim]Drop the previous version with 'embedding-models --drop <model>' "
+                          "once running clients have restarted[/dim]\n")
+        else:
+            console.print(f"\n[yellow]{result['embedded']}/{result['total']} chunks embedded with {model}; "
+                          f"the active model is unchanged[/yellow]\n")
+
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Embedding migration failed: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@snapshot_app.command("export")
+def snapshot_export(
+    directory: Path = typer.Argument(..., help="New (or empty) directory to write the snapshot to")
+):
+    """Write all chunks, metadata and embeddings to a checksummed snapshot directory"""
+    try:
+        rag = RAGEngine()
+        rag.initialize(check_ollama=False)
+
+        with console.status("[bold yellow]Exporting index...[/bold yellow]") as status:
+            manifest = rag.export_snapshot(
+                str(directory),
+                progress_callback=lambda p: status.update(f"[bold yellow]Exported {p['rows']} chunks...[/bold yellow]")
+            )
+
+        counts = manifest['counts']
+        size = sum(f['bytes'] for f in manifest['files'].values())
+        console.print(f"\n[bold green]✓ Exported {counts['documents']} chunks ({counts['embeddings']} embeddings, "
+                      f"{manifest['embedding_model']['model']}) from {counts['courses']} courses to {directory}[/bold green]")
+        console.print(f"[dim]{size / 1e6:.1f} MB in {manifest['seconds']:.1f}s[/dim]\n")
+
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Snapshot export failed: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@snapshot_app.command("import")
+def snapshot_import(
+    directory: Path = typer.Argument(..., help="Snapshot directory written by 'snapshot export'"),
+    replace: bool = typer.Option(False, "--replace", help="Clear existing documents before importing")
+):
+    """Load a snapshot with bulk COPY and rebuild the vector indexes (no embedding calls)"""
+    try:
+        rag = RAGEngine()
+        rag.initialize(check_ollama=False)
+
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[bold yellow]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            console=console
+        ) as progress:
+            task = progress.add_task("Verifying and loading snapshot...", total=1.0)
+
+            def on_progress(p):
+                progress.update(
+                    task,
+                    completed=p['rows'] / p['total'] if p['total'] else 1.0,
+                    description=f"Loaded {p['rows']}/{p['total']} chunks"
+                )
+
+            result = rag.import_snapshot(str(directory), replace=replace, progress_callback=on_progress)
+
+        console.print(f"\n[bold green]✓ Imported {result['documents']} chunks ({result['embeddings']} embeddings, "
+                      f"{result['model']})[/bold green]")
+        console.print(f"[dim]Load {result['load_seconds']:.1f}s, indexes {result['index_seconds']:.1f}s[/dim]\n")
+
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Snapshot import failed: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@app.command("embedding-models")
+def embedding_models(
+    drop: Optional[str] = typer.Option(None, "--drop", help="Drop a retired model version's vectors")
+):
+    """List embedding model versions and their coverage"""
+    try:
+        rag = RAGEngine()
+        rag.initialize()
+
+        if drop:
+            rag.db.drop_embedding_model(drop)
+            console.print(f"[green]✓ Dropped {drop}[/green]")
+
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Model", style="cyan")
+        table.add_column("Dimensions", justify="right")
+        table.add_column("Column")
+        table.add_column("Status", style="yellow")
+        table.add_column("Coverage", justify="right")
+
+        for m in rag.db.list_embedding_models():
+            coverage = f"{m['embedded']}/{m['total']}" if m['total'] else "-"
+            table.add_row(m['model'], str(m['dimension']), m['column'], m['status'], coverage)
+
+        console.print(table)
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Error: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
 @app.command()
 def query(
     question: str = typer.Argument(..., help="Your question about aerospace topics"),
@@ -123,6 +432,8 @@ def query(
 
             console.print(table)
 
+        print_query_metrics(result.get('metrics'), result.get('context_stats'))
+
         console.print("\n")
         rag.close()
 
@@ -144,10 +455,14 @@ def interactive(
             "[bold cyan]Aerospace RAG Interactive Mode[/bold cyan]\n\n"
             "Type your questions and get AI-powered answers from MIT aerospace course materials.\n"
             "Commands: 'exit', 'quit' - Exit the session\n"
-            "          'stats' - Show system statistics",
+            "          'stats' - Show system statistics\n"
+            "          'new' - Start a new conversation",
             border_style="cyan"
         ))
 
+        # Follow-up questions see earlier turns of the same session
+        session_id = rag.start_session()
+
         while True:
             console.print("\n[bold yellow]Your question:[/bold yellow] ", end="")
             question = input().strip()
@@ -161,13 +476,21 @@ def interactive(
                 console.print(f"\n[bold cyan]System Statistics:[/bold cyan]")
                 console.print(f"  Total documents: {stats['total_documents']}")
                 console.print(f"  Configured courses: {stats['configured_courses']}")
-                console.print(f"  Indexed courses: {len(stats['courses'])}\n")
+                console.print(f"  Indexed courses: {len(stats['courses'])}")
+                print_latency_stats(stats)
+                console.print()
+                continue
+
+            if question.lower() == 'new':
+                rag.end_session(session_id)
+                session_id = rag.start_session()
+                console.print("\n[bold green]✓ Started a new conversation[/bold green]")
                 continue
 
             if not question:
                 continue
 
-            result = rag.query(question, course_code=course)
+            result = rag.query(question, course_code=course, session_id=session_id)
 
             console.print("\n" + "-"*80 + "\n")
             console.print(Panel(
@@ -206,11 +529,14 @@ def stats():
         table.add_column("Value", style="green")
 
         table.add_row("Total Documents", str(stats['total_documents']))
+        table.add_row("Unique (Embedded) Chunks", str(stats['dedup']['unique_chunks']))
         table.add_row("Configured Courses", str(stats['configured_courses']))
         table.add_row("Indexed Courses", str(len(stats['courses'])))
 
         console.print(table)
 
+        print_latency_stats(stats)
+
         # Course-wise stats
         if stats['courses']:
             console.print("\n[bold cyan]Indexed Courses:[/bold cyan]\n")
@@ -237,6 +563,204 @@ def stats():
         raise typer.Exit(code=1)
 
 
+@app.command("dedup-report")
+def dedup_report():
+    """Show content embedded once per course because several courses share it (scans all chunks)"""
+    try:
+        rag = RAGEngine()
+        rag.initialize(check_ollama=False)
+
+        with console.status("[bold yellow]Scanning chunks...[/bold yellow]"):
+            report = rag.db.cross_course_report()
+
+        console.print("\n[bold cyan]Content Shared Between Courses[/bold cyan]\n")
+        if not report['courses']:
+            console.print("[yellow]No embedded chunk is shared between courses[/yellow]\n")
+            rag.close()
+            return
+
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Course", style="cyan")
+        table.add_column("Shared chunks", justify="right", style="green")
+        for course in report['courses']:
+            table.add_row(course['course_code'], str(course['shared_chunks']))
+        console.print(table)
+
+        # Deduplication is per course; shared content keeps one embedded copy per course
+        console.print(f"\n{report['extra_vectors']} vector(s) repeat another course's content\n")
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Error: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@app.command("chunk-report")
+def chunk_report(
+    course: Optional[str] = typer.Option(None, "--course", "-c", help="Limit the report to one course")
+):
+    """Compare character and token chunking (chunk count and index size)"""
+    try:
+        from aerospace_rag.core.tokenizer import get_token_counter
+
+        rag = RAGEngine()
+
+        with console.status("[bold yellow]Parsing PDFs...[/bold yellow]"):
+            report = rag.compare_chunking(course_code=course)
+
+        console.print("\n[bold cyan]Chunking Comparison[/bold cyan]\n")
+
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Mode", style="cyan")
+        table.add_column("Chunks", justify="right")
+        table.add_column("Avg tokens", justify="right")
+        table.add_column("Max tokens", justify="right")
+        table.add_column("Est. index size", justify="right", style="green")
+
+        for mode, t in report.items():
+            table.add_row(
+                mode,
+                str(t['chunks']),
+                f"{t['avg_tokens']:.0f}",
+                str(t['max_tokens']),
+                f"{t['estimated_bytes'] / (1024 * 1024):.1f} MB"
+            )
+
+        console.print(table)
+
+        chars, tokens = report['characters'], report['tokens']
+        if tokens['chunks']:
+            console.print(
+                f"\nToken chunking needs {chars['chunks'] / tokens['chunks']:.1f}x fewer embeddings "
+                f"({chars['chunks']} → {tokens['chunks']})"
+            )
+        if not get_token_counter().exact:
+            console.print("[dim]Token counts are approximate (set rag.tokenizer to a tokenizer.json for exact counts)[/dim]")
+        console.print()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Error: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@app.command("eval-compression")
+def eval_compression(
+    eval_set: Optional[Path] = typer.Option(None, "--eval-set", "-e", help="JSONL eval set (default: compression.eval_set)"),
+    save: bool = typer.Option(True, "--save/--no-save", help="Save the chosen keep ratio as the calibration")
+):
+    """Calibrate sentence compression against an eval set"""
+    try:
+        rag = RAGEngine()
+        rag.initialize()
+
+        with console.status("[bold yellow]Evaluating compression ratios...[/bold yellow]"):
+            calibration = rag.evaluate_compression(str(eval_set) if eval_set else None, save=save)
+
+        console.print(f"\n[bold cyan]Compression Calibration[/bold cyan] "
+                      f"({calibration['questions']} questions, max loss {calibration['max_accuracy_loss']:.0%})\n")
+
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Keep ratio", justify="right", style="cyan")
+        table.add_column("Evidence recall", justify="right")
+        table.add_column("Loss", justify="right")
+        table.add_column("Avg context tokens", justify="right", style="green")
+
+        for row in calibration['results']:
+            marker = " ←" if row['keep_ratio'] == calibration['keep_ratio'] else ""
+            table.add_row(
+                f"{row['keep_ratio']:.2f}{marker}",
+                f"{row['recall']:.1%}",
+                f"{row['accuracy_loss']:+.1%}",
+                f"{row['avg_context_tokens']:.0f}"
+            )
+
+        console.print(table)
+        console.print(f"\nChosen keep ratio: [bold green]{calibration['keep_ratio']:.2f}[/bold green]")
+        if save:
+            console.print("[dim]Saved; used whenever compression.enabled is true[/dim]")
+        console.print()
+
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Error: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@app.command("eval-retrieval")
+def eval_retrieval(
+    eval_set: Optional[Path] = typer.Option(None, "--eval-set", "-e", help="JSONL eval set (default: compression.eval_set)"),
+    depth: Optional[List[int]] = typer.Option(None, "--depth", "-d", help="Files searched per query (repeatable)"),
+    top_k: Optional[int] = typer.Option(None, "--top-k", "-k", help="Chunks retrieved per query")
+):
+    """Report recall and latency of hierarchical retrieval against flat search"""
+    try:
+        rag = RAGEngine()
+        rag.initialize()
+
+        with console.status("[bold yellow]Comparing retrieval modes...[/bold yellow]"):
+            report = rag.evaluate_hierarchical(str(eval_set) if eval_set else None, depths=depth, top_k=top_k)
+
+        console.print(f"\n[bold cyan]Hierarchical vs Flat Retrieval[/bold cyan] "
+                      f"({report['questions']} questions, top {report['top_k']})\n")
+
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Mode", style="cyan")
+        table.add_column("Recall vs flat", justify="right")
+        table.add_column("Evidence recall", justify="right")
+        table.add_column("Mean", justify="right", style="green")
+        table.add_column("p95", justify="right", style="yellow")
+
+        for row in report['results']:
+            table.add_row(
+                f"top {row['top_files']} files" if row['top_files'] else "flat",
+                f"{row['recall']:.1%}",
+                f"{row['evidence_recall']:.1%}",
+                _fmt_seconds(row['mean_seconds']),
+                _fmt_seconds(row['p95_seconds'])
+            )
+
+        console.print(table)
+        console.print("[dim]Enable with hierarchical.enabled and hierarchical.top_files in config.yaml[/dim]\n")
+
+        rag.close()
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Error: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def metrics(
+    output: Optional[Path] = typer.Option(None, "--output", "-o", help="Write Prometheus text format to this file"),
+    serve: bool = typer.Option(False, "--serve", help="Serve /metrics over HTTP until interrupted"),
+    port: Optional[int] = typer.Option(None, "--port", "-p", help="Port for --serve (default: metrics.port)")
+):
+    """Export query metrics in Prometheus text format"""
+    try:
+        registry = load_metrics_state(get_metrics())
+
+        if output:
+            registry.write_textfile(str(output))
+            console.print(f"[green]✓ Metrics written to {output}[/green]")
+
+        if serve:
+            port = port or get_config().get('metrics', {}).get('port', 9464)
+            server = serve_prometheus(registry, port)
+            console.print(f"[bold cyan]Serving metrics on http://0.0.0.0:{port}/metrics (Ctrl+C to stop)[/bold cyan]")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.server_close()
+
+        if not output and not serve:
+            console.print(registry.render_prometheus(), end="", markup=False, highlight=False)
+
+    except Exception as e:
+        console.print(f"[bold red]✗ Error: {e}[/bold red]")
+        raise typer.Exit(code=1)
+
+
 @app.command()
 def courses():
     """List all configured courses"""
@@ -276,6 +800,11 @@ def test():
 
         if ollama_client.check_connection():
             console.print("[green]✓ Ollama is running[/green]")
+            endpoints = ollama_client.pool.info()
+            if len(endpoints) > 1:
+                for e in endpoints:
+                    state = "[green]up[/green]" if e['healthy'] else f"[red]down[/red] ({e['last_error']})"
+                    console.print(f"  • {e['url']}: {state}")
 
             if ollama_client.check_model_available():
                 console.print(f"[green]✓ Model {ollama_client.model} is available[/green]")
@@ -306,8 +835,100 @@ def test():
         raise typer.Exit(code=1)
 
 
+def _fmt_seconds(value: Optional[float]) -> str:
+    """Format a latency value for tables"""
+    if value is None:
+        return "-"
+    return f"{value * 1000:.0f} ms" if value < 1 else f"{value:.2f} s"
+
+
+def print_query_metrics(query_metrics: Optional[dict], context_stats: Optional[dict] = None) -> None:
+    """Print the per-stage timings of a single query"""
+    if not query_metrics:
+        return
+
+    parts = [
+        f"embed {_fmt_seconds(query_metrics['embed_seconds'])}",
+        f"search {_fmt_seconds(query_metrics['search_seconds'])}",
+    ]
+    if query_metrics.get('rerank_seconds') is not None:
+        parts.append(f"rerank {_fmt_seconds(query_metrics['rerank_seconds'])}")
+    parts += [
+        f"context {_fmt_seconds(query_metrics['context_build_seconds'])}",
+        f"generate {_fmt_seconds(query_metrics['generation_seconds'])}",
+        f"TTFT {_fmt_seconds(query_metrics['time_to_first_token_seconds'])}",
+    ]
+    if query_metrics.get('tokens_per_second'):
+        parts.append(f"{query_metrics['tokens_per_second']:.1f} tok/s")
+    parts.append(f"{query_metrics['retrieved_rows']} rows")
+    if query_metrics.get('routed_courses'):
+        parts.append(f"routed to {', '.join(query_metrics['routed_courses'])}")
+    parts.append(f"total {_fmt_seconds(query_metrics['total_seconds'])}")
+
+    console.print(f"\n[dim]Timings: {' | '.join(parts)}[/dim]")
+
+    if context_stats:
+        console.print(
+            f"[dim]Context: {context_stats['context_tokens']} tokens in {context_stats['context_blocks']} blocks "
+            f"(saved {context_stats['tokens_saved']}; expanded {context_stats.get('expanded_chunks', 0)}, "
+            f"merged {context_stats['merged_chunks']}, "
+            f"dropped {context_stats['dropped_redundant'] + context_stats['dropped_budget']})[/dim]"
+        )
+
+
+def print_latency_stats(stats: dict) -> None:
+    """Print accumulated per-stage latency histograms"""
+    rows = dict(stats.get('latency', {}))
+    if stats.get('query_latency', {}).get('count'):
+        rows['total'] = stats['query_latency']
+    if stats.get('time_to_first_token', {}).get('count'):
+        rows['first token'] = stats['time_to_first_token']
+
+    if not rows:
+        return
+
+    console.print("\n[bold cyan]Query Latency:[/bold cyan]\n")
+
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Stage", style="cyan")
+    table.add_column("Count", justify="right")
+    table.add_column("Mean", justify="right")
+    table.add_column("p50", justify="right")
+    table.add_column("p95", justify="right", style="yellow")
+    table.add_column("p99", justify="right")
+
+    stage_order = ['embed', 'search', 'rerank', 'context_build', 'generation', 'first token', 'total']
+    for stage in sorted(rows, key=lambda s: stage_order.index(s) if s in stage_order else len(stage_order)):
+        summary = rows[stage]
+        table.add_row(
+            stage,
+            str(summary['count']),
+            _fmt_seconds(summary['mean']),
+            _fmt_seconds(summary['p50']),
+            _fmt_seconds(summary['p95']),
+            _fmt_seconds(summary['p99'])
+        )
+
+    console.print(table)
+
+    extras = []
+    tps = stats.get('tokens_per_second', {})
+    if tps.get('count'):
+        extras.append(f"Generation: {tps['mean']:.1f} tok/s mean")
+    rows_summary = stats.get('retrieved_rows', {})
+    if rows_summary.get('count'):
+        extras.append(f"Retrieved rows: {rows_summary['mean']:.1f} mean")
+    for name, cache in stats.get('caches', {}).items():
+        lookups = cache['hits'] + cache['misses']
+        if lookups:
+            extras.append(f"{name} cache: {int(cache['hits'])}/{int(lookups)} hits")
+    console.print(f"[dim]{' | '.join(extras)}[/dim]")
+
+
 def main():
     """Main entry point"""
+    # Parallel PDF extraction uses worker processes; required for frozen executables
+    multiprocessing.freeze_support()
     app()
 
 
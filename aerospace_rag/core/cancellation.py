@@ -0,0 +1,56 @@
+"""
+Cancellation of in-flight queries and indexing runs
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Callable, List
+
+
+class OperationCancelled(Exception):
+    """Raised when work is stopped through its CancelToken"""
+
+
+class CancelToken:
+    """Cancellation flag that can also interrupt calls already in progress
+
+    Work checks the flag between steps (check()); a step that blocks, such
+    as a running PostgreSQL statement, is interrupted by the hooks registered
+    for its duration, which cancel() calls from whichever thread cancels.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._hooks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Request cancellation and interrupt whatever is currently blocking"""
+        with self._lock:
+            self._event.set()
+            hooks = list(self._hooks)
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                pass
+
+    def check(self) -> None:
+        """Raise OperationCancelled if cancellation was requested"""
+        if self._event.is_set():
+            raise OperationCancelled("Operation cancelled")
+
+    @contextmanager
+    def hook(self, callback: Callable[[], None]):
+        """Call callback on cancel() while the block runs"""
+        with self._lock:
+            self._hooks.append(callback)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._hooks.remove(callback)
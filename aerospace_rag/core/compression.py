@@ -0,0 +1,77 @@
+"""
+Extractive sentence-level context compression
+"""
+
+import re
+from typing import List, Dict, Any, Callable, Tuple
+
+import numpy as np
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences (same boundary rule as the chunker)"""
+    return [s for s in re.split(r'(?<=[.!?])\s+', text) if s.strip()]
+
+
+class SentenceCompressor:
+    """Keeps only the sentences of each context block that are most similar to the query"""
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], np.ndarray],
+        keep_ratio: float = 0.5,
+        min_sentences_per_block: int = 1,
+        min_sentence_chars: int = 20
+    ):
+        self.embed_fn = embed_fn
+        self.keep_ratio = keep_ratio
+        self.min_sentences_per_block = min_sentences_per_block
+        self.min_sentence_chars = min_sentence_chars
+
+    def compress(
+        self,
+        blocks: List[Dict[str, Any]],
+        query_embedding: np.ndarray
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Return blocks with text reduced to their top-scoring sentences, in original order"""
+        sentences: List[Tuple[int, int, str]] = []
+        for b, block in enumerate(blocks):
+            for s, sentence in enumerate(split_sentences(block['text'])):
+                sentences.append((b, s, sentence))
+
+        stats = {'sentences_in': len(sentences), 'sentences_kept': len(sentences)}
+        if not sentences or self.keep_ratio >= 1.0:
+            return blocks, stats
+
+        # Very short fragments (labels, equation numbers) are cheap to keep and embed poorly
+        scored = [i for i, (_, _, text) in enumerate(sentences) if len(text) >= self.min_sentence_chars]
+        scores = np.full(len(sentences), np.inf, dtype=np.float32)
+        if scored:
+            vectors = self.embed_fn([sentences[i][2] for i in scored])
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            query = np.asarray(query_embedding, dtype=np.float32)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            scores[scored] = vectors @ query
+
+        # Global top sentences across all blocks, plus a floor per block so citations survive
+        n_keep = max(1, int(round(len(scored) * self.keep_ratio)))
+        keep = set(np.argsort(-np.where(np.isinf(scores), -np.inf, scores))[:n_keep].tolist())
+        keep.update(i for i in range(len(sentences)) if np.isinf(scores[i]))
+
+        by_block: Dict[int, List[int]] = {}
+        for i, (b, _, _) in enumerate(sentences):
+            by_block.setdefault(b, []).append(i)
+        for members in by_block.values():
+            kept_in_block = [i for i in members if i in keep and not np.isinf(scores[i])]
+            if len(kept_in_block) < self.min_sentences_per_block:
+                ranked = sorted((i for i in members if not np.isinf(scores[i])), key=lambda i: -scores[i])
+                keep.update(ranked[:self.min_sentences_per_block])
+
+        compressed = []
+        for b, block in enumerate(blocks):
+            kept = [sentences[i][2] for i in by_block.get(b, []) if i in keep]
+            if kept:
+                compressed.append(dict(block, text=' '.join(kept)))
+
+        stats['sentences_kept'] = sum(1 for i in range(len(sentences)) if i in keep)
+        return compressed, stats
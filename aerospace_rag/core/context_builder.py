@@ -0,0 +1,252 @@
+"""
+Prompt context construction: MMR diversity, adjacent-chunk merging and token-budget packing
+"""
+
+import re
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+import numpy as np
+
+from .tokenizer import TokenCounter
+from .compression import SentenceCompressor
+
+
+def format_source_header(index: int, block: Dict[str, Any]) -> str:
+    """Citation header for one context block"""
+    first, last = block['page_start'], block['page_end']
+    pages = f"page {first}" if first == last else f"pages {first}-{last}"
+    return (
+        f"[Source {index}] From {block['course_name']} "
+        f"({block['content_type']}, {block['file_name']}, {pages}):\n"
+    )
+
+
+def merge_overlapping_text(left: str, right: str, max_overlap: int = 600) -> str:
+    """Join two chunk texts, dropping the longest suffix of left that repeats as a prefix of right"""
+    limit = min(len(left), len(right), max_overlap)
+    for size in range(limit, 0, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + ' ' + right
+
+
+class ContextBuilder:
+    """Turns similarity-search hits into a compact, cited prompt context"""
+
+    def __init__(
+        self,
+        token_counter: TokenCounter,
+        token_budget: int,
+        use_mmr: bool = True,
+        mmr_lambda: float = 0.7,
+        redundancy_threshold: float = 0.95,
+        merge_adjacent: bool = True,
+        compressor: Optional[SentenceCompressor] = None,
+        expander: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None
+    ):
+        self.token_counter = token_counter
+        self.token_budget = token_budget
+        self.use_mmr = use_mmr
+        self.mmr_lambda = mmr_lambda
+        self.redundancy_threshold = redundancy_threshold
+        self.merge_adjacent = merge_adjacent
+        self.compressor = compressor
+        self.expander = expander
+
+    def build(
+        self,
+        results: List[Dict[str, Any]],
+        query_embedding: Optional[np.ndarray] = None
+    ) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+        """Return (context, sources, stats) for retrieved results"""
+        naive_tokens = sum(
+            self.token_counter.count(format_source_header(i, self._as_block(r)) + r['text'])
+            for i, r in enumerate(results, 1)
+        )
+
+        selected, dropped_redundant = self._select(results)
+
+        # Small-to-big: add neighbouring chunks of each selected hit; merging folds them into the hit's block
+        expanded = 0
+        if self.expander is not None and selected:
+            neighbors = self.expander(selected)
+            expanded = len(neighbors)
+            selected = selected + neighbors
+
+        if self.merge_adjacent or expanded:
+            blocks = self._merge(selected)
+        else:
+            blocks = [self._as_block(r) for r in selected]
+
+        compression_stats = {'sentences_in': None, 'sentences_kept': None}
+        if self.compressor is not None and query_embedding is not None:
+            blocks, compression_stats = self.compressor.compress(blocks, query_embedding)
+
+        blocks, dropped_budget, truncated = self._pack(blocks)
+
+        context_parts = []
+        sources = []
+        for i, block in enumerate(blocks, 1):
+            context_parts.append(format_source_header(i, block) + block['text'] + "\n")
+            sources.append({
+                'course_code': block['course_code'],
+                'course_name': block['course_name'],
+                'content_type': block['content_type'],
+                'file_name': block['file_name'],
+                'page_number': block['page_start'],
+                'page_end': block['page_end'],
+                'chunk_indices': block['chunk_indices'],
+                'similarity': block['similarity']
+            })
+
+        context = "\n".join(context_parts)
+        context_tokens = self.token_counter.count(context)
+
+        stats = {
+            'retrieved_chunks': len(results),
+            'context_blocks': len(blocks),
+            'merged_chunks': sum(len(b['chunk_indices']) - 1 for b in blocks),
+            'expanded_chunks': expanded,
+            'dropped_redundant': dropped_redundant,
+            'dropped_budget': dropped_budget,
+            'truncated_blocks': truncated,
+            'sentences_in': compression_stats['sentences_in'],
+            'sentences_kept': compression_stats['sentences_kept'],
+            'token_budget': self.token_budget,
+            'naive_tokens': naive_tokens,
+            'context_tokens': context_tokens,
+            'tokens_saved': max(0, naive_tokens - context_tokens)
+        }
+        return context, sources, stats
+
+    def _select(self, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Order hits by maximal marginal relevance and drop near-copies of already selected hits"""
+        embedded = [r for r in results if r.get('embedding') is not None]
+        if not self.use_mmr or len(embedded) != len(results) or len(results) < 2:
+            return list(results), 0
+
+        vectors = np.vstack([np.asarray(r['embedding'], dtype=np.float32) for r in results])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        pairwise = vectors @ vectors.T
+        relevance = np.array([r['similarity'] for r in results], dtype=np.float32)
+
+        remaining = list(range(len(results)))
+        chosen = []
+        dropped = 0
+        while remaining:
+            if chosen:
+                redundancy = pairwise[np.ix_(remaining, chosen)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+
+            best = int(np.argmax(scores))
+            candidate = remaining.pop(best)
+
+            # Overlapping neighbours from the same file are merged later rather than dropped
+            if chosen and redundancy[best] >= self.redundancy_threshold and not self._has_neighbour(
+                results, candidate, chosen
+            ):
+                dropped += 1
+                continue
+            chosen.append(candidate)
+
+        return [results[i] for i in chosen], dropped
+
+    def _has_neighbour(self, results: List[Dict[str, Any]], candidate: int, chosen: List[int]) -> bool:
+        if not self.merge_adjacent:
+            return False
+        c = results[candidate]
+        return any(
+            self._same_file(c, results[i]) and abs(c['chunk_index'] - results[i]['chunk_index']) == 1
+            for i in chosen
+        )
+
+    @staticmethod
+    def _same_file(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        return (a['course_code'], a['content_type'], a['file_name']) == \
+               (b['course_code'], b['content_type'], b['file_name'])
+
+    @staticmethod
+    def _as_block(result: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'course_code': result['course_code'],
+            'course_name': result['course_name'],
+            'content_type': result['content_type'],
+            'file_name': result['file_name'],
+            'page_start': result['page_number'],
+            'page_end': result['page_number'],
+            'chunk_indices': [result['chunk_index']],
+            'similarity': result['similarity'],
+            'text': result['text']
+        }
+
+    def _merge(self, selected: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merge runs of consecutive chunks from the same file into single blocks, keeping selection order"""
+        groups: Dict[Tuple, List[Tuple[int, Dict[str, Any]]]] = {}
+        for rank, result in enumerate(selected):
+            key = (result['course_code'], result['content_type'], result['file_name'])
+            groups.setdefault(key, []).append((rank, result))
+
+        blocks = []
+        for members in groups.values():
+            members.sort(key=lambda m: m[1]['chunk_index'])
+            current, current_rank = None, None
+            for rank, result in members:
+                if current is not None and result['chunk_index'] == current['chunk_indices'][-1] + 1:
+                    current['text'] = merge_overlapping_text(current['text'], result['text'])
+                    current['chunk_indices'].append(result['chunk_index'])
+                    current['page_end'] = max(current['page_end'], result['page_number'])
+                    current['similarity'] = max(current['similarity'], result['similarity'])
+                    current_rank = min(current_rank, rank)
+                    continue
+                if current is not None:
+                    blocks.append((current_rank, current))
+                current, current_rank = self._as_block(result), rank
+            blocks.append((current_rank, current))
+
+        blocks.sort(key=lambda b: b[0])
+        return [block for _, block in blocks]
+
+    def _pack(self, blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int, int]:
+        """Keep blocks in order until the token budget is spent, trimming the last one at a sentence end"""
+        packed = []
+        used = 0
+        dropped = 0
+        truncated = 0
+
+        for i, block in enumerate(blocks, 1):
+            header_tokens = self.token_counter.count(format_source_header(i, block))
+            block_tokens = header_tokens + self.token_counter.count(block['text'])
+
+            if used + block_tokens <= self.token_budget:
+                packed.append(block)
+                used += block_tokens
+                continue
+
+            remaining = self.token_budget - used - header_tokens
+            # Too little room left for a useful excerpt
+            if remaining < 64:
+                dropped += len(blocks) - len(packed)
+                break
+
+            block = dict(block, text=self._truncate(block['text'], remaining))
+            packed.append(block)
+            truncated += 1
+            dropped += len(blocks) - len(packed)
+            break
+
+        return packed, dropped, truncated
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of whole sentences within max_tokens"""
+        kept = []
+        used = 0
+        for sentence in re.split(r'(?<=[.!?])\s+', text):
+            tokens = self.token_counter.count(sentence)
+            if used + tokens > max_tokens:
+                break
+            kept.append(sentence)
+            used += tokens
+        return ' '.join(kept) if kept else text[:max_tokens * 4]
@@ -2,15 +2,166 @@
 PostgreSQL database manager with pgvector support
 """
 
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
+import psycopg2.errors
 from psycopg2.extras import execute_values
-from typing import List, Tuple, Optional, Dict, Any
+from psycopg2.pool import ThreadedConnectionPool
+from typing import List, Tuple, Optional, Dict, Any, Callable
 import numpy as np
 from .config import get_config
 
 
+# embeddinggemma produces 768-dimensional vectors
+EMBEDDING_DIMENSION = 768
+
+# Column order for batch inserts into documents; course and file names live in courses/files.
+# {embedding} is the active embedding model's column (see embedding_models)
+DOCUMENT_INSERT_COLUMNS = """
+    (course_id, file_id, chunk_text, chunk_index, page_number, {embedding},
+     metadata, token_count, content_hash, minhash)
+"""
+DOCUMENT_INSERT_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+
+# Duplicate chunks carry no embedding; they point at the canonical row with the same content.
+# Canonicals are per course, so a course's partition is self-contained: a chunk whose only
+# canonical lives in another course becomes this course's canonical with a copied embedding.
+# Content shared between courses (a common textbook) is therefore stored and indexed once per
+# course, not once overall; only repeats within a course save vectors (see cross_course_report).
+# A row whose canonical was deleted (or lost its vector) since it was classified matches nothing
+# and is not inserted; callers compare the returned rows with the batch (see _insert_duplicates).
+DUPLICATE_INSERT_SQL = """
+    INSERT INTO {target}
+    (course_id, file_id, chunk_text, chunk_index, page_number, {embedding}, metadata,
+     token_count, content_hash, minhash, canonical_id)
+    SELECT v.course_id, v.file_id, v.chunk_text, v.chunk_index, v.page_number,
+           CASE WHEN c.course_id = v.course_id THEN NULL ELSE c.embedding END,
+           v.metadata, v.token_count, v.content_hash,
+           CASE WHEN c.course_id = v.course_id THEN NULL ELSE c.minhash END,
+           CASE WHEN c.course_id = v.course_id THEN c.id END
+    FROM (VALUES %s) AS v (course_id, file_id, chunk_text, chunk_index, page_number, metadata,
+                           token_count, content_hash, canonical_hash)
+    CROSS JOIN LATERAL (
+        SELECT id, course_id, {embedding} AS embedding, minhash FROM {canonicals} k
+        WHERE content_hash = v.canonical_hash
+          AND canonical_id IS NULL AND {embedding} IS NOT NULL
+        ORDER BY (course_id = v.course_id) DESC, id LIMIT 1
+    ) c
+    RETURNING id
+"""
+DUPLICATE_INSERT_TEMPLATE = (
+    "(%s::integer, %s::integer, %s, %s::integer, %s::integer, %s::jsonb, %s::integer, %s, %s)"
+)
+
+# Columns of a documents snapshot (besides the embedding), in COPY order; see snapshot.py
+SNAPSHOT_COLUMNS = (
+    'id', 'course_id', 'file_id', 'chunk_text', 'chunk_index', 'page_number',
+    'metadata', 'token_count', 'content_hash', 'canonical_id', 'minhash'
+)
+SNAPSHOT_NULLABLE = ('page_number', 'metadata', 'token_count', 'content_hash', 'canonical_id', 'minhash')
+
+# Per-row count deltas taken from a statement's transition tables
+_COUNT_DELTAS = {
+    'insert': "SELECT course_id, file_id, 1 AS n, (canonical_id IS NULL)::int AS u FROM new_rows",
+    'delete': "SELECT course_id, file_id, -1 AS n, -((canonical_id IS NULL)::int) AS u FROM old_rows",
+    'update': (
+        "SELECT course_id, file_id, 1 AS n, (canonical_id IS NULL)::int AS u FROM new_rows "
+        "UNION ALL "
+        "SELECT course_id, file_id, -1, -((canonical_id IS NULL)::int) FROM old_rows"
+    )
+}
+
+# Statement-level trigger body applying those deltas to the file and course counters
+COUNTER_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION documents_count_{op}() RETURNS trigger AS $$
+    BEGIN
+        WITH delta AS (
+            SELECT course_id, file_id, SUM(n) AS n, SUM(u) AS u
+            FROM ({delta}) r
+            GROUP BY course_id, file_id
+            HAVING SUM(n) <> 0 OR SUM(u) <> 0
+        ),
+        file_update AS (
+            UPDATE files SET
+                chunk_count = files.chunk_count + delta.n,
+                unique_count = files.unique_count + delta.u
+            FROM delta
+            WHERE files.id = delta.file_id
+        )
+        UPDATE courses SET
+            document_count = courses.document_count + s.n,
+            unique_count = courses.unique_count + s.u,
+            last_updated = CURRENT_TIMESTAMP
+        FROM (SELECT course_id, SUM(n) AS n, SUM(u) AS u FROM delta GROUP BY course_id) s
+        WHERE courses.id = s.course_id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+COUNTER_TRIGGER_REFERENCING = {
+    'insert': "REFERENCING NEW TABLE AS new_rows",
+    'delete': "REFERENCING OLD TABLE AS old_rows",
+    'update': "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"
+}
+
+
+def parse_vector(value: Any) -> Optional[np.ndarray]:
+    """Convert a pgvector value (text form unless an adapter is registered) to a float32 array"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return np.array(value.strip('[]').split(','), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def ivfflat_lists(n_rows: int) -> int:
+    """IVFFlat list count for a table size (pgvector guidance: rows/1000 up to 1M rows, then sqrt)"""
+    if n_rows <= 1_000_000:
+        return max(1, n_rows // 1000)
+    return int(math.sqrt(n_rows))
+
+
+def embedding_column_name(model_id: int) -> str:
+    """Column holding an embedding model version's vectors (version 1 keeps the original column)"""
+    return 'embedding' if model_id == 1 else f"embedding_v{int(model_id)}"
+
+
+def partition_name(course_id: int) -> str:
+    """Table name of a course's first documents partition (later generations add a _g<id> suffix)"""
+    return f"documents_c{int(course_id)}"
+
+
+def estimate_index_bytes(n_chunks: int, text_bytes: int, dimension: int = EMBEDDING_DIMENSION) -> int:
+    """Rough on-disk size of the documents table plus its vector index"""
+    vector_bytes = 4 * dimension + 8
+    row_overhead = 24 + 48  # tuple header plus the fixed-width/metadata columns
+    heap = n_chunks * (row_overhead + vector_bytes) + text_bytes
+    ivfflat = n_chunks * (vector_bytes + 16)
+    return heap + ivfflat
+
+
+class StaleBatchError(Exception):
+    """Duplicates in a batch lost their canonical chunk before they were stored; classify the batch again"""
+
+
+class EmbeddingModelChanged(Exception):
+    """The active embedding model was switched (by another process) after a batch was embedded"""
+
+
 class DatabaseManager:
-    """Manages PostgreSQL database operations with pgvector"""
+    """Manages PostgreSQL database operations with pgvector
+
+    Each thread gets its own connection (opened on first use after
+    connect()), so work running on several threads, such as a GUI query
+    beside an indexing run, never interleaves statements on one cursor or
+    commits inside another thread's transaction.
+    """
 
     def __init__(self, config: Optional[Dict[str, Any]] = None):
         if config is None:
@@ -18,34 +169,107 @@ class DatabaseManager:
             config = cfg.database
 
         self.config = config
-        self.conn = None
-        self.cursor = None
+        self._local = threading.local()
+        # Every thread's connection, closed together by disconnect()
+        self._conns: List[Any] = []
+        self._conns_lock = threading.Lock()
+        self._connected = False
+        # Unfiltered searches fan out over course partitions on this many connections
+        self.search_workers = config.get('search_workers', 1)
+        # Partition swaps wait at most this long for their lock per attempt (see _swap_with_retry)
+        self.swap_lock_timeout_ms = config.get('swap_lock_timeout_ms', 2000)
+        self.swap_retries = config.get('swap_retries', 10)
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        # (course_code, content_type, file_name) -> (course_id, file_id)
+        self._file_ids: Dict[Tuple[str, str, str], Tuple[int, int]] = {}
+        self._course_ids: Dict[str, int] = {}
+        # Column and model of the embedding version queries and inserts use (set by init_schema)
+        self.embedding_column = 'embedding'
+        self.embedding_model: Optional[Dict[str, Any]] = None
+        # Called with the new embedding_model when a cutover made elsewhere is picked up
+        self.on_embedding_model_change: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    def _connect_params(self) -> Dict[str, Any]:
+        return {
+            'host': self.config['host'],
+            'port': self.config['port'],
+            'user': self.config['user'],
+            'password': self.config['password'],
+            'database': self.config['database']
+        }
 
     def connect(self) -> None:
         """Establish database connection"""
         try:
-            self.conn = psycopg2.connect(
-                host=self.config['host'],
-                port=self.config['port'],
-                user=self.config['user'],
-                password=self.config['password'],
-                database=self.config['database']
-            )
-            self.cursor = self.conn.cursor()
+            self._connected = True
+            self._thread_connection()
             print(f"✓ Connected to PostgreSQL database: {self.config['database']}")
         except Exception as e:
+            self._connected = False
             raise ConnectionError(f"Failed to connect to database: {e}")
 
+    def _thread_connection(self):
+        """The calling thread's connection, opened on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None and self._connected:
+            conn = psycopg2.connect(**self._connect_params())
+            self._local.conn = conn
+            self._local.cursor = conn.cursor()
+            # Pooled connections searching on this thread's behalf, so its canceller can reach them
+            self._local.busy = set()
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    @property
+    def conn(self):
+        return self._thread_connection()
+
+    @property
+    def cursor(self):
+        return self._local.cursor if self._thread_connection() is not None else None
+
+    def canceller(self) -> Callable[[], None]:
+        """A callback, safe to call from any thread, that aborts the statements the calling thread is running
+
+        Only this thread's connection (and pooled connections searching for
+        it) are interrupted; work on other threads carries on.
+        """
+        conn = self.conn
+        busy = self._local.busy
+
+        def cancel() -> None:
+            for c in [conn] + list(busy):
+                try:
+                    c.cancel()
+                except Exception:
+                    pass
+
+        return cancel
+
     def disconnect(self) -> None:
         """Close database connection"""
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
+        if self._pool:
+            self._pool.closeall()
+            self._pool = None
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+        self._connected = False
         print("✓ Database connection closed")
 
-    def init_schema(self) -> None:
-        """Initialize database schema with pgvector extension"""
+    def init_schema(self, default_embedding_model: str = 'embeddinggemma') -> None:
+        """Initialize database schema with pgvector extension
+
+        default_embedding_model names the model behind the original embedding
+        column when the embedding model registry is first created.
+        """
         try:
             # Enable pgvector extension
             try:
@@ -68,49 +292,165 @@ class DatabaseManager:
                     print("\n" + "="*60 + "\n")
                 raise Exception(f"pgvector extension not installed. {error_msg}")
 
-            # Create documents table
-            # Using vector(768) for embeddinggemma model
+            # Create courses table; document_count/unique_count are maintained by triggers
             self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS documents (
+                CREATE TABLE IF NOT EXISTS courses (
                     id SERIAL PRIMARY KEY,
-                    course_code VARCHAR(20) NOT NULL,
+                    course_code VARCHAR(20) UNIQUE NOT NULL,
                     course_name VARCHAR(200) NOT NULL,
+                    description TEXT,
+                    document_count INTEGER DEFAULT 0,
+                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                ALTER TABLE courses ADD COLUMN IF NOT EXISTS unique_count INTEGER NOT NULL DEFAULT 0;
+            """)
+
+            # One row per indexed file
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id SERIAL PRIMARY KEY,
+                    course_id INTEGER NOT NULL REFERENCES courses(id),
                     content_type VARCHAR(50) NOT NULL,
                     file_name VARCHAR(255) NOT NULL,
-                    chunk_text TEXT NOT NULL,
-                    chunk_index INTEGER NOT NULL,
-                    page_number INTEGER,
-                    embedding vector(768),
-                    metadata JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    unique_count INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (course_id, content_type, file_name)
                 );
             """)
 
-            # Create index for vector similarity search
+            # documents is LIST-partitioned by course; older databases hold a plain table
+            migrated = False
+            relkind = self._relkind('documents')
+            if relkind is None:
+                self._create_documents_table()
+            elif relkind != 'p':
+                # Columns added after the original schema
+                self.cursor.execute("""
+                    ALTER TABLE documents ADD COLUMN IF NOT EXISTS token_count INTEGER;
+                    ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+                    ALTER TABLE documents ADD COLUMN IF NOT EXISTS canonical_id INTEGER;
+                    ALTER TABLE documents ADD COLUMN IF NOT EXISTS minhash BYTEA;
+                """)
+                # Databases created before courses/files existed repeat the names on every row
+                if self._has_column('documents', 'course_code'):
+                    self._migrate_legacy_documents()
+                self._partition_documents()
+                migrated = True
+
+            # Indexes on the parent are created on every partition
+            self.cursor.execute("""
+                CREATE INDEX IF NOT EXISTS documents_content_hash_idx
+                ON documents (content_hash) WHERE canonical_id IS NULL;
+            """)
             self.cursor.execute("""
-                CREATE INDEX IF NOT EXISTS documents_embedding_idx
-                ON documents USING ivfflat (embedding vector_cosine_ops)
-                WITH (lists = 100);
+                CREATE INDEX IF NOT EXISTS documents_canonical_idx
+                ON documents (canonical_id) WHERE canonical_id IS NOT NULL;
             """)
 
-            # Create index for course lookups
+            # Neighbour-window lookups: every chunk of one file, by position
             self.cursor.execute("""
-                CREATE INDEX IF NOT EXISTS documents_course_idx
-                ON documents (course_code);
+                CREATE INDEX IF NOT EXISTS documents_file_chunk_idx
+                ON documents (file_id, chunk_index);
             """)
 
-            # Create courses table
+            # Vector indexes are per partition, sized to the course (see build_vector_index)
+
+            self._create_counter_triggers()
+            if migrated:
+                self._recount()
+                self.cursor.execute("SELECT id, unique_count FROM courses WHERE unique_count > 0")
+                for course_id, n_rows in self.cursor.fetchall():
+                    self._create_vector_index(partition_name(course_id), n_rows)
+
+            # Per-file indexing checkpoints, so a crashed run resumes where it stopped
             self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS courses (
+                CREATE TABLE IF NOT EXISTS index_checkpoints (
+                    course_code VARCHAR(20) NOT NULL,
+                    content_type VARCHAR(50) NOT NULL,
+                    file_name VARCHAR(255) NOT NULL,
+                    file_hash CHAR(64) NOT NULL,
+                    chunks_total INTEGER NOT NULL DEFAULT 0,
+                    chunks_done INTEGER NOT NULL DEFAULT 0,
+                    status VARCHAR(20) NOT NULL DEFAULT 'in_progress',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (course_code, content_type, file_name)
+                );
+            """)
+
+            # Blue/green re-index generations: one table per (course, generation); the
+            # active one is attached as the course's partition, retired ones allow rollback
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS index_generations (
                     id SERIAL PRIMARY KEY,
-                    course_code VARCHAR(20) UNIQUE NOT NULL,
-                    course_name VARCHAR(200) NOT NULL,
-                    description TEXT,
-                    document_count INTEGER DEFAULT 0,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    course_id INTEGER NOT NULL REFERENCES courses(id),
+                    table_name VARCHAR(63) NOT NULL,
+                    status VARCHAR(20) NOT NULL,
+                    chunks INTEGER,
+                    checkpoints JSONB,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    activated_at TIMESTAMP
+                );
+                ALTER TABLE index_generations ADD COLUMN IF NOT EXISTS file_counts JSONB;
+            """)
+
+            # Embedding model versions: each has its own vector column (and dimension)
+            # and per-partition index; exactly one is active for queries and inserts
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_models (
+                    id SERIAL PRIMARY KEY,
+                    model VARCHAR(200) UNIQUE NOT NULL,
+                    dimension INTEGER NOT NULL,
+                    column_name VARCHAR(63) NOT NULL,
+                    status VARCHAR(20) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    activated_at TIMESTAMP
+                );
+            """)
+            # Mean embedding of each course (file_id NULL) and of each file, per embedding
+            # version, used to route unfiltered queries to the courses most likely to answer them
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS centroids (
+                    course_id INTEGER NOT NULL REFERENCES courses(id),
+                    file_id INTEGER,
+                    column_name VARCHAR(63) NOT NULL,
+                    centroid vector NOT NULL,
+                    chunks INTEGER NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS centroids_column_idx ON centroids (column_name, course_id);
+            """)
+            # Centroids of detached generations, copied into centroids when one is swapped in
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS generation_centroids (
+                    generation_id INTEGER NOT NULL REFERENCES index_generations(id),
+                    course_id INTEGER NOT NULL,
+                    file_id INTEGER,
+                    column_name VARCHAR(63) NOT NULL,
+                    centroid vector NOT NULL,
+                    chunks INTEGER NOT NULL
                 );
+                CREATE INDEX IF NOT EXISTS generation_centroids_idx ON generation_centroids (generation_id);
             """)
 
+            self.cursor.execute("SELECT 1 FROM embedding_models LIMIT 1")
+            if self.cursor.fetchone() is None:
+                # The original embedding column becomes version 1
+                self.cursor.execute("""
+                    INSERT INTO embedding_models (id, model, dimension, column_name, status, activated_at)
+                    VALUES (1, %s, %s, 'embedding', 'active', CURRENT_TIMESTAMP);
+                    SELECT setval(pg_get_serial_sequence('embedding_models', 'id'), 1);
+                """, (default_embedding_model, EMBEDDING_DIMENSION))
+            self._load_active_embedding_model()
+
+            # Databases indexed before routing existed get their centroids once
+            self.cursor.execute(
+                "SELECT 1 FROM centroids WHERE column_name = %s LIMIT 1", (self.embedding_column,)
+            )
+            if self.cursor.fetchone() is None:
+                self.cursor.execute("SELECT id FROM courses WHERE unique_count > 0")
+                for (course_id,) in self.cursor.fetchall():
+                    self._refresh_centroids(course_id)
+
             self.conn.commit()
             print("✓ Database schema initialized successfully")
 
@@ -118,6 +458,404 @@ class DatabaseManager:
             self.conn.rollback()
             raise Exception(f"Failed to initialize schema: {e}")
 
+    def _relkind(self, table: str) -> Optional[str]:
+        """pg_class relkind of a table ('r' plain, 'p' partitioned), or None if it doesn't exist"""
+        self.cursor.execute("""
+            SELECT c.relkind FROM pg_class c
+            WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+        """, (table,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def _create_documents_table(self) -> None:
+        """Create the partitioned documents table (caller commits)"""
+        # Using vector(768) for embeddinggemma model
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS documents (
+                id SERIAL,
+                course_id INTEGER NOT NULL REFERENCES courses(id),
+                file_id INTEGER NOT NULL REFERENCES files(id),
+                chunk_text TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                page_number INTEGER,
+                embedding vector({EMBEDDING_DIMENSION}),
+                metadata JSONB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                token_count INTEGER,
+                content_hash CHAR(64),
+                canonical_id INTEGER,
+                minhash BYTEA,
+                PRIMARY KEY (course_id, id)
+            ) PARTITION BY LIST (course_id);
+        """)
+
+    def _ensure_partition(self, course_id: int) -> None:
+        """Create a course's documents partition if it doesn't exist (caller commits)"""
+        self.cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(course_id)} "
+            f"PARTITION OF documents FOR VALUES IN ({int(course_id)})"
+        )
+
+    def _partition_documents(self) -> None:
+        """Rebuild a plain documents table as one partition per course (caller commits)"""
+        print("Partitioning documents by course...")
+        self.cursor.execute("""
+            ALTER TABLE documents RENAME TO documents_unpartitioned;
+            ALTER INDEX IF EXISTS documents_pkey RENAME TO documents_unpartitioned_pkey;
+        """)
+        self._create_documents_table()
+
+        self.cursor.execute("SELECT id FROM courses")
+        for (course_id,) in self.cursor.fetchall():
+            self._ensure_partition(course_id)
+
+        self.cursor.execute("""
+            INSERT INTO documents
+            (id, course_id, file_id, chunk_text, chunk_index, page_number, embedding, metadata,
+             created_at, token_count, content_hash, canonical_id, minhash)
+            SELECT id, course_id, file_id, chunk_text, chunk_index, page_number, embedding, metadata,
+                   created_at, token_count, content_hash, canonical_id, minhash
+            FROM documents_unpartitioned;
+
+            DROP TABLE documents_unpartitioned;
+
+            SELECT setval(pg_get_serial_sequence('documents', 'id'),
+                          COALESCE((SELECT MAX(id) FROM documents), 0) + 1, false);
+        """)
+
+        # Duplicates referencing another course's canonical get a canonical of their own
+        # course (the lowest-id duplicate, with the embedding copied), so no course's
+        # rows depend on another partition
+        self.cursor.execute("""
+            WITH heirs AS (
+                SELECT DISTINCT ON (d.course_id, d.canonical_id)
+                    d.course_id, d.canonical_id AS old_id, d.id AS new_id
+                FROM documents d
+                JOIN documents c ON c.id = d.canonical_id
+                WHERE d.course_id <> c.course_id
+                ORDER BY d.course_id, d.canonical_id, d.id
+            )
+            UPDATE documents t SET
+                canonical_id = CASE WHEN t.id = heirs.new_id THEN NULL ELSE heirs.new_id END,
+                embedding = CASE WHEN t.id = heirs.new_id THEN c.embedding ELSE t.embedding END,
+                minhash = CASE WHEN t.id = heirs.new_id THEN c.minhash ELSE t.minhash END
+            FROM heirs JOIN documents c ON c.id = heirs.old_id
+            WHERE t.canonical_id = heirs.old_id AND t.course_id = heirs.course_id
+        """)
+        print("  ✓ Partitioned")
+
+    def _partition_table(self, course_id: int) -> Optional[str]:
+        """Name of the table currently attached as a course's partition"""
+        self.cursor.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'documents'::regclass
+              AND pg_get_expr(c.relpartbound, c.oid) = %s
+        """, (f"FOR VALUES IN ({int(course_id)})",))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def _create_vector_index(self, table: str, n_rows: int, column: Optional[str] = None) -> None:
+        """(Re)create one table's IVFFlat index with lists sized to n_rows (caller commits)
+
+        Indexes the active embedding column unless another version's column is given.
+        DROP INDEX locks the table against readers until the transaction ends, so this
+        is only for tables not serving queries (shadows, bulk loads); live partitions
+        use _replace_vector_index.
+        """
+        column = column or self.embedding_column
+        self.cursor.execute(f"DROP INDEX IF EXISTS {table}_{column}_idx")
+        if n_rows <= 0:
+            return
+        self.cursor.execute(f"""
+            CREATE INDEX {table}_{column}_idx
+            ON {table} USING ivfflat ({column} vector_cosine_ops)
+            WITH (lists = {ivfflat_lists(n_rows)})
+        """)
+
+    def _replace_vector_index(self, table: str, n_rows: int, column: Optional[str] = None) -> None:
+        """Rebuild a live partition's IVFFlat index without blocking its queries (commits)
+
+        The replacement is built with CREATE INDEX CONCURRENTLY under a temporary
+        name while queries keep using the old index, which is then dropped
+        concurrently and its name handed over. CONCURRENTLY cannot run in a
+        transaction block, so the connection autocommits for the duration.
+        """
+        column = column or self.embedding_column
+        name = f"{table}_{column}_idx"
+        self.conn.commit()
+        self.conn.autocommit = True
+        try:
+            # An interrupted rebuild leaves an invalid index behind
+            self.cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}_new")
+            if n_rows > 0:
+                self.cursor.execute(f"""
+                    CREATE INDEX CONCURRENTLY {name}_new
+                    ON {table} USING ivfflat ({column} vector_cosine_ops)
+                    WITH (lists = {ivfflat_lists(n_rows)})
+                """)
+            self.cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            if n_rows > 0:
+                self.cursor.execute(f"ALTER INDEX {name}_new RENAME TO {name}")
+        finally:
+            self.conn.autocommit = False
+
+    def build_vector_index(self, course_code: str) -> None:
+        """Rebuild a course partition's vector index after its contents changed; queries keep running"""
+        course_id = self._course_id(course_code)
+        if course_id is None:
+            return
+        try:
+            self.cursor.execute("SELECT unique_count FROM courses WHERE id = %s", (course_id,))
+            n_rows = self.cursor.fetchone()[0]
+            self._replace_vector_index(self._partition_table(course_id), n_rows)
+            self._refresh_centroids(course_id)
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to build vector index for {course_code}: {e}")
+
+    def _refresh_centroids(self, course_id: int, column: Optional[str] = None) -> None:
+        """Recompute a course's and its files' centroids from its partition (caller commits)"""
+        column = column or self.embedding_column
+        self.cursor.execute(
+            "DELETE FROM centroids WHERE course_id = %s AND column_name = %s", (course_id, column)
+        )
+        # One scan of the partition yields the course row (file_id NULL) and one row per file
+        self.cursor.execute(f"""
+            INSERT INTO centroids (course_id, file_id, column_name, centroid, chunks)
+            SELECT course_id, file_id, %s, AVG({column}), COUNT(*)
+            FROM documents
+            WHERE course_id = {int(course_id)} AND {column} IS NOT NULL
+            GROUP BY GROUPING SETS ((course_id), (course_id, file_id))
+        """, (column,))
+
+    def refresh_centroids(self, course_code: Optional[str] = None) -> None:
+        """Recompute one course's (or every course's) centroids for the active embedding version"""
+        try:
+            if course_code:
+                course_ids = [self._course_id(course_code)]
+            else:
+                self.cursor.execute("SELECT id FROM courses")
+                course_ids = [r[0] for r in self.cursor.fetchall()]
+            for course_id in course_ids:
+                if course_id is not None:
+                    self._refresh_centroids(course_id)
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to refresh centroids: {e}")
+
+    def get_course_centroids(self) -> List[Tuple[str, int, np.ndarray]]:
+        """(course_code, chunks, centroid) of every course with vectors in the active embedding version"""
+        try:
+            self.cursor.execute("""
+                SELECT c.course_code, ce.chunks, ce.centroid
+                FROM centroids ce
+                JOIN courses c ON c.id = ce.course_id
+                WHERE ce.column_name = %s AND ce.file_id IS NULL AND c.unique_count > 0
+                ORDER BY c.course_code
+            """, (self.embedding_column,))
+            rows = self.cursor.fetchall()
+            self.conn.commit()
+            return [(r[0], r[1], parse_vector(r[2])) for r in rows]
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to load course centroids: {e}")
+
+    def truncate_course(self, course_code: str) -> None:
+        """Empty a course's partition (no row-by-row DELETE) and forget its checkpoints"""
+        try:
+            course_id = self._course_id(course_code)
+            if course_id is not None:
+                # TRUNCATE skips the counter triggers
+                self.cursor.execute(f"TRUNCATE {self._partition_table(course_id)}")
+                self.cursor.execute(
+                    "UPDATE files SET chunk_count = 0, unique_count = 0 WHERE course_id = %s", (course_id,)
+                )
+                self.cursor.execute("""
+                    UPDATE courses SET document_count = 0, unique_count = 0, last_updated = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (course_id,))
+                self.cursor.execute("DELETE FROM centroids WHERE course_id = %s", (course_id,))
+            self.cursor.execute("DELETE FROM index_checkpoints WHERE course_code = %s", (course_code,))
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to truncate course {course_code}: {e}")
+
+    def _course_id(self, course_code: str) -> Optional[int]:
+        if course_code not in self._course_ids:
+            self.cursor.execute("SELECT id FROM courses WHERE course_code = %s", (course_code,))
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            self._course_ids[course_code] = row[0]
+        return self._course_ids[course_code]
+
+    def _has_column(self, table: str, column: str) -> bool:
+        self.cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+        """, (table, column))
+        return self.cursor.fetchone() is not None
+
+    def _migrate_legacy_documents(self) -> None:
+        """Move course/file names out of documents into courses/files (caller commits)"""
+        print("Migrating documents to the courses/files schema...")
+        self.cursor.execute("""
+            INSERT INTO courses (course_code, course_name)
+            SELECT DISTINCT ON (course_code) course_code, course_name
+            FROM documents
+            ORDER BY course_code, id DESC
+            ON CONFLICT (course_code) DO UPDATE SET course_name = EXCLUDED.course_name;
+
+            INSERT INTO files (course_id, content_type, file_name)
+            SELECT DISTINCT c.id, d.content_type, d.file_name
+            FROM documents d JOIN courses c ON c.course_code = d.course_code
+            ON CONFLICT (course_id, content_type, file_name) DO NOTHING;
+
+            ALTER TABLE documents
+                ADD COLUMN IF NOT EXISTS course_id INTEGER,
+                ADD COLUMN IF NOT EXISTS file_id INTEGER;
+
+            UPDATE documents d SET course_id = f.course_id, file_id = f.id
+            FROM files f JOIN courses c ON c.id = f.course_id
+            WHERE c.course_code = d.course_code
+              AND f.content_type = d.content_type
+              AND f.file_name = d.file_name;
+
+            ALTER TABLE documents
+                ALTER COLUMN course_id SET NOT NULL,
+                ALTER COLUMN file_id SET NOT NULL,
+                ADD CONSTRAINT documents_course_id_fkey FOREIGN KEY (course_id) REFERENCES courses(id),
+                ADD CONSTRAINT documents_file_id_fkey FOREIGN KEY (file_id) REFERENCES files(id),
+                DROP COLUMN course_code,
+                DROP COLUMN course_name,
+                DROP COLUMN content_type,
+                DROP COLUMN file_name;
+        """)
+        print("  ✓ Migrated (run VACUUM FULL documents to reclaim the space of the dropped columns)")
+
+    def _create_counter_triggers(self) -> None:
+        """Keep files/courses counters in step with every insert, delete and update of documents"""
+        for op, delta in _COUNT_DELTAS.items():
+            self.cursor.execute(COUNTER_FUNCTION_SQL.format(op=op, delta=delta))
+            self.cursor.execute(f"""
+                DROP TRIGGER IF EXISTS documents_count_{op} ON documents;
+                CREATE TRIGGER documents_count_{op}
+                    AFTER {op.upper()} ON documents
+                    {COUNTER_TRIGGER_REFERENCING[op]}
+                    FOR EACH STATEMENT EXECUTE FUNCTION documents_count_{op}();
+            """)
+
+    def _recount(self, course_id: Optional[int] = None) -> None:
+        """Recompute file and course counters from documents, for one course or all (caller commits)"""
+        # With a course_id the scan is pruned to that course's partition
+        course_filter = "" if course_id is None else f"AND course_id = {int(course_id)}"
+        file_filter = "" if course_id is None else f"AND f.course_id = {int(course_id)}"
+        self.cursor.execute(f"""
+            UPDATE files SET
+                chunk_count = COALESCE(s.n, 0),
+                unique_count = COALESCE(s.u, 0)
+            FROM files f
+            LEFT JOIN (
+                SELECT file_id, COUNT(*) AS n, COUNT(*) FILTER (WHERE canonical_id IS NULL) AS u
+                FROM documents WHERE TRUE {course_filter} GROUP BY file_id
+            ) s ON s.file_id = f.id
+            WHERE files.id = f.id {file_filter};
+
+            UPDATE courses SET
+                document_count = COALESCE(s.n, 0),
+                unique_count = COALESCE(s.u, 0),
+                last_updated = CURRENT_TIMESTAMP
+            FROM courses c
+            LEFT JOIN (
+                SELECT course_id, SUM(chunk_count) AS n, SUM(unique_count) AS u
+                FROM files GROUP BY course_id
+            ) s ON s.course_id = c.id
+            WHERE courses.id = c.id {file_filter.replace('f.course_id', 'c.id')};
+        """)
+
+    def refresh_counters(self) -> None:
+        """Rebuild the maintained course/file counters with a full scan"""
+        try:
+            self._recount()
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to refresh counters: {e}")
+
+    def ensure_file(
+        self,
+        course_code: str,
+        course_name: str,
+        content_type: str,
+        file_name: str
+    ) -> Tuple[int, int]:
+        """(course_id, file_id) for a file, creating its course and file rows on first use"""
+        key = (course_code, content_type, file_name)
+        if key in self._file_ids:
+            return self._file_ids[key]
+
+        course_id = self.ensure_course(course_code, course_name)
+        try:
+            self.cursor.execute("""
+                INSERT INTO files (course_id, content_type, file_name) VALUES (%s, %s, %s)
+                ON CONFLICT (course_id, content_type, file_name) DO UPDATE SET file_name = EXCLUDED.file_name
+                RETURNING id
+            """, (course_id, content_type, file_name))
+            file_id = self.cursor.fetchone()[0]
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to register file {file_name}: {e}")
+
+        self._file_ids[key] = (course_id, file_id)
+        return course_id, file_id
+
+    def ensure_course(self, course_code: str, course_name: str) -> int:
+        """course_id for a course, creating its row and partition on first use"""
+        if course_code in self._course_ids:
+            return self._course_ids[course_code]
+
+        try:
+            self.cursor.execute("""
+                INSERT INTO courses (course_code, course_name) VALUES (%s, %s)
+                ON CONFLICT (course_code) DO UPDATE SET course_name = EXCLUDED.course_name
+                RETURNING id
+            """, (course_code, course_name))
+            course_id = self.cursor.fetchone()[0]
+            if self._partition_table(course_id) is None:
+                self._ensure_partition(course_id)
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to register course {course_code}: {e}")
+
+        self._course_ids[course_code] = course_id
+        return course_id
+
+    def _lookup_file(self, course_code: str, content_type: str, file_name: str) -> Optional[int]:
+        """file_id of an already registered file, or None"""
+        key = (course_code, content_type, file_name)
+        if key in self._file_ids:
+            return self._file_ids[key][1]
+
+        self.cursor.execute("""
+            SELECT f.id FROM files f JOIN courses c ON c.id = f.course_id
+            WHERE c.course_code = %s AND f.content_type = %s AND f.file_name = %s
+        """, key)
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
     def insert_document(
         self,
         course_code: str,
@@ -128,151 +866,1513 @@ class DatabaseManager:
         chunk_index: int,
         embedding: np.ndarray,
         page_number: Optional[int] = None,
-        metadata: Optional[Dict] = None
+        metadata: Optional[Dict] = None,
+        token_count: Optional[int] = None
     ) -> int:
         """Insert a document chunk with its embedding"""
+        course_id, file_id = self.ensure_file(course_code, course_name, content_type, file_name)
+
         try:
             embedding_list = embedding.tolist() if isinstance(embedding, np.ndarray) else embedding
 
-            self.cursor.execute("""
+            self.cursor.execute(f"""
                 INSERT INTO documents
-                (course_code, course_name, content_type, file_name, chunk_text,
-                 chunk_index, page_number, embedding, metadata)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                (course_id, file_id, chunk_text, chunk_index, page_number,
+                 {self.embedding_column}, metadata, token_count)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING id;
             """, (
-                course_code, course_name, content_type, file_name, chunk_text,
-                chunk_index, page_number, embedding_list, metadata
+                course_id, file_id, chunk_text, chunk_index, page_number,
+                embedding_list, metadata, token_count
             ))
 
             doc_id = self.cursor.fetchone()[0]
+            self._check_embedding_model()
             self.conn.commit()
             return doc_id
 
+        except EmbeddingModelChanged:
+            self.conn.rollback()
+            self.reload_embedding_model()
+            raise
         except Exception as e:
             self.conn.rollback()
             raise Exception(f"Failed to insert document: {e}")
 
     def insert_documents_batch(self, documents: List[Tuple]) -> None:
-        """Insert multiple documents efficiently"""
+        """Insert multiple documents efficiently (rows in DOCUMENT_INSERT_COLUMNS order)"""
         try:
             execute_values(
                 self.cursor,
-                """
-                INSERT INTO documents
-                (course_code, course_name, content_type, file_name, chunk_text,
-                 chunk_index, page_number, embedding, metadata)
-                VALUES %s
-                """,
+                f"INSERT INTO documents {self._insert_columns()} VALUES %s",
                 documents,
-                template="(%s, %s, %s, %s, %s, %s, %s, %s, %s)"
+                template=DOCUMENT_INSERT_TEMPLATE
             )
+            self._check_embedding_model()
             self.conn.commit()
             print(f"✓ Inserted {len(documents)} document chunks")
 
+        except EmbeddingModelChanged:
+            self.conn.rollback()
+            self.reload_embedding_model()
+            raise
         except Exception as e:
             self.conn.rollback()
             raise Exception(f"Failed to batch insert documents: {e}")
 
-    def similarity_search(
+    def get_checkpoint(
         self,
-        query_embedding: np.ndarray,
-        top_k: int = 5,
-        course_code: Optional[str] = None,
-        similarity_threshold: float = 0.0
-    ) -> List[Dict[str, Any]]:
-        """Search for similar documents using cosine similarity"""
+        course_code: str,
+        content_type: str,
+        file_name: str
+    ) -> Optional[Dict[str, Any]]:
+        """Get the indexing checkpoint for a file, if any"""
         try:
-            embedding_list = query_embedding.tolist() if isinstance(query_embedding, np.ndarray) else query_embedding
-
-            query = """
-                SELECT
-                    id, course_code, course_name, content_type, file_name,
-                    chunk_text, chunk_index, page_number, metadata,
-                    1 - (embedding <=> %s::vector) as similarity
-                FROM documents
-                WHERE 1 - (embedding <=> %s::vector) > %s
-            """
-            params = [embedding_list, embedding_list, similarity_threshold]
-
-            if course_code:
-                query += " AND course_code = %s"
-                params.append(course_code)
-
-            query += " ORDER BY embedding <=> %s::vector LIMIT %s;"
-            params.extend([embedding_list, top_k])
+            self.cursor.execute("""
+                SELECT file_hash, chunks_total, chunks_done, status
+                FROM index_checkpoints
+                WHERE course_code = %s AND content_type = %s AND file_name = %s
+            """, (course_code, content_type, file_name))
 
-            self.cursor.execute(query, params)
-            results = self.cursor.fetchall()
+            row = self.cursor.fetchone()
+            self.conn.commit()
+            if row is None:
+                return None
 
-            return [
-                {
-                    'id': r[0],
-                    'course_code': r[1],
-                    'course_name': r[2],
-                    'content_type': r[3],
-                    'file_name': r[4],
-                    'text': r[5],
-                    'chunk_index': r[6],
-                    'page_number': r[7],
-                    'metadata': r[8],
-                    'similarity': float(r[9])
-                }
-                for r in results
-            ]
+            return {
+                'file_hash': row[0].strip(),
+                'chunks_total': row[1],
+                'chunks_done': row[2],
+                'status': row[3]
+            }
 
         except Exception as e:
-            raise Exception(f"Similarity search failed: {e}")
+            self.conn.rollback()
+            raise Exception(f"Failed to get checkpoint: {e}")
 
-    def get_document_count(self, course_code: Optional[str] = None) -> int:
-        """Get total document count, optionally filtered by course"""
+    def reset_file(
+        self,
+        course_code: str,
+        content_type: str,
+        file_name: str,
+        file_hash: str,
+        chunks_total: int
+    ) -> None:
+        """Drop any rows indexed for a file and start a fresh checkpoint for it"""
         try:
-            if course_code:
-                self.cursor.execute(
-                    "SELECT COUNT(*) FROM documents WHERE course_code = %s",
-                    (course_code,)
-                )
-            else:
-                self.cursor.execute("SELECT COUNT(*) FROM documents")
-
-            return self.cursor.fetchone()[0]
+            file_id = self._lookup_file(course_code, content_type, file_name)
+            if file_id is not None:
+                self._delete_file_rows(file_id)
+            self._upsert_checkpoint(course_code, content_type, file_name, file_hash, chunks_total, 0)
+            self.conn.commit()
 
         except Exception as e:
-            raise Exception(f"Failed to get document count: {e}")
+            self.conn.rollback()
+            raise Exception(f"Failed to reset file {file_name}: {e}")
 
-    def get_all_courses(self) -> List[Dict[str, Any]]:
-        """Get all courses with document counts"""
+    def retire_file(self, course_code: str, content_type: str, file_name: str) -> int:
+        """Remove a deleted file's chunks and checkpoint; returns the number of chunks removed"""
         try:
+            removed = 0
+            file_id = self._lookup_file(course_code, content_type, file_name)
+            if file_id is not None:
+                self.cursor.execute("SELECT chunk_count FROM files WHERE id = %s", (file_id,))
+                removed = self.cursor.fetchone()[0]
+                self._delete_file_rows(file_id)
+                self.cursor.execute("DELETE FROM centroids WHERE file_id = %s", (file_id,))
             self.cursor.execute("""
-                SELECT course_code, course_name, COUNT(*) as doc_count
-                FROM documents
-                GROUP BY course_code, course_name
-                ORDER BY course_code
-            """)
+                DELETE FROM index_checkpoints
+                WHERE course_code = %s AND content_type = %s AND file_name = %s
+            """, (course_code, content_type, file_name))
+            self.conn.commit()
+            return removed
 
-            results = self.cursor.fetchall()
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to retire file {file_name}: {e}")
+
+    def list_checkpoints(self, course_code: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Every file with an indexing checkpoint, optionally for one course"""
+        try:
+            query = "SELECT course_code, content_type, file_name, status FROM index_checkpoints"
+            params: Tuple = ()
+            if course_code:
+                query += " WHERE course_code = %s"
+                params = (course_code,)
+            self.cursor.execute(query + " ORDER BY course_code, content_type, file_name", params)
+            rows = self.cursor.fetchall()
+            self.conn.commit()
             return [
-                {
-                    'course_code': r[0],
-                    'course_name': r[1],
-                    'document_count': r[2]
-                }
-                for r in results
+                {'course_code': r[0], 'content_type': r[1], 'file_name': r[2], 'status': r[3]}
+                for r in rows
             ]
 
         except Exception as e:
-            raise Exception(f"Failed to get courses: {e}")
+            self.conn.rollback()
+            raise Exception(f"Failed to list checkpoints: {e}")
 
-    def clear_all_documents(self) -> None:
-        """Clear all documents from the database"""
+    def _delete_file_rows(self, file_id: int) -> None:
+        """Delete a file's rows, first promoting an outside duplicate of each canonical chunk (caller commits)"""
+        # For every canonical chunk in this file that other files still reference, hand its
+        # embedding to the lowest-id referencing row and repoint the remaining references to it
+        # Only the active version is handed over; a migration in progress re-embeds the heir
+        column = self.embedding_column
+        self.cursor.execute(f"""
+            WITH doomed AS (
+                SELECT id, {column} AS embedding, minhash FROM documents
+                WHERE file_id = %s AND canonical_id IS NULL
+            ),
+            heirs AS (
+                SELECT DISTINCT ON (d.canonical_id) d.canonical_id AS old_id, d.id AS new_id
+                FROM documents d
+                JOIN doomed ON d.canonical_id = doomed.id
+                WHERE d.file_id <> %s
+                ORDER BY d.canonical_id, d.id
+            )
+            UPDATE documents t SET
+                canonical_id = CASE WHEN t.id = heirs.new_id THEN NULL ELSE heirs.new_id END,
+                {column} = CASE WHEN t.id = heirs.new_id THEN doomed.embedding ELSE t.{column} END,
+                minhash = CASE WHEN t.id = heirs.new_id THEN doomed.minhash ELSE t.minhash END
+            FROM heirs JOIN doomed ON doomed.id = heirs.old_id
+            WHERE t.canonical_id = heirs.old_id
+              AND t.file_id <> %s
+        """, (file_id, file_id, file_id))
+
+        self.cursor.execute("DELETE FROM documents WHERE file_id = %s", (file_id,))
+
+    def find_canonical_hashes(self, hashes: List[str], generation: Optional[Dict[str, Any]] = None) -> set:
+        """Which of the given content hashes already have an embedded canonical chunk
+
+        For a shadow generation, the course's live rows are about to be replaced,
+        so its canonicals come from the shadow table and the other courses.
+        """
+        if not hashes:
+            return set()
         try:
-            self.cursor.execute("DELETE FROM documents")
+            source = self._canonical_source(generation) if generation else 'documents'
+            self.cursor.execute(f"""
+                SELECT DISTINCT content_hash FROM {source} k
+                WHERE content_hash = ANY(%s) AND canonical_id IS NULL AND {self.embedding_column} IS NOT NULL
+            """, (list(hashes),))
+            found = {r[0] for r in self.cursor.fetchall()}
             self.conn.commit()
-            print("✓ All documents cleared")
+            return found
 
         except Exception as e:
             self.conn.rollback()
-            raise Exception(f"Failed to clear documents: {e}")
+            raise Exception(f"Failed to look up content hashes: {e}")
+
+    def iter_minhash_signatures(self, batch_size: int = 10000, exclude_courses: Optional[List[str]] = None):
+        """Yield (content_hash, signature bytes) for canonical chunks, streamed with a server-side cursor"""
+        try:
+            exclude_ids = [i for i in (self._course_id(c) for c in exclude_courses or []) if i is not None]
+            with self.conn.cursor(name='minhash_scan') as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(f"""
+                    SELECT content_hash, minhash FROM documents
+                    WHERE canonical_id IS NULL AND minhash IS NOT NULL AND {self.embedding_column} IS NOT NULL
+                      AND course_id <> ALL(%s)
+                """, (exclude_ids,))
+                for content_hash, minhash in cursor:
+                    yield content_hash, bytes(minhash)
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to load MinHash signatures: {e}")
+
+    def get_dedup_stats(self) -> Dict[str, int]:
+        """Counts of stored chunk locations vs unique embedded chunks (from the maintained counters)"""
+        try:
+            self.cursor.execute("""
+                SELECT COALESCE(SUM(document_count), 0), COALESCE(SUM(unique_count), 0)
+                FROM courses
+            """)
+            total, unique = self.cursor.fetchone()
+            self.conn.commit()
+            return {
+                'total_chunks': int(total),
+                'unique_chunks': int(unique),
+                'duplicate_chunks': int(total - unique)
+            }
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to get dedup stats: {e}")
+
+    def cross_course_report(self) -> Dict[str, Any]:
+        """Embedded chunks whose content is also a canonical chunk of another course
+
+        Dedup is per course partition, so each copy beyond the first still
+        takes a vector and an index entry (extra_vectors). This scans every
+        canonical chunk, so it is a report, not part of the statistics.
+        """
+        try:
+            self.cursor.execute("""
+                SELECT c.course_code, COUNT(*)
+                FROM documents d JOIN courses c ON c.id = d.course_id
+                WHERE d.canonical_id IS NULL AND d.content_hash IS NOT NULL
+                  AND EXISTS (
+                      SELECT 1 FROM documents o
+                      WHERE o.content_hash = d.content_hash AND o.canonical_id IS NULL
+                        AND o.course_id <> d.course_id
+                  )
+                GROUP BY c.course_code
+                ORDER BY c.course_code
+            """)
+            courses = [{'course_code': r[0], 'shared_chunks': r[1]} for r in self.cursor.fetchall()]
+            self.cursor.execute("""
+                SELECT COALESCE(SUM(n - 1), 0) FROM (
+                    SELECT COUNT(*) AS n FROM documents
+                    WHERE canonical_id IS NULL AND content_hash IS NOT NULL
+                    GROUP BY content_hash HAVING COUNT(*) > 1
+                ) shared
+            """)
+            extra = self.cursor.fetchone()[0]
+            self.conn.commit()
+            return {'courses': courses, 'extra_vectors': int(extra)}
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to build cross-course report: {e}")
+
+    def insert_documents_checkpointed(
+        self,
+        documents: List[Tuple],
+        course_code: str,
+        content_type: str,
+        file_name: str,
+        file_hash: str,
+        chunks_done: int,
+        chunks_total: int,
+        duplicates: Optional[List[Tuple]] = None
+    ) -> None:
+        """Insert a batch of chunks and advance the file checkpoint in one transaction
+
+        duplicates are rows without an embedding whose last element is the content hash
+        of their canonical chunk (in the database already or among documents).
+        """
+        try:
+            if documents:
+                execute_values(
+                    self.cursor,
+                    f"INSERT INTO documents {self._insert_columns()} VALUES %s",
+                    documents,
+                    template=DOCUMENT_INSERT_TEMPLATE
+                )
+
+            if duplicates:
+                self._insert_duplicates('documents', 'documents', duplicates)
+
+            if documents or duplicates:
+                self._check_embedding_model()
+            self._upsert_checkpoint(course_code, content_type, file_name, file_hash, chunks_total, chunks_done)
+            self.conn.commit()
+
+        except StaleBatchError:
+            self.conn.rollback()
+            raise
+        except EmbeddingModelChanged:
+            self.conn.rollback()
+            self.reload_embedding_model()
+            raise
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to insert batch for {file_name}: {e}")
+
+    def _insert_duplicates(self, target: str, canonicals: str, duplicates: List[Tuple]) -> None:
+        """Insert duplicate rows pointing at their canonicals; raise StaleBatchError if any was left out (caller rolls back)
+
+        Otherwise a chunk whose canonical disappeared between classification
+        and insert would be dropped while its file checkpoint advanced.
+        """
+        stored = execute_values(
+            self.cursor,
+            DUPLICATE_INSERT_SQL.format(target=target, canonicals=canonicals, embedding=self.embedding_column),
+            duplicates,
+            template=DUPLICATE_INSERT_TEMPLATE,
+            fetch=True
+        )
+        if len(stored) != len(duplicates):
+            raise StaleBatchError(
+                f"{len(duplicates) - len(stored)} duplicate chunk(s) no longer have an embedded canonical"
+            )
+
+    def _upsert_checkpoint(
+        self,
+        course_code: str,
+        content_type: str,
+        file_name: str,
+        file_hash: str,
+        chunks_total: int,
+        chunks_done: int
+    ) -> None:
+        """Write a checkpoint row (caller commits)"""
+        status = 'complete' if chunks_done >= chunks_total else 'in_progress'
+        self.cursor.execute("""
+            INSERT INTO index_checkpoints
+            (course_code, content_type, file_name, file_hash, chunks_total, chunks_done, status, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (course_code, content_type, file_name) DO UPDATE SET
+                file_hash = EXCLUDED.file_hash,
+                chunks_total = EXCLUDED.chunks_total,
+                chunks_done = EXCLUDED.chunks_done,
+                status = EXCLUDED.status,
+                updated_at = CURRENT_TIMESTAMP
+        """, (course_code, content_type, file_name, file_hash, chunks_total, chunks_done, status))
+
+    def clear_checkpoints(self, course_code: Optional[str] = None) -> None:
+        """Forget indexing checkpoints so the next run re-processes every file"""
+        try:
+            if course_code:
+                self.cursor.execute("DELETE FROM index_checkpoints WHERE course_code = %s", (course_code,))
+            else:
+                self.cursor.execute("DELETE FROM index_checkpoints")
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to clear checkpoints: {e}")
+
+    def similarity_search(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 5,
+        course_code: Optional[str] = None,
+        similarity_threshold: float = 0.0,
+        include_embeddings: bool = False,
+        course_codes: Optional[List[str]] = None,
+        top_files: int = 0
+    ) -> List[Dict[str, Any]]:
+        """Search for similar documents using cosine similarity
+
+        A course filter prunes the search to that course's partition, and a
+        list of course_codes (routed queries) to those partitions. Without
+        either, partitions are searched concurrently (search_workers > 1) and
+        the per-course top_k lists merged.
+
+        With top_files > 0 the search is hierarchical: the top_files files
+        whose centroids are nearest the query are found first, and only their
+        chunks are compared (falling back to the flat search when no file
+        centroids exist for the filter).
+        """
+        try:
+            embedding_list = query_embedding.tolist() if isinstance(query_embedding, np.ndarray) else query_embedding
+            args = (embedding_list, top_k, similarity_threshold, include_embeddings)
+
+            file_ids = None
+            if top_files > 0:
+                scope = [course_code] if course_code else course_codes
+                file_ids = self._nearest_files(
+                    embedding_list, top_files,
+                    [i for i in map(self._course_id, scope) if i is not None] if scope else None
+                )
+
+            if file_ids:
+                rows = self._knn(self.cursor, *args, file_ids=file_ids, column=self.embedding_column)
+            elif course_code:
+                course_id = self._course_id(course_code)
+                rows = (
+                    self._knn(self.cursor, *args, course_id=course_id, column=self.embedding_column)
+                    if course_id is not None else []
+                )
+            elif course_codes:
+                course_ids = [i for i in map(self._course_id, course_codes) if i is not None]
+                if self.search_workers > 1 and len(course_ids) > 1:
+                    rows = self._knn_fan_out(args, course_ids)
+                else:
+                    rows = [
+                        row for course_id in course_ids
+                        for row in self._knn(self.cursor, *args, course_id=course_id, column=self.embedding_column)
+                    ]
+                    rows.sort(key=lambda r: -r[9])
+                    rows = rows[:top_k]
+            else:
+                self.cursor.execute("SELECT id FROM courses WHERE unique_count > 0")
+                course_ids = [r[0] for r in self.cursor.fetchall()]
+                if self.search_workers > 1 and len(course_ids) > 1:
+                    rows = self._knn_fan_out(args, course_ids)
+                else:
+                    rows = self._knn(self.cursor, *args, column=self.embedding_column)
+
+            results = [
+                {
+                    'id': r[0],
+                    'course_code': r[1],
+                    'course_name': r[2],
+                    'content_type': r[3],
+                    'file_name': r[4],
+                    'text': r[5],
+                    'chunk_index': r[6],
+                    'page_number': r[7],
+                    'metadata': r[8],
+                    'similarity': float(r[9]),
+                    'embedding': parse_vector(r[10]),
+                    'file_id': r[11]
+                }
+                for r in rows
+            ]
+
+            self._attach_locations(results, course_code)
+            # Ending the read transaction releases its partition locks, which would otherwise
+            # hold up partition swaps and index rebuilds while this connection sits idle
+            self.conn.commit()
+            return results
+
+        except Exception as e:
+            # A cancelled or failed statement leaves the transaction aborted
+            self.conn.rollback()
+            raise Exception(f"Similarity search failed: {e}")
+
+    @staticmethod
+    def _knn(
+        cursor,
+        embedding_list: List[float],
+        top_k: int,
+        similarity_threshold: float,
+        include_embeddings: bool,
+        course_id: Optional[int] = None,
+        column: str = 'embedding',
+        file_ids: Optional[List[int]] = None
+    ) -> List[Tuple]:
+        """Nearest canonical rows by one embedding version's column, joined to their names after the LIMIT"""
+        # Only canonical rows carry embeddings. course_id is bound as a literal
+        # so the planner prunes to a single partition.
+        inner = f"""
+            SELECT
+                id, course_id, file_id, chunk_text, chunk_index, page_number, metadata,
+                {column} <=> %s::vector AS distance,
+                {column if include_embeddings else 'NULL'} AS embedding
+            FROM documents
+            WHERE {column} IS NOT NULL
+              AND 1 - ({column} <=> %s::vector) > %s
+        """
+        params = [embedding_list, embedding_list, similarity_threshold]
+
+        if course_id is not None:
+            inner += " AND course_id = %s"
+            params.append(course_id)
+        if file_ids is not None:
+            # Few files: an exact scan of their chunks via the file_id index
+            inner += " AND file_id = ANY(%s)"
+            params.append(file_ids)
+
+        inner += f" ORDER BY {column} <=> %s::vector LIMIT %s"
+        params.extend([embedding_list, top_k])
+
+        cursor.execute(f"""
+            SELECT
+                d.id, c.course_code, c.course_name, f.content_type, f.file_name,
+                d.chunk_text, d.chunk_index, d.page_number, d.metadata,
+                1 - d.distance AS similarity, d.embedding, d.file_id
+            FROM ({inner}) d
+            JOIN files f ON f.id = d.file_id
+            JOIN courses c ON c.id = d.course_id
+            ORDER BY d.distance;
+        """, params)
+        return cursor.fetchall()
+
+    def _nearest_files(
+        self,
+        embedding_list: List[float],
+        top_files: int,
+        course_ids: Optional[List[int]] = None
+    ) -> List[int]:
+        """Ids of the files whose centroids are most similar to the query, optionally within courses"""
+        query = """
+            SELECT file_id FROM centroids
+            WHERE column_name = %s AND file_id IS NOT NULL
+        """
+        params: List[Any] = [self.embedding_column]
+        if course_ids is not None:
+            query += " AND course_id = ANY(%s)"
+            params.append(course_ids)
+        query += " ORDER BY centroid <=> %s::vector LIMIT %s"
+        params.extend([embedding_list, top_files])
+
+        self.cursor.execute(query, params)
+        return [r[0] for r in self.cursor.fetchall()]
+
+    def _knn_fan_out(self, args: Tuple, course_ids: List[int]) -> List[Tuple]:
+        """Search each course partition on its own pooled connection and merge the top_k"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(1, self.search_workers, **self._connect_params())
+        busy = self._local.busy
+
+        def search(course_id: int) -> List[Tuple]:
+            conn = self._pool.getconn()
+            busy.add(conn)
+            try:
+                with conn.cursor() as cursor:
+                    return self._knn(cursor, *args, course_id=course_id, column=self.embedding_column)
+            finally:
+                busy.discard(conn)
+                conn.rollback()
+                self._pool.putconn(conn)
+
+        with ThreadPoolExecutor(max_workers=min(self.search_workers, len(course_ids))) as executor:
+            per_course = list(executor.map(search, course_ids))
+
+        top_k = args[1]
+        merged = [row for rows in per_course for row in rows]
+        merged.sort(key=lambda r: -r[9])
+        return merged[:top_k]
+
+    def _attach_locations(self, results: List[Dict[str, Any]], course_code: Optional[str]) -> None:
+        """Add every course/file/page a deduplicated chunk appears at, citing the filtered course first"""
+        for result in results:
+            result['locations'] = [{
+                key: result[key]
+                for key in ('course_code', 'course_name', 'content_type', 'file_name',
+                            'file_id', 'chunk_index', 'page_number')
+            }]
+
+        if not results:
+            return
+
+        by_id = {r['id']: r for r in results}
+        self.cursor.execute("""
+            SELECT d.canonical_id, c.course_code, c.course_name, f.content_type, f.file_name,
+                   d.file_id, d.chunk_index, d.page_number
+            FROM documents d
+            JOIN files f ON f.id = d.file_id
+            JOIN courses c ON c.id = d.course_id
+            WHERE d.canonical_id = ANY(%s)
+            ORDER BY d.canonical_id, d.id
+        """, (list(by_id),))
+
+        for row in self.cursor.fetchall():
+            by_id[row[0]]['locations'].append({
+                'course_code': row[1],
+                'course_name': row[2],
+                'content_type': row[3],
+                'file_name': row[4],
+                'file_id': row[5],
+                'chunk_index': row[6],
+                'page_number': row[7]
+            })
+
+        if course_code:
+            for result in results:
+                if result['course_code'] == course_code:
+                    continue
+                match = next((loc for loc in result['locations'] if loc['course_code'] == course_code), None)
+                if match:
+                    result.update(match)
+
+    def fetch_neighbors(self, hits: List[Dict[str, Any]], window: int) -> List[Dict[str, Any]]:
+        """Chunks within +/-window positions of each hit in the same file, in one query
+
+        Hits themselves are not returned. Each neighbour carries 'neighbor_of'
+        (the id of the nearest hit it was fetched for) and that hit's similarity.
+        """
+        if not hits or window <= 0:
+            return []
+
+        try:
+            ranges = [
+                (i, h['file_id'], h['chunk_index'] - window, h['chunk_index'] + window)
+                for i, h in enumerate(hits)
+            ]
+            rows = execute_values(self.cursor, """
+                SELECT DISTINCT ON (d.file_id, d.chunk_index)
+                    h.hit, d.id, d.file_id, d.chunk_text, d.chunk_index, d.page_number, d.metadata
+                FROM (VALUES %s) AS h(hit, file_id, lo, hi)
+                JOIN documents d
+                  ON d.file_id = h.file_id
+                 AND d.chunk_index BETWEEN h.lo AND h.hi
+                ORDER BY d.file_id, d.chunk_index, abs(d.chunk_index - (h.lo + h.hi) / 2), h.hit
+            """, ranges, template="(%s, %s::integer, %s::integer, %s::integer)", fetch=True)
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Neighbour lookup failed: {e}")
+
+        hit_positions = {(h['file_id'], h['chunk_index']) for h in hits}
+        neighbors = []
+        for r in rows:
+            if (r[2], r[4]) in hit_positions:
+                continue
+            hit = hits[r[0]]
+            neighbors.append({
+                'id': r[1],
+                'course_code': hit['course_code'],
+                'course_name': hit['course_name'],
+                'content_type': hit['content_type'],
+                'file_name': hit['file_name'],
+                'file_id': r[2],
+                'text': r[3],
+                'chunk_index': r[4],
+                'page_number': r[5],
+                'metadata': r[6],
+                'similarity': hit['similarity'],
+                'embedding': None,
+                'neighbor_of': hit['id']
+            })
+        return neighbors
+
+    def get_document_count(self, course_code: Optional[str] = None) -> int:
+        """Get total document count, optionally filtered by course (from the maintained counters)"""
+        try:
+            if course_code:
+                self.cursor.execute(
+                    "SELECT COALESCE(SUM(document_count), 0) FROM courses WHERE course_code = %s",
+                    (course_code,)
+                )
+            else:
+                self.cursor.execute("SELECT COALESCE(SUM(document_count), 0) FROM courses")
+
+            count = int(self.cursor.fetchone()[0])
+            self.conn.commit()
+            return count
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to get document count: {e}")
+
+    def corpus_version(self) -> Tuple:
+        """A value that changes whenever searchable content changes
+
+        Counter updates bump courses.last_updated, generation swaps set
+        activated_at, and an embedding cutover changes the active version,
+        which is reloaded here when another process made it.
+        """
+        try:
+            self.cursor.execute("""
+                SELECT
+                    (SELECT id FROM embedding_models WHERE status = 'active'),
+                    (SELECT MAX(last_updated) FROM courses),
+                    (SELECT COALESCE(SUM(document_count), 0) FROM courses),
+                    (SELECT MAX(activated_at) FROM index_generations)
+            """)
+            version = tuple(self.cursor.fetchone())
+            changed = version[0] != self.embedding_model['id'] and self._load_active_embedding_model()
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to read corpus version: {e}")
+
+        if changed:
+            self._embedding_model_changed()
+        return version
+
+    def get_all_courses(self) -> List[Dict[str, Any]]:
+        """Get all courses with document counts"""
+        try:
+            self.cursor.execute("""
+                SELECT course_code, course_name, document_count
+                FROM courses
+                WHERE document_count > 0
+                ORDER BY course_code
+            """)
+
+            results = self.cursor.fetchall()
+            self.conn.commit()
+            return [
+                {
+                    'course_code': r[0],
+                    'course_name': r[1],
+                    'document_count': r[2]
+                }
+                for r in results
+            ]
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to get courses: {e}")
+
+    def clear_all_documents(self) -> None:
+        """Clear all documents from the database"""
+        try:
+            # TRUNCATE skips the per-statement counter triggers, so reset the counters here
+            self.cursor.execute("TRUNCATE documents")
+            self.cursor.execute("UPDATE files SET chunk_count = 0, unique_count = 0")
+            self.cursor.execute("""
+                UPDATE courses SET document_count = 0, unique_count = 0, last_updated = CURRENT_TIMESTAMP
+            """)
+            self.cursor.execute("DELETE FROM centroids")
+            self.cursor.execute("DELETE FROM index_checkpoints")
+            self.conn.commit()
+            print("✓ All documents cleared")
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to clear documents: {e}")
+
+    def documents_empty(self) -> bool:
+        self.cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM documents)")
+        empty = self.cursor.fetchone()[0]
+        self.conn.commit()
+        return empty
+
+    def snapshot_catalog(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Courses, files and completed checkpoints, as stored alongside a documents snapshot"""
+        try:
+            self.cursor.execute("SELECT id, course_code, course_name, description FROM courses ORDER BY id")
+            courses = [
+                {'id': r[0], 'course_code': r[1], 'course_name': r[2], 'description': r[3]}
+                for r in self.cursor.fetchall()
+            ]
+            self.cursor.execute("SELECT id, course_id, content_type, file_name FROM files ORDER BY id")
+            files = [
+                {'id': r[0], 'course_id': r[1], 'content_type': r[2], 'file_name': r[3]}
+                for r in self.cursor.fetchall()
+            ]
+            self.cursor.execute("""
+                SELECT course_code, content_type, file_name, file_hash, chunks_total
+                FROM index_checkpoints WHERE status = 'complete'
+                ORDER BY course_code, content_type, file_name
+            """)
+            checkpoints = [
+                {'course_code': r[0], 'content_type': r[1], 'file_name': r[2],
+                 'file_hash': r[3].strip(), 'chunks_total': r[4]}
+                for r in self.cursor.fetchall()
+            ]
+            self.conn.commit()
+            return {'courses': courses, 'files': files, 'checkpoints': checkpoints}
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to read catalog: {e}")
+
+    def iter_snapshot_documents(self, batch_size: int = 5000):
+        """Stream every document row (SNAPSHOT_COLUMNS plus the active embedding) in (course_id, id) order"""
+        cursor = self.conn.cursor(name='snapshot_export')
+        cursor.itersize = batch_size
+        try:
+            cursor.execute(f"""
+                SELECT {', '.join(SNAPSHOT_COLUMNS)}, {self.embedding_column}
+                FROM documents ORDER BY course_id, id
+            """)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+            self.conn.commit()
+
+    def copy_documents(self, column: str, csv_buffer) -> None:
+        """Bulk-load CSV rows of SNAPSHOT_COLUMNS plus one embedding column (caller commits)"""
+        columns = SNAPSHOT_COLUMNS + (column,)
+        csv_buffer.seek(0)
+        # Quoted empty strings in nullable columns are NULLs (the writer quotes every string)
+        self.cursor.copy_expert(f"""
+            COPY documents ({', '.join(columns)}) FROM STDIN
+            WITH (FORMAT csv, FORCE_NULL ({', '.join(SNAPSHOT_NULLABLE + (column,))}))
+        """, csv_buffer)
+
+    def finish_import(self, column: str, checkpoints: List[Dict[str, Any]]) -> None:
+        """Commit bulk-loaded documents with their counters, checkpoints, indexes and centroids
+
+        Vector indexes are built here only when column is the active embedding
+        version; activating another version builds its own.
+        """
+        try:
+            self.cursor.execute("""
+                SELECT setval(pg_get_serial_sequence('documents', 'id'), COALESCE(MAX(id), 1)) FROM documents
+            """)
+            for cp in checkpoints:
+                self._upsert_checkpoint(
+                    cp['course_code'], cp['content_type'], cp['file_name'], cp['file_hash'],
+                    cp['chunks_total'], cp['chunks_total']
+                )
+            self._recount()
+
+            if column == self.embedding_column:
+                self.cursor.execute("SELECT id, unique_count FROM courses WHERE unique_count > 0")
+                for course_id, n_rows in self.cursor.fetchall():
+                    self._create_vector_index(self._partition_table(course_id), n_rows)
+                    self._refresh_centroids(course_id)
+            self.cursor.execute("ANALYZE documents")
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to finish import: {e}")
+
+    def _insert_columns(self) -> str:
+        return DOCUMENT_INSERT_COLUMNS.format(embedding=self.embedding_column)
+
+    def _load_active_embedding_model(self) -> bool:
+        """Read the active embedding version; True if it replaced a different one loaded before"""
+        self.cursor.execute("""
+            SELECT id, model, dimension, column_name FROM embedding_models WHERE status = 'active'
+        """)
+        row = self.cursor.fetchone()
+        previous = self.embedding_model
+        self.embedding_model = {'id': row[0], 'model': row[1], 'dimension': row[2], 'column': row[3]}
+        self.embedding_column = row[3]
+        return previous is not None and previous['id'] != row[0]
+
+    def reload_embedding_model(self) -> None:
+        """Pick up the active embedding version, e.g. after another process cut over"""
+        try:
+            changed = self._load_active_embedding_model()
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to load the active embedding model: {e}")
+
+        if changed:
+            self._embedding_model_changed()
+
+    def _embedding_model_changed(self) -> None:
+        print(f"Embedding model switched to {self.embedding_model['model']} ({self.embedding_column})")
+        if self.on_embedding_model_change is not None:
+            self.on_embedding_model_change(self.embedding_model)
+
+    def _check_embedding_model(self) -> None:
+        """Raise EmbeddingModelChanged if the active version is no longer the loaded one (caller rolls back)
+
+        Called after a batch's INSERT into documents: holding that statement's
+        lock, a cutover (which locks documents in SHARE mode to check coverage)
+        has either committed and is visible here, or waits for this transaction,
+        so no row can go in with only the retired column filled.
+        """
+        self.cursor.execute("SELECT id FROM embedding_models WHERE status = 'active'")
+        if self.cursor.fetchone()[0] != self.embedding_model['id']:
+            raise EmbeddingModelChanged(
+                f"The active embedding model is no longer {self.embedding_model['model']}"
+            )
+
+    def register_embedding_model(self, model: str, dimension: int) -> Dict[str, Any]:
+        """Add (or resume) an embedding model version, with an empty vector column of its own
+
+        Adding a nullable column without a default is a catalog-only change, so the
+        live column and queries against it are unaffected. Detached generation
+        tables get the column too, so they can still be attached.
+        """
+        try:
+            self.cursor.execute("""
+                SELECT id, dimension, column_name, status FROM embedding_models WHERE model = %s
+            """, (model,))
+            row = self.cursor.fetchone()
+            if row is not None:
+                model_id, stored_dimension, column, status = row
+                if stored_dimension != dimension:
+                    raise ValueError(
+                        f"{model} was registered with {stored_dimension} dimensions, now produces {dimension}"
+                    )
+                if status == 'retired':
+                    self.cursor.execute(
+                        "UPDATE embedding_models SET status = 'migrating' WHERE id = %s", (model_id,)
+                    )
+                    status = 'migrating'
+            else:
+                self.cursor.execute("""
+                    INSERT INTO embedding_models (model, dimension, column_name, status)
+                    VALUES (%s, %s, '', 'migrating') RETURNING id
+                """, (model, dimension))
+                model_id = self.cursor.fetchone()[0]
+                column = embedding_column_name(model_id)
+                status = 'migrating'
+                self.cursor.execute(
+                    "UPDATE embedding_models SET column_name = %s WHERE id = %s", (column, model_id)
+                )
+
+            for table in ['documents'] + self._detached_generation_tables():
+                self.cursor.execute(
+                    f"ALTER TABLE IF EXISTS {table} ADD COLUMN IF NOT EXISTS {column} vector({int(dimension)})"
+                )
+            self.conn.commit()
+
+        except ValueError:
+            self.conn.rollback()
+            raise
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to register embedding model {model}: {e}")
+
+        return {'id': model_id, 'model': model, 'dimension': dimension, 'column': column, 'status': status}
+
+    def fetch_unembedded(self, column: str, limit: int) -> List[Tuple[int, int, str]]:
+        """Up to limit canonical chunks (course_id, id, text) with no vector in column yet"""
+        try:
+            self.cursor.execute(f"""
+                SELECT course_id, id, chunk_text FROM documents
+                WHERE canonical_id IS NULL AND {column} IS NULL
+                ORDER BY course_id, id
+                LIMIT %s
+            """, (limit,))
+            rows = self.cursor.fetchall()
+            self.conn.commit()
+            return rows
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to fetch chunks to embed: {e}")
+
+    def store_embeddings(self, column: str, rows: List[Tuple[int, int, List[float]]]) -> None:
+        """Write one embedding version's vectors for (course_id, id, vector) rows"""
+        if not rows:
+            return
+        try:
+            execute_values(self.cursor, f"""
+                UPDATE documents d SET {column} = v.embedding::vector
+                FROM (VALUES %s) AS v (course_id, id, embedding)
+                WHERE d.course_id = v.course_id AND d.id = v.id
+            """, rows, template="(%s::integer, %s::integer, %s)")
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to store embeddings: {e}")
+
+    def embedding_coverage(self, column: str) -> Tuple[int, int]:
+        """(embedded, total) canonical chunks for one embedding version"""
+        try:
+            self.cursor.execute(f"""
+                SELECT COUNT({column}), COUNT(*) FROM documents WHERE canonical_id IS NULL
+            """)
+            done, total = self.cursor.fetchone()
+            self.conn.commit()
+            return int(done), int(total)
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to measure embedding coverage: {e}")
+
+    def activate_embedding_model(self, model_id: int) -> None:
+        """Cut queries and inserts over to a fully embedded model version
+
+        The version's per-partition indexes are built first, while the current
+        version keeps serving. The switch itself re-checks coverage with writes
+        to documents blocked, so no chunk can slip in without a vector.
+        """
+        self.cursor.execute(
+            "SELECT column_name, status FROM embedding_models WHERE id = %s", (model_id,)
+        )
+        row = self.cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Unknown embedding model version {model_id}")
+        column, status = row
+        if status == 'active':
+            return
+
+        try:
+            self.cursor.execute("SELECT id, unique_count FROM courses WHERE unique_count > 0")
+            for course_id, n_rows in self.cursor.fetchall():
+                self._replace_vector_index(self._partition_table(course_id), n_rows, column=column)
+                self._refresh_centroids(course_id, column=column)
+            self.conn.commit()
+
+            self.cursor.execute("LOCK TABLE documents IN SHARE MODE")
+            self.cursor.execute(f"""
+                SELECT COUNT(*) FROM documents WHERE canonical_id IS NULL AND {column} IS NULL
+            """)
+            missing = self.cursor.fetchone()[0]
+            if missing:
+                raise ValueError(f"{missing} chunk(s) still have no {column} vector")
+
+            self.cursor.execute("""
+                UPDATE embedding_models SET status = 'retired' WHERE status = 'active';
+                UPDATE embedding_models SET status = 'active', activated_at = CURRENT_TIMESTAMP
+                WHERE id = %s;
+            """, (model_id,))
+            self.conn.commit()
+
+        except ValueError:
+            self.conn.rollback()
+            raise
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to activate embedding model version {model_id}: {e}")
+
+        self._load_active_embedding_model()
+        self.conn.commit()
+
+    def drop_embedding_model(self, model: str) -> None:
+        """Drop a retired model version's vector column and indexes
+
+        Other running processes keep querying the retired column until their
+        next corpus_version() check picks up the cutover, so only drop it after that.
+        """
+        self.cursor.execute(
+            "SELECT id, column_name, status FROM embedding_models WHERE model = %s", (model,)
+        )
+        row = self.cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Unknown embedding model: {model}")
+        model_id, column, status = row
+        if status == 'active':
+            raise ValueError(f"{model} is the active embedding model")
+
+        try:
+            for table in ['documents'] + self._detached_generation_tables():
+                self.cursor.execute(f"ALTER TABLE IF EXISTS {table} DROP COLUMN IF EXISTS {column}")
+            self.cursor.execute("DELETE FROM centroids WHERE column_name = %s", (column,))
+            self.cursor.execute("DELETE FROM generation_centroids WHERE column_name = %s", (column,))
+            self.cursor.execute("DELETE FROM embedding_models WHERE id = %s", (model_id,))
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to drop embedding model {model}: {e}")
+
+    def _detached_generation_tables(self) -> List[str]:
+        """Generation tables that exist outside documents: shadows being built and retired generations"""
+        self.cursor.execute("""
+            SELECT table_name FROM index_generations
+            WHERE status IN ('building', 'retired', 'rolled_back') AND table_name <> ''
+        """)
+        return [r[0] for r in self.cursor.fetchall()]
+
+    def list_embedding_models(self) -> List[Dict[str, Any]]:
+        """Registered embedding model versions with their coverage of canonical chunks"""
+        try:
+            self.cursor.execute("""
+                SELECT id, model, dimension, column_name, status, activated_at
+                FROM embedding_models ORDER BY id
+            """)
+            models = [
+                {
+                    'id': r[0], 'model': r[1], 'dimension': r[2], 'column': r[3],
+                    'status': r[4], 'activated_at': r[5]
+                }
+                for r in self.cursor.fetchall()
+            ]
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to list embedding models: {e}")
+
+        for m in models:
+            m['embedded'], m['total'] = self.embedding_coverage(m['column'])
+        return models
+
+    def create_shadow(self, course_code: str, course_name: str) -> Dict[str, Any]:
+        """Start a new generation of a course in an unattached table shaped like documents
+
+        Writes to the shadow never touch the live partition, so queries keep
+        running against the current generation until activate_shadow().
+        """
+        course_id = self.ensure_course(course_code, course_name)
+        try:
+            self.cursor.execute("""
+                INSERT INTO index_generations (course_id, table_name, status)
+                VALUES (%s, '', 'building') RETURNING id
+            """, (course_id,))
+            generation_id = self.cursor.fetchone()[0]
+            table = f"{partition_name(course_id)}_g{generation_id}"
+
+            self.cursor.execute(f"""
+                CREATE TABLE {table} (LIKE documents INCLUDING DEFAULTS);
+                ALTER TABLE {table}
+                    ADD PRIMARY KEY (course_id, id),
+                    ADD CONSTRAINT {table}_course_check CHECK (course_id = {int(course_id)});
+                CREATE INDEX ON {table} (content_hash) WHERE canonical_id IS NULL;
+            """)
+            self.cursor.execute(
+                "UPDATE index_generations SET table_name = %s WHERE id = %s", (table, generation_id)
+            )
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to create shadow table for {course_code}: {e}")
+
+        return {
+            'id': generation_id,
+            'course_code': course_code,
+            'course_id': course_id,
+            'table': table,
+            'expected_chunks': 0,
+            'checkpoints': []
+        }
+
+    def _canonical_source(self, generation: Dict[str, Any]) -> str:
+        """Rows a shadow build may deduplicate against: itself plus other courses' live rows"""
+        columns = f"id, course_id, minhash, content_hash, canonical_id, {self.embedding_column}"
+        return (
+            f"(SELECT {columns} FROM {generation['table']} "
+            f"UNION ALL SELECT {columns} FROM documents WHERE course_id <> {int(generation['course_id'])})"
+        )
+
+    def insert_documents_shadow(
+        self,
+        generation: Dict[str, Any],
+        documents: List[Tuple],
+        duplicates: Optional[List[Tuple]] = None
+    ) -> None:
+        """Insert a batch of chunks into a shadow generation"""
+        try:
+            if documents:
+                execute_values(
+                    self.cursor,
+                    f"INSERT INTO {generation['table']} {self._insert_columns()} VALUES %s",
+                    documents,
+                    template=DOCUMENT_INSERT_TEMPLATE
+                )
+
+            if duplicates:
+                self._insert_duplicates(generation['table'], self._canonical_source(generation), duplicates)
+            self._check_embedding_model()
+            self.conn.commit()
+
+        except StaleBatchError:
+            self.conn.rollback()
+            raise
+        except EmbeddingModelChanged:
+            self.conn.rollback()
+            self.reload_embedding_model()
+            raise
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to insert into {generation['table']}: {e}")
+
+    def shadow_stats(self, generation: Dict[str, Any]) -> Dict[str, int]:
+        """Row counts of a shadow generation, for validation before it goes live"""
+        try:
+            self.cursor.execute(f"""
+                SELECT COUNT(*),
+                       COUNT(*) FILTER (WHERE canonical_id IS NULL),
+                       COUNT(*) FILTER (WHERE canonical_id IS NULL AND {self.embedding_column} IS NULL)
+                FROM {generation['table']}
+            """)
+            rows, unique, unembedded = self.cursor.fetchone()
+            self.conn.commit()
+            return {'rows': rows, 'unique': unique, 'unembedded': unembedded}
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to count {generation['table']}: {e}")
+
+    def finalize_shadow(self, generation: Dict[str, Any], stats: Dict[str, int]) -> None:
+        """Build the shadow's indexes, constraints, counts and centroids offline, ready to be attached"""
+        table = generation['table']
+        try:
+            # Matching indexes and foreign keys let ATTACH PARTITION adopt them instead of building them
+            self.cursor.execute(f"""
+                CREATE INDEX ON {table} (canonical_id) WHERE canonical_id IS NOT NULL;
+                CREATE INDEX ON {table} (file_id, chunk_index);
+                ALTER TABLE {table}
+                    ADD FOREIGN KEY (course_id) REFERENCES courses(id),
+                    ADD FOREIGN KEY (file_id) REFERENCES files(id);
+            """)
+            self._create_vector_index(table, stats['unique'])
+            self.cursor.execute(f"ANALYZE {table}")
+            self._store_generation_stats(generation['id'], table)
+            self.cursor.execute(
+                "UPDATE index_generations SET chunks = %s WHERE id = %s", (stats['rows'], generation['id'])
+            )
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to finalize {table}: {e}")
+
+    def discard_shadow(self, generation: Dict[str, Any]) -> None:
+        """Drop a shadow generation that failed to build or validate"""
+        try:
+            self.cursor.execute(f"DROP TABLE IF EXISTS {generation['table']}")
+            self.cursor.execute(
+                "DELETE FROM generation_centroids WHERE generation_id = %s", (generation['id'],)
+            )
+            self.cursor.execute(
+                "UPDATE index_generations SET status = 'failed' WHERE id = %s", (generation['id'],)
+            )
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to discard {generation['table']}: {e}")
+
+    def activate_shadow(self, generation: Dict[str, Any], keep_generations: int = 1) -> None:
+        """Swap a finalized shadow in as the course's partition in one transaction
+
+        The replaced partition is detached, not dropped, and kept for rollback.
+        """
+        course_id = generation['course_id']
+        checkpoints = [
+            {'content_type': ct, 'file_name': fn, 'file_hash': fh, 'chunks_total': n}
+            for ct, fn, fh, n in generation['checkpoints']
+        ]
+        def swap():
+            self._swap_partition(generation['course_code'], course_id, generation['table'], generation['id'])
+            self._restore_checkpoints(generation['course_code'], checkpoints)
+            self.cursor.execute("""
+                UPDATE index_generations
+                SET status = 'active', checkpoints = %s::jsonb, activated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (json.dumps(checkpoints), generation['id']))
+
+        try:
+            self._swap_with_retry(swap)
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to activate {generation['table']}: {e}")
+
+        self._prune_generations(course_id, keep_generations)
+
+    def rollback_generation(self, course_code: str) -> str:
+        """Re-attach a course's most recently retired generation; returns its table name
+
+        A generation retired before an embedding cutover has no vectors in the
+        now active column and is refused.
+        """
+        course_id = self._course_id(course_code)
+        if course_id is None:
+            raise ValueError(f"Course {course_code} has not been indexed")
+
+        try:
+            column = self.embedding_column
+            self.cursor.execute("""
+                SELECT g.id, g.table_name, g.checkpoints,
+                       g.file_counts IS NOT NULL AND EXISTS (
+                           SELECT 1 FROM generation_centroids gc
+                           WHERE gc.generation_id = g.id AND gc.column_name = %s
+                       )
+                FROM index_generations g
+                WHERE g.course_id = %s AND g.status = 'retired'
+                ORDER BY g.activated_at DESC NULLS LAST, g.id DESC LIMIT 1
+            """, (column, course_id))
+            row = self.cursor.fetchone()
+            if row is None:
+                raise ValueError(f"No previous generation of {course_code} to roll back to")
+            generation_id, table, checkpoints, has_stats = row
+
+            # The table is detached, so scanning it here blocks nothing
+            unembedded = not self._has_column(table, column)
+            if not unembedded:
+                self.cursor.execute(f"""
+                    SELECT EXISTS (SELECT 1 FROM {table} WHERE canonical_id IS NULL AND {column} IS NULL)
+                """)
+                unembedded = self.cursor.fetchone()[0]
+            if unembedded:
+                raise ValueError(
+                    f"{table} was retired before the switch to embedding model "
+                    f"{self.embedding_model['model']} and has no vectors for it; re-index {course_code} instead"
+                )
+            if not has_stats:
+                # Retired before its counts, or centroids for the active model, were kept with it
+                self._store_generation_stats(generation_id, table)
+            self.conn.commit()
+
+        except ValueError:
+            self.conn.rollback()
+            raise
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to roll back {course_code}: {e}")
+
+        def swap():
+            self._swap_partition(course_code, course_id, table, generation_id, replaced_status='rolled_back')
+            self._restore_checkpoints(course_code, checkpoints or [])
+            self.cursor.execute("""
+                UPDATE index_generations SET status = 'active', activated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (generation_id,))
+
+        try:
+            self._swap_with_retry(swap)
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to roll back {course_code}: {e}")
+
+        return table
+
+    def _swap_with_retry(self, swap) -> None:
+        """Run swap() in one transaction under a short lock_timeout, retrying with backoff (commits)
+
+        DETACH/ATTACH PARTITION need an ACCESS EXCLUSIVE lock on documents.
+        Waiting for it behind a long-running query would queue every new query
+        behind the pending lock, so each attempt gives up after
+        swap_lock_timeout_ms, lets the queue drain and tries again.
+        """
+        for attempt in range(self.swap_retries + 1):
+            try:
+                self.cursor.execute(f"SET LOCAL lock_timeout = {int(self.swap_lock_timeout_ms)}")
+                swap()
+                self.conn.commit()
+                return
+            except psycopg2.errors.LockNotAvailable:
+                self.conn.rollback()
+                if attempt == self.swap_retries:
+                    raise
+                # Jittered exponential backoff, capped at 10 s
+                time.sleep(min(10.0, 0.1 * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def _swap_partition(
+        self,
+        course_code: str,
+        course_id: int,
+        new_table: str,
+        new_generation_id: int,
+        replaced_status: str = 'retired'
+    ) -> None:
+        """Detach the live partition and attach new_table in its place (caller commits)
+
+        Runs under the ACCESS EXCLUSIVE lock on documents, so nothing here scans
+        a partition: the outgoing generation's counters and centroids are kept
+        from the maintained rows, and the incoming one's were computed when it
+        was finalized (see _store_generation_stats).
+        """
+        live = self._partition_table(course_id)
+        if live is not None:
+            # Remember what the outgoing generation was indexed from, for a later rollback
+            self.cursor.execute("""
+                SELECT content_type, file_name, file_hash, chunks_total
+                FROM index_checkpoints WHERE course_code = %s AND status = 'complete'
+            """, (course_code,))
+            live_checkpoints = json.dumps([
+                {'content_type': r[0], 'file_name': r[1], 'file_hash': r[2].strip(), 'chunks_total': r[3]}
+                for r in self.cursor.fetchall()
+            ])
+
+            self.cursor.execute(f"ALTER TABLE documents DETACH PARTITION {live}")
+            self.cursor.execute("""
+                UPDATE index_generations SET status = %s, checkpoints = %s::jsonb
+                WHERE course_id = %s AND table_name = %s
+                RETURNING id
+            """, (replaced_status, live_checkpoints, course_id, live))
+            row = self.cursor.fetchone()
+            if row is None:
+                # The original partition predates generation tracking
+                self.cursor.execute("""
+                    INSERT INTO index_generations (course_id, table_name, status, checkpoints, activated_at)
+                    VALUES (%s, %s, %s, %s::jsonb, CURRENT_TIMESTAMP)
+                    RETURNING id
+                """, (course_id, live, replaced_status, live_checkpoints))
+                row = self.cursor.fetchone()
+            live_generation_id = row[0]
+
+            # The live counters and centroids describe the outgoing generation; keep them for a rollback
+            self.cursor.execute("""
+                UPDATE index_generations SET file_counts = (
+                    SELECT COALESCE(jsonb_agg(jsonb_build_array(id, chunk_count, unique_count)), '[]'::jsonb)
+                    FROM files WHERE course_id = %s AND chunk_count > 0
+                )
+                WHERE id = %s
+            """, (course_id, live_generation_id))
+            self.cursor.execute("""
+                DELETE FROM generation_centroids WHERE generation_id = %s;
+                INSERT INTO generation_centroids (generation_id, course_id, file_id, column_name, centroid, chunks)
+                SELECT %s, course_id, file_id, column_name, centroid, chunks
+                FROM centroids WHERE course_id = %s;
+            """, (live_generation_id, live_generation_id, course_id))
+
+        self.cursor.execute(
+            f"ALTER TABLE documents ATTACH PARTITION {new_table} FOR VALUES IN ({int(course_id)})"
+        )
+        self._apply_generation_stats(course_id, new_generation_id)
+
+    def _store_generation_stats(self, generation_id: int, table: str) -> None:
+        """Compute a detached generation's per-file counts and centroids from its table (caller commits)
+
+        Done before the swap, so swapping the generation in only copies these rows.
+        """
+        column = self.embedding_column
+        self.cursor.execute(f"""
+            UPDATE index_generations SET file_counts = (
+                SELECT COALESCE(jsonb_agg(jsonb_build_array(file_id, n, u)), '[]'::jsonb) FROM (
+                    SELECT file_id, COUNT(*) AS n, COUNT(*) FILTER (WHERE canonical_id IS NULL) AS u
+                    FROM {table} GROUP BY file_id
+                ) s
+            )
+            WHERE id = %s
+        """, (generation_id,))
+        self.cursor.execute(
+            "DELETE FROM generation_centroids WHERE generation_id = %s", (generation_id,)
+        )
+        self.cursor.execute(f"""
+            INSERT INTO generation_centroids (generation_id, course_id, file_id, column_name, centroid, chunks)
+            SELECT %s, course_id, file_id, %s, AVG({column}), COUNT(*)
+            FROM {table}
+            WHERE {column} IS NOT NULL
+            GROUP BY GROUPING SETS ((course_id), (course_id, file_id))
+        """, (generation_id, column))
+
+    def _apply_generation_stats(self, course_id: int, generation_id: int) -> None:
+        """Set a course's counters and centroids to those stored for the generation now attached (caller commits)"""
+        self.cursor.execute("""
+            UPDATE files SET
+                chunk_count = COALESCE(s.n, 0),
+                unique_count = COALESCE(s.u, 0)
+            FROM files f
+            LEFT JOIN (
+                SELECT (e->>0)::int AS file_id, (e->>1)::int AS n, (e->>2)::int AS u
+                FROM index_generations g, jsonb_array_elements(g.file_counts) e
+                WHERE g.id = %s
+            ) s ON s.file_id = f.id
+            WHERE files.id = f.id AND f.course_id = %s;
+
+            UPDATE courses SET
+                document_count = s.n,
+                unique_count = s.u,
+                last_updated = CURRENT_TIMESTAMP
+            FROM (
+                SELECT COALESCE(SUM(chunk_count), 0) AS n, COALESCE(SUM(unique_count), 0) AS u
+                FROM files WHERE course_id = %s
+            ) s
+            WHERE courses.id = %s;
+
+            DELETE FROM centroids WHERE course_id = %s;
+            INSERT INTO centroids (course_id, file_id, column_name, centroid, chunks)
+            SELECT course_id, file_id, column_name, centroid, chunks
+            FROM generation_centroids WHERE generation_id = %s;
+        """, (generation_id, course_id, course_id, course_id, course_id, generation_id))
+
+    def _restore_checkpoints(self, course_code: str, checkpoints: List[Dict[str, Any]]) -> None:
+        """Replace a course's checkpoints with those of the generation now live (caller commits)"""
+        self.cursor.execute("DELETE FROM index_checkpoints WHERE course_code = %s", (course_code,))
+        for cp in checkpoints:
+            self._upsert_checkpoint(
+                course_code, cp['content_type'], cp['file_name'], cp['file_hash'],
+                cp['chunks_total'], cp['chunks_total']
+            )
+
+    def _prune_generations(self, course_id: int, keep: int) -> None:
+        """Drop retired generations beyond the newest `keep`"""
+        try:
+            self.cursor.execute("""
+                SELECT id, table_name FROM index_generations
+                WHERE course_id = %s AND status IN ('retired', 'rolled_back')
+                ORDER BY id DESC OFFSET %s
+            """, (course_id, max(0, keep)))
+            for generation_id, table in self.cursor.fetchall():
+                self.cursor.execute(f"DROP TABLE IF EXISTS {table}")
+                self.cursor.execute(
+                    "DELETE FROM generation_centroids WHERE generation_id = %s", (generation_id,)
+                )
+                self.cursor.execute(
+                    "UPDATE index_generations SET status = 'dropped' WHERE id = %s", (generation_id,)
+                )
+            self.conn.commit()
+
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Warning: Failed to drop old generations: {e}")
+
+    def list_generations(self, course_code: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Index generations, newest first"""
+        try:
+            query = """
+                SELECT g.id, c.course_code, g.table_name, g.status, g.chunks, g.created_at, g.activated_at
+                FROM index_generations g JOIN courses c ON c.id = g.course_id
+            """
+            params = []
+            if course_code:
+                query += " WHERE c.course_code = %s"
+                params.append(course_code)
+            self.cursor.execute(query + " ORDER BY g.id DESC", params)
+            rows = self.cursor.fetchall()
+            self.conn.commit()
+            return [
+                {
+                    'id': r[0], 'course_code': r[1], 'table': r[2], 'status': r[3],
+                    'chunks': r[4], 'created_at': r[5], 'activated_at': r[6]
+                }
+                for r in rows
+            ]
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Failed to list generations: {e}")
 
     def __enter__(self):
         """Context manager entry"""
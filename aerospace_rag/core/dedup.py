@@ -0,0 +1,170 @@
+"""
+Chunk deduplication: exact content hashing and MinHash near-duplicate detection
+"""
+
+import hashlib
+import re
+import zlib
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+
+# Mersenne prime used for universal hashing of shingle hashes
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def normalize_for_hash(text: str) -> str:
+    """Normalize text so trivial whitespace/case differences hash identically"""
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def content_hash(text: str) -> str:
+    """Content address of a chunk (SHA-256 of normalized text)"""
+    return hashlib.sha256(normalize_for_hash(text).encode('utf-8')).hexdigest()
+
+
+class MinHasher:
+    """MinHash signatures over word shingles"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        # Coefficients below 2**31 keep a * crc32 + b inside uint64 without wrapping
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        words = normalize_for_hash(text).split(' ')
+        if len(words) < self.shingle_size:
+            shingles = {' '.join(words)}
+        else:
+            shingles = {
+                ' '.join(words[i:i + self.shingle_size])
+                for i in range(len(words) - self.shingle_size + 1)
+            }
+        return np.array([zlib.crc32(s.encode('utf-8')) for s in shingles], dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature (num_perm uint32 values) for text"""
+        hashes = self._shingle_hashes(text)
+        # (num_perm, n_shingles) permuted hashes; min over shingles
+        permuted = ((np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return float(np.mean(sig_a == sig_b))
+
+
+class LSHIndex:
+    """Banded locality-sensitive hashing index over MinHash signatures"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.9):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[i * self.rows:(i + 1) * self.rows].tobytes()
+            for i in range(self.bands)
+        ]
+
+    def add(self, key: str, signature: np.ndarray) -> None:
+        """Index a signature under key"""
+        self._signatures[key] = signature
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(band_key, set()).add(key)
+
+    def query(self, signature: np.ndarray) -> Optional[str]:
+        """Key of the most similar indexed signature above the threshold, if any"""
+        candidates = set()
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(band.get(band_key, ()))
+
+        best_key, best_sim = None, self.threshold
+        for key in candidates:
+            sim = MinHasher.similarity(signature, self._signatures[key])
+            if sim >= best_sim:
+                best_key, best_sim = key, sim
+        return best_key
+
+
+class ChunkDeduplicator:
+    """Decides, before embedding, which chunks are new content and which duplicate a canonical chunk"""
+
+    def __init__(
+        self,
+        near_duplicates: bool = False,
+        num_perm: int = 64,
+        bands: int = 16,
+        threshold: float = 0.9
+    ):
+        self.near_duplicates = near_duplicates
+        self.minhasher = MinHasher(num_perm=num_perm) if near_duplicates else None
+        self.lsh = LSHIndex(num_perm=num_perm, bands=bands, threshold=threshold) if near_duplicates else None
+        self.exact_hits = 0
+        self.near_hits = 0
+
+    def load_signatures(self, signatures) -> None:
+        """Seed the near-duplicate index with (content_hash, signature bytes) of stored chunks"""
+        if self.lsh is None:
+            return
+        for key, raw in signatures:
+            self.lsh.add(key, np.frombuffer(raw, dtype=np.uint32))
+
+    def classify(self, texts: List[str], known_hashes: Set[str]) -> List[Dict]:
+        """For each text return its hash, the canonical hash it duplicates (or None) and its signature"""
+        seen_in_batch = set()
+        pending = {}
+        decisions = []
+
+        for text in texts:
+            h = content_hash(text)
+            signature = None
+            canonical = None
+
+            if h in known_hashes or h in seen_in_batch:
+                canonical = h
+                self.exact_hits += 1
+            elif self.near_duplicates:
+                signature = self.minhasher.signature(text)
+                canonical = self.lsh.query(signature)
+                if canonical is None:
+                    # Near duplicates within the batch are only visible once added
+                    for key, sig in pending.items():
+                        if MinHasher.similarity(signature, sig) >= self.lsh.threshold:
+                            canonical = key
+                            break
+                if canonical is not None:
+                    self.near_hits += 1
+                else:
+                    pending[h] = signature
+
+            if canonical is None:
+                seen_in_batch.add(h)
+
+            decisions.append({'hash': h, 'canonical': canonical, 'signature': signature})
+
+        return decisions
+
+    def commit(self, decisions: List[Dict]) -> None:
+        """Make canonical chunks of a successfully stored batch visible to later near-duplicate lookups"""
+        if self.lsh is None:
+            return
+        for d in decisions:
+            if d['canonical'] is None and d['signature'] is not None:
+                self.lsh.add(d['hash'], d['signature'])
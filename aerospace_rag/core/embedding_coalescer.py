@@ -0,0 +1,120 @@
+"""
+Coalescing of concurrent embedding requests into multi-input Ollama calls
+"""
+
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeout
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import get_metrics
+
+
+def _settle(future: Future, result=None, error: Optional[BaseException] = None) -> None:
+    """Resolve a future unless it already is (its caller may have timed out and cancelled it)"""
+    if future.done():
+        return
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class EmbeddingCoalescer:
+    """Gathers embedding requests from many threads into batched embed calls
+
+    A single dispatcher thread sends one multi-input request at a time.
+    Requests arriving while a batch is in flight queue up and go out together
+    in the next one, so batch size grows with load. A request arriving when
+    the coalescer is idle is sent at once; the max_wait window for stragglers
+    is only spent when requests have already piled up, so a lone user (or a
+    sequential caller) pays no added latency. Every request is resolved with
+    a vector or an error, and a caller waits at most timeout seconds.
+    """
+
+    def __init__(
+        self,
+        embed_many: Callable[..., np.ndarray],
+        max_wait_ms: float = 5.0,
+        max_batch: int = 32,
+        timeout: Optional[float] = 600.0
+    ):
+        self.embed_many = embed_many
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        self._pending: List[Tuple[str, str, Future]] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def embed(self, text: str, model: str) -> np.ndarray:
+        """Embedding of one text; blocks until its batch returns"""
+        future: Future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embed-coalescer", daemon=True)
+                self._thread.start()
+            self._pending.append((text, model, future))
+            self._cond.notify()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Still queued: don't send it; in flight: its result is dropped
+            future.cancel()
+            raise TimeoutError(f"Embedding request timed out after {self.timeout:.0f}s")
+
+    def _run(self) -> None:
+        while True:
+            batch: List[Tuple[str, str, Future]] = []
+            try:
+                with self._cond:
+                    while not self._pending:
+                        self._cond.wait()
+
+                    # More than one waiting means concurrent callers; let a few more join
+                    if len(self._pending) > 1:
+                        deadline = time.perf_counter() + self.max_wait
+                        while len(self._pending) < self.max_batch:
+                            remaining = deadline - time.perf_counter()
+                            if remaining <= 0:
+                                break
+                            self._cond.wait(remaining)
+
+                    batch = self._pending[:self.max_batch]
+                    del self._pending[:self.max_batch]
+
+                self._dispatch(batch)
+            except Exception as e:
+                # The dispatcher must survive: every later caller depends on it
+                for _, _, future in batch:
+                    _settle(future, error=e)
+
+    def _dispatch(self, batch: List[Tuple[str, str, Future]]) -> None:
+        """Embed a batch with one request per model and resolve each caller's future"""
+        get_metrics().get('embed_batch_size').observe(len(batch))
+
+        by_model = {}
+        for item in batch:
+            # Skip requests whose callers gave up waiting
+            if not item[2].done():
+                by_model.setdefault(item[1], []).append(item)
+
+        for model, items in by_model.items():
+            try:
+                vectors = self.embed_many([text for text, _, _ in items], batch_size=len(items), model=model)
+                if len(vectors) != len(items):
+                    raise ValueError(f"Embedding response has {len(vectors)} vectors for {len(items)} texts")
+                for (_, _, future), vector in zip(items, vectors):
+                    _settle(future, vector)
+            except Exception as e:
+                for _, _, future in items:
+                    _settle(future, error=e)
+            finally:
+                # Whatever happened above, no caller is left waiting on this batch
+                for _, _, future in items:
+                    _settle(future, error=RuntimeError("Embedding batch ended without a result"))
@@ -0,0 +1,95 @@
+"""
+Online migration of the corpus to a new embedding model
+"""
+
+import threading
+import time
+from typing import Dict, Any, Optional, Callable
+
+from .database import DatabaseManager
+from .ollama_client import OllamaClient
+
+
+class EmbeddingMigration:
+    """Re-embeds every canonical chunk into a new model version's column, then cuts over
+
+    The new version gets its own vector column (of its own dimension), so the
+    active version's column and indexes keep serving queries throughout. Work
+    is committed per batch and picked up again from the rows still missing a
+    vector, so an interrupted run simply resumes; chunks indexed while the
+    migration runs are caught by the same query.
+    """
+
+    def __init__(
+        self,
+        db: DatabaseManager,
+        ollama: OllamaClient,
+        model: str,
+        batch_size: int = 64
+    ):
+        self.db = db
+        self.ollama = ollama
+        self.model = model
+        self.batch_size = batch_size
+        self.version: Optional[Dict[str, Any]] = None
+
+    def prepare(self) -> Dict[str, Any]:
+        """Register the model version, probing it once for its embedding dimension"""
+        probe = self.ollama.embed_many(["dimension probe"], model=self.model)
+        self.version = self.db.register_embedding_model(self.model, int(probe.shape[1]))
+        return self.version
+
+    def run(
+        self,
+        cutover: bool = True,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        stop_event: Optional[threading.Event] = None
+    ) -> Dict[str, Any]:
+        """Fill the version's column until every canonical chunk has a vector
+
+        With cutover, the version becomes the active one once coverage reaches
+        100%. Setting stop_event ends the run after the current batch.
+        """
+        if self.version is None:
+            self.prepare()
+        column = self.version['column']
+        done, total = self.db.embedding_coverage(column)
+        start = time.perf_counter()
+        embedded = 0
+
+        while not (stop_event and stop_event.is_set()):
+            rows = self.db.fetch_unembedded(column, self.batch_size)
+            if not rows:
+                break
+
+            vectors = self.ollama.embed_many([r[2] for r in rows], batch_size=self.batch_size, model=self.model)
+            self.db.store_embeddings(
+                column, [(course_id, doc_id, v.tolist()) for (course_id, doc_id, _), v in zip(rows, vectors)]
+            )
+
+            embedded += len(rows)
+            done += len(rows)
+            if progress_callback:
+                elapsed = time.perf_counter() - start
+                progress_callback({
+                    'model': self.model,
+                    'embedded': min(done, total),
+                    'total': total,
+                    'rate': embedded / elapsed if elapsed > 0 else 0.0
+                })
+
+        # New chunks may have arrived meanwhile, so coverage is re-measured rather than assumed
+        done, total = self.db.embedding_coverage(column)
+        activated = False
+        if cutover and done == total and not (stop_event and stop_event.is_set()):
+            self.db.activate_embedding_model(self.version['id'])
+            activated = True
+
+        return {
+            'model': self.model,
+            'column': column,
+            'embedded': done,
+            'total': total,
+            'activated': activated,
+            'seconds': time.perf_counter() - start
+        }
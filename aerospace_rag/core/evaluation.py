@@ -0,0 +1,62 @@
+"""
+Evaluation sets and calibration helpers for retrieval and context compression
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+
+def load_eval_set(path: str) -> List[Dict[str, Any]]:
+    """Load a JSONL eval set: {"question": ..., "expected": [key phrases], "course_code": optional}"""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Eval set not found: {path}")
+
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_no}: invalid JSON: {e}")
+            if 'question' not in item:
+                raise ValueError(f"{path}:{line_no}: missing 'question'")
+            item.setdefault('expected', [])
+            items.append(item)
+
+    return items
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def evidence_recall(context: str, expected: List[str]) -> float:
+    """Fraction of expected key phrases present in the context (1.0 when nothing is expected)"""
+    if not expected:
+        return 1.0
+    haystack = _normalize(context)
+    return sum(1 for phrase in expected if _normalize(phrase) in haystack) / len(expected)
+
+
+def load_calibration(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Previously saved calibration result, if any"""
+    if not path or not Path(path).exists():
+        return None
+    try:
+        return json.loads(Path(path).read_text(encoding='utf-8'))
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable calibration file {path}: {e}")
+        return None
+
+
+def save_calibration(path: str, calibration: Dict[str, Any]) -> None:
+    """Persist a calibration result"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(calibration, indent=2), encoding='utf-8')
@@ -0,0 +1,65 @@
+"""
+On-disk cache of extracted PDF page text, keyed by PDF content hash and extractor version
+"""
+
+import gzip
+import json
+import os
+from pathlib import Path
+from typing import List, Tuple, Optional
+
+from .metrics import get_metrics
+
+
+class PageTextCache:
+    """Stores per-page text as gzip-compressed JSON so re-chunking never re-parses PDFs"""
+
+    def __init__(self, cache_dir: str, extractor_version: str):
+        self.cache_dir = Path(cache_dir)
+        self.extractor_version = extractor_version
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.metrics = get_metrics()
+
+    def _path(self, pdf_hash: str) -> Path:
+        # Two-level fan-out keeps directories small for large corpora
+        return self.cache_dir / pdf_hash[:2] / f"{pdf_hash}.v{self.extractor_version}.json.gz"
+
+    def get(self, pdf_hash: str) -> Optional[List[Tuple[int, str]]]:
+        """Cached pages for a PDF hash, or None"""
+        path = self._path(pdf_hash)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            self.metrics.get('cache_misses_total').inc(cache='page_text')
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Warning: Discarding corrupt page cache entry {path.name}: {e}")
+            path.unlink(missing_ok=True)
+            self.metrics.get('cache_misses_total').inc(cache='page_text')
+            return None
+
+        self.metrics.get('cache_hits_total').inc(cache='page_text')
+        return [(page_num, text) for page_num, text in data['pages']]
+
+    def put(self, pdf_hash: str, pages: List[Tuple[int, str]]) -> None:
+        """Store pages for a PDF hash (atomic replace)"""
+        path = self._path(pdf_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                json.dump({'extractor_version': self.extractor_version, 'pages': pages}, f)
+            tmp_path.replace(path)
+        except OSError as e:
+            print(f"Warning: Failed to write page cache for {pdf_hash[:12]}: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    def clear(self) -> int:
+        """Delete all cache entries; returns the number removed"""
+        removed = 0
+        for path in self.cache_dir.glob("*/*.json.gz"):
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
@@ -0,0 +1,547 @@
+"""
+Latency and throughput metrics with a Prometheus text-format exporter
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Dict, Any, Callable, ContextManager, Optional, Tuple, List
+
+from .config import get_config
+
+
+# Seconds; tuned for a local Ollama + pgvector stack (sub-ms DB hits up to minute-long generations)
+DEFAULT_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+ROW_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    """Turn a label dict into a hashable, order-independent key"""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    """Render a label key in Prometheus exposition syntax"""
+    pairs = list(key) + sorted((extra or {}).items())
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _keyed(pairs: List[Any]) -> Dict[LabelKey, Any]:
+    """Saved [label pairs, *values] entries keyed by label key"""
+    return {tuple(tuple(p) for p in entry[0]): entry[1:] for entry in pairs}
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """Hold an exclusive lock on path across processes for the duration of the block"""
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            # Retries for about 10 seconds, then raises OSError
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _format_value(value: float) -> str:
+    """Render a sample value the way Prometheus expects"""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """Increment the counter"""
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        """Current value for a label set"""
+        return self._values.get(_label_key(labels), 0.0)
+
+    def total(self) -> float:
+        """Sum across all label sets"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        """All label sets recorded so far"""
+        with self._lock:
+            return [dict(key) for key in sorted(self._values)]
+
+    def render(self) -> List[str]:
+        """Render Prometheus sample lines"""
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(key)} {_format_value(v)}"
+                for key, v in sorted(self._values.items())
+            ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'values': [[list(map(list, k)), v] for k, v in self._values.items()]}
+
+    def load_dict(self, data: Dict[str, Any]) -> None:
+        with self._lock:
+            for key, v in data.get('values', []):
+                self._values[tuple(tuple(p) for p in key)] = v
+
+    def merge_dict(
+        self,
+        saved: Optional[Dict[str, Any]],
+        baseline: Optional[Dict[str, Any]],
+        current: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Saved state plus this process's increments since baseline (both to_dict() forms)"""
+        saved_values = _keyed((saved or {}).get('values', []))
+        base_values = _keyed((baseline or {}).get('values', []))
+        merged = {key: v[0] for key, v in saved_values.items()}
+        for key, (v,) in _keyed(current.get('values', [])).items():
+            merged[key] = merged.get(key, 0.0) + v - base_values.get(key, (0.0,))[0]
+        return {'values': [[list(map(list, k)), v] for k, v in merged.items()]}
+
+
+class Gauge(Counter):
+    """Point-in-time value with optional labels"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """Set the gauge"""
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+    def merge_dict(self, saved, baseline, current) -> Dict[str, Any]:
+        """Saved state with this process's values written over it"""
+        merged = {key: v[0] for key, v in _keyed((saved or {}).get('values', [])).items()}
+        merged.update({key: v[0] for key, v in _keyed(current.get('values', [])).items()})
+        return {'values': [[list(map(list, k)), v] for k, v in merged.items()]}
+
+
+class _HistogramSeries:
+    """Bucket counts for a single label set"""
+
+    def __init__(self, n_buckets: int):
+        self.bucket_counts = [0] * n_buckets
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, _HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        """Record an observation"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series.bucket_counts[i] += 1
+                    break
+            series.count += 1
+            series.sum += value
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside buckets (like histogram_quantile)"""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if series is None or series.count == 0:
+                return None
+
+            rank = q * series.count
+            cumulative = 0
+            lower = 0.0
+            for bound, n in zip(self.buckets, series.bucket_counts):
+                if n and cumulative + n >= rank:
+                    return lower + (bound - lower) * ((rank - cumulative) / n)
+                cumulative += n
+                lower = bound
+
+            # Observation fell into the +Inf bucket
+            return self.buckets[-1]
+
+    def summary(self, **labels) -> Dict[str, Any]:
+        """Count, mean and p50/p95/p99 for a label set"""
+        series = self._series.get(_label_key(labels))
+        if series is None or series.count == 0:
+            return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None}
+        return {
+            'count': series.count,
+            'mean': series.sum / series.count,
+            'p50': self.quantile(0.50, **labels),
+            'p95': self.quantile(0.95, **labels),
+            'p99': self.quantile(0.99, **labels),
+        }
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        """All label sets observed so far"""
+        with self._lock:
+            return [dict(key) for key in sorted(self._series)]
+
+    def render(self) -> List[str]:
+        """Render Prometheus sample lines"""
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series.bucket_counts):
+                    cumulative += n
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(key, {'le': _format_value(bound)})} {cumulative}"
+                    )
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series.count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series.sum)}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series.count}")
+        return lines
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'series': [
+                    [list(map(list, key)), s.bucket_counts, s.count, s.sum]
+                    for key, s in self._series.items()
+                ]
+            }
+
+    def load_dict(self, data: Dict[str, Any]) -> None:
+        # Bucket layout changed since the state was saved; start fresh rather than mis-bin
+        if tuple(data.get('buckets', [])) != self.buckets:
+            return
+        with self._lock:
+            for key, bucket_counts, count, total in data.get('series', []):
+                series = _HistogramSeries(len(self.buckets))
+                series.bucket_counts = list(bucket_counts)
+                series.count = count
+                series.sum = total
+                self._series[tuple(tuple(p) for p in key)] = series
+
+    def merge_dict(
+        self,
+        saved: Optional[Dict[str, Any]],
+        baseline: Optional[Dict[str, Any]],
+        current: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Saved state plus this process's observations since baseline (both to_dict() forms)"""
+        def series(data):
+            # Series saved with another bucket layout cannot be combined; drop them
+            if not data or tuple(data.get('buckets', ())) != self.buckets:
+                return {}
+            return _keyed(data.get('series', []))
+
+        saved_series, base_series = series(saved), series(baseline)
+        empty = ([0] * len(self.buckets), 0, 0.0)
+        merged = dict(saved_series)
+        for key, (counts, count, total) in series(current).items():
+            s_counts, s_count, s_total = saved_series.get(key, empty)
+            b_counts, b_count, b_total = base_series.get(key, empty)
+            merged[key] = (
+                [s + c - b for s, c, b in zip(s_counts, counts, b_counts)],
+                s_count + count - b_count,
+                s_total + total - b_total
+            )
+        return {
+            'buckets': list(self.buckets),
+            'series': [[list(map(list, k)), c, n, t] for k, (c, n, t) in merged.items()]
+        }
+
+
+class MetricsRegistry:
+    """Holds all metrics for the process"""
+
+    def __init__(self, namespace: str = "aerospace_rag"):
+        self.namespace = namespace
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        # Each metric's to_dict() as of the last load/save; save() adds only what changed since
+        self._saved: Dict[str, Dict[str, Any]] = {}
+        # Wraps blocks timed with a 'stage' label (the profiler installs one while running)
+        self.stage_hook: Optional[Callable[[str], ContextManager]] = None
+
+    def _get_or_create(self, cls, name: str, *args):
+        full_name = f"{self.namespace}_{name}"
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, *args)
+            return metric
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        """Get or create a counter"""
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str = "") -> Gauge:
+        """Get or create a gauge"""
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str = "",
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS
+    ) -> Histogram:
+        """Get or create a histogram"""
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def get(self, name: str):
+        """Look up a metric by its short name"""
+        return self._metrics.get(f"{self.namespace}_{name}")
+
+    @contextmanager
+    def timer(self, name: str, help_text: str = "", **labels):
+        """Time a block into a histogram; yields a dict that receives 'seconds'
+
+        A 'stage' label is also passed to stage_hook, when one is set.
+        """
+        result = {}
+        hook = self.stage_hook
+        start = time.perf_counter()
+        try:
+            with hook(labels['stage']) if hook is not None and 'stage' in labels else nullcontext():
+                yield result
+        finally:
+            result['seconds'] = time.perf_counter() - start
+            self.histogram(name, help_text).observe(result['seconds'], **labels)
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        for name, metric in metrics:
+            if metric.help_text:
+                lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """Atomically write the exposition text (node_exporter textfile collector format)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(self.render_prometheus(), encoding="utf-8")
+        tmp_path.replace(path)
+
+    def save(self, path: str) -> None:
+        """Persist metric state so counts accumulate across CLI invocations
+
+        Other processes (watcher, GUI, CLI) save to the same file, so under a
+        file lock this process's changes since its last load/save are added
+        to whatever the file holds now rather than overwriting it.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            metrics = list(self._metrics.items())
+
+        with _file_lock(path.with_suffix(path.suffix + ".lock")):
+            saved = self._read_state(path) or {}
+            state = dict(saved)
+            for name, m in metrics:
+                current = m.to_dict()
+                entry = saved.get(name, {})
+                state[name] = {
+                    'type': m.type_name,
+                    'help': m.help_text,
+                    'data': m.merge_dict(
+                        entry.get('data') if entry.get('type') == m.type_name else None,
+                        self._saved.get(name),
+                        current
+                    )
+                }
+                self._saved[name] = current
+
+            tmp_path = path.with_suffix(path.suffix + ".tmp")
+            tmp_path.write_text(json.dumps(state), encoding="utf-8")
+            tmp_path.replace(path)
+
+    @staticmethod
+    def _read_state(path: Path) -> Optional[Dict[str, Any]]:
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable metrics state {path}: {e}")
+            return None
+
+    def load(self, path: str) -> None:
+        """Merge previously saved metric state"""
+        state = self._read_state(Path(path))
+        if state is None:
+            return
+
+        short = len(self.namespace) + 1
+        for name, entry in state.items():
+            if not name.startswith(self.namespace + "_"):
+                continue
+            if entry['type'] == 'histogram':
+                metric = self.histogram(name[short:], entry['help'], tuple(entry['data'].get('buckets', ())))
+            elif entry['type'] == 'gauge':
+                metric = self.gauge(name[short:], entry['help'])
+            else:
+                metric = self.counter(name[short:], entry['help'])
+            metric.load_dict(entry['data'])
+            self._saved[name] = entry['data']
+
+    def stage_summary(self) -> Dict[str, Dict[str, Any]]:
+        """Latency summaries for each RAG query stage"""
+        stages = self.get('stage_seconds')
+        if stages is None:
+            return {}
+        return {
+            labels['stage']: stages.summary(**labels)
+            for labels in stages.label_sets()
+            if 'stage' in labels
+        }
+
+
+def serve_prometheus(registry: MetricsRegistry, port: int, host: str = "0.0.0.0") -> HTTPServer:
+    """Create an HTTP server exposing /metrics; caller runs serve_forever()"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return HTTPServer((host, port), MetricsHandler)
+
+
+# Global metrics registry
+_metrics = None
+_state_loaded = False
+
+
+def get_metrics() -> MetricsRegistry:
+    """Get global metrics registry"""
+    global _metrics
+    if _metrics is None:
+        _metrics = MetricsRegistry()
+        _register_default_metrics(_metrics)
+    return _metrics
+
+
+def _register_default_metrics(registry: MetricsRegistry) -> None:
+    """Declare the core RAG metrics so they show up (with help text) before first use"""
+    registry.histogram('stage_seconds', "Time spent in each RAG query stage")
+    registry.histogram('query_seconds', "End-to-end RAG query latency")
+    registry.histogram('time_to_first_token_seconds', "Time from generation request to first token")
+    registry.histogram(
+        'generation_tokens_per_second', "Generation throughput reported by Ollama",
+        TOKENS_PER_SECOND_BUCKETS
+    )
+    registry.histogram('retrieved_rows', "Rows returned by similarity search", ROW_COUNT_BUCKETS)
+    registry.histogram(
+        'embed_batch_size', "Texts per coalesced embedding request", (1, 2, 4, 8, 16, 32, 64)
+    )
+    registry.counter('queries_total', "RAG queries served")
+    registry.counter('query_routes_total', "Unfiltered queries by course routing outcome")
+    registry.counter('ollama_requests_total', "Ollama requests by endpoint, kind and outcome")
+    registry.histogram('ollama_request_seconds', "Ollama request latency by endpoint and kind")
+    registry.gauge('ollama_outstanding_requests', "In-flight Ollama requests per endpoint")
+    registry.gauge('ollama_endpoint_up', "Whether an Ollama endpoint is in rotation (health checks)")
+    registry.counter('cache_hits_total', "Cache hits by cache name")
+    registry.counter('cache_misses_total', "Cache misses by cache name")
+    registry.histogram(
+        'context_tokens', "Prompt context size after packing",
+        (128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+    )
+    registry.counter('context_tokens_saved_total', "Prompt tokens saved by merging, MMR and budget packing")
+    registry.histogram('index_stage_seconds', "Time spent in each indexing stage")
+    registry.counter('index_pages_total', "PDF pages extracted during indexing")
+    registry.counter('index_chunks_total', "Chunks produced during indexing")
+    registry.counter('index_embeddings_total', "Chunks embedded and stored during indexing")
+    registry.counter('index_duplicates_total', "Duplicate chunks stored without a new embedding")
+    registry.counter('extraction_pages_total', "Pages extracted, by extractor path (fast/layout/empty)")
+    registry.counter('extraction_fallbacks_total', "Pages sent to the layout extractor, by reason")
+
+
+def load_metrics_state(registry: Optional[MetricsRegistry] = None) -> MetricsRegistry:
+    """Load persisted metric state configured under metrics.state_file (once per process)"""
+    global _state_loaded
+    registry = registry or get_metrics()
+    if _state_loaded:
+        return registry
+    state_file = get_config().get('metrics', {}).get('state_file')
+    if state_file:
+        registry.load(state_file)
+    _state_loaded = True
+    return registry
+
+
+def flush_metrics(registry: Optional[MetricsRegistry] = None) -> None:
+    """Write metric state and the Prometheus textfile dump if configured"""
+    registry = registry or get_metrics()
+    cfg = get_config().get('metrics', {})
+    try:
+        if cfg.get('state_file'):
+            registry.save(cfg['state_file'])
+        if cfg.get('textfile'):
+            registry.write_textfile(cfg['textfile'])
+    except OSError as e:
+        print(f"Warning: Failed to write metrics: {e}")
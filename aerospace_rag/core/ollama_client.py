@@ -2,10 +2,22 @@
 Ollama client for embeddings and completions
 """
 
+import time
 import ollama
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from .config import get_config
+from .cancellation import CancelToken, OperationCancelled
+from .embedding_coalescer import EmbeddingCoalescer
+from .ollama_pool import OllamaPool
+
+
+def _response_field(response: Any, name: str) -> Any:
+    """Read a field from an Ollama response object or dict (depends on library version)"""
+    value = getattr(response, name, None)
+    if value is None and isinstance(response, dict):
+        value = response.get(name)
+    return value
 
 
 class OllamaClient:
@@ -21,14 +33,37 @@ class OllamaClient:
         self.embedding_model = config.get('embedding_model', 'gemma3:1b')
         self.temperature = config.get('temperature', 0.7)
         self.max_tokens = config.get('max_tokens', 2048)
+        self.num_ctx = config.get('num_ctx', 8192)
+        self.keep_alive = config.get('keep_alive')
+
+        # Requests go to the configured endpoints through persistent clients
+        self.pool = OllamaPool.from_config(config)
+        # Older ollama libraries only have the single-prompt embeddings endpoint
+        self._has_embed = hasattr(ollama.Client, 'embed')
+
+        # Concurrent generate_embedding calls (GUI, batch jobs) share multi-input requests
+        coalesce = config.get('embed_coalescing', {})
+        self.coalescer: Optional[EmbeddingCoalescer] = None
+        if coalesce.get('enabled', True):
+            self.coalescer = EmbeddingCoalescer(
+                self.embed_many,
+                max_wait_ms=coalesce.get('max_wait_ms', 5),
+                max_batch=coalesce.get('max_batch', 32),
+                # Room for the request itself plus a failover to another endpoint
+                timeout=2 * config.get('request_timeout', 300) + coalesce.get('max_wait_ms', 5) / 1000.0
+            )
 
-    def generate_embedding(self, text: str) -> np.ndarray:
-        """Generate embedding for text using Ollama"""
+    def generate_embedding(self, text: str, model: Optional[str] = None) -> np.ndarray:
+        """Generate embedding for text using Ollama (the configured embedding model unless given)"""
+        model = model or self.embedding_model
+        if self.coalescer is not None and self._has_embed:
+            return self.coalescer.embed(text, model)
+        return self._embed_one(text, model)
+
+    def _embed_one(self, text: str, model: str) -> np.ndarray:
+        """Single-prompt embedding request"""
         try:
-            response = ollama.embeddings(
-                model=self.embedding_model,
-                prompt=text
-            )
+            response = self.pool.call('embed', lambda client: client.embeddings(model=model, prompt=text))
 
             embedding = np.array(response['embedding'], dtype=np.float32)
             return embedding
@@ -37,30 +72,47 @@ class OllamaClient:
             error_msg = str(e).lower()
             if 'not found' in error_msg or 'pull' in error_msg:
                 raise Exception(
-                    f"❌ Embedding model '{self.embedding_model}' not found!\n\n"
+                    f"❌ Embedding model '{model}' not found!\n\n"
                     f"Please pull the model first:\n"
-                    f"  ollama pull {self.embedding_model}\n\n"
+                    f"  ollama pull {model}\n\n"
                     f"Or run the setup script again to auto-install models."
                 )
             raise Exception(f"Failed to generate embedding: {e}")
 
-    def generate_embeddings_batch(self, texts: List[str]) -> List[np.ndarray]:
-        """Generate embeddings for multiple texts"""
-        embeddings = []
-        for i, text in enumerate(texts):
-            try:
-                embedding = self.generate_embedding(text)
-                embeddings.append(embedding)
+    def embed_many(self, texts: List[str], batch_size: int = 64, model: Optional[str] = None) -> np.ndarray:
+        """Embed texts with multi-input requests; returns an (n, dim) float32 matrix"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        if not self._has_embed:
+            return np.vstack([self._embed_one(t, model or self.embedding_model) for t in texts])
+
+        vectors = []
+        try:
+            for start in range(0, len(texts), batch_size):
+                batch = texts[start:start + batch_size]
+                response = self.pool.call(
+                    'embed', lambda client: client.embed(model=model or self.embedding_model, input=batch)
+                )
+                if len(response['embeddings']) != len(batch):
+                    raise ValueError(f"got {len(response['embeddings'])} vectors for {len(batch)} texts")
+                vectors.extend(response['embeddings'])
+        except Exception as e:
+            raise Exception(f"Failed to generate embeddings: {e}")
 
-                if (i + 1) % 10 == 0:
-                    print(f"  Generated {i + 1}/{len(texts)} embeddings")
+        return np.array(vectors, dtype=np.float32)
 
-            except Exception as e:
-                print(f"Warning: Failed to generate embedding for text {i}: {e}")
-                # Use zero vector as fallback
-                embeddings.append(np.zeros(384, dtype=np.float32))
+    def generate_embeddings_batch(self, texts: List[str], model: Optional[str] = None) -> List[np.ndarray]:
+        """Generate embeddings for multiple texts in one multi-input request
 
-        return embeddings
+        A failure raises rather than substituting a placeholder vector: a zero
+        vector of guessed size would either be rejected by the column's
+        dimension or silently stored as an unmatchable chunk. The caller's
+        checkpoint lets the file be resumed instead.
+        """
+        if not texts:
+            return []
+        return list(self.embed_many(texts, batch_size=len(texts), model=model))
 
     def generate_completion(
         self,
@@ -70,6 +122,31 @@ class OllamaClient:
         stream: bool = False
     ) -> str:
         """Generate completion using Ollama"""
+        answer, _ = self.generate_completion_with_stats(
+            prompt, context=context, system_prompt=system_prompt, stream=stream
+        )
+        return answer
+
+    def generate_completion_with_stats(
+        self,
+        prompt: str,
+        context: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        stream: bool = False,
+        history: Optional[List[Dict[str, str]]] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        session_id: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Generate completion and return it with timing stats (TTFT, tokens/sec)
+
+        history holds earlier chat messages; they go between the system prompt
+        and the new question so the prompt prefix matches the previous turn.
+        Turns of one session_id go to the same endpoint while it is healthy,
+        where that prefix is still cached.
+        When streaming, tokens go to on_token (default: stdout) and a cancelled
+        token stops generation at the next token.
+        """
         try:
             messages = []
 
@@ -80,32 +157,37 @@ class OllamaClient:
                     'content': system_prompt
                 })
 
-            # Add context if provided
-            if context:
-                messages.append({
-                    'role': 'user',
-                    'content': f"Context:\n{context}\n\nQuestion: {prompt}"
-                })
-            else:
-                messages.append({
-                    'role': 'user',
-                    'content': prompt
-                })
+            if history:
+                messages.extend(history)
+
+            messages.append({
+                'role': 'user',
+                'content': self.format_user_message(prompt, context)
+            })
 
             if stream:
-                return self._generate_streaming(messages)
+                return self._generate_streaming(messages, on_token, cancel, session_id)
             else:
-                response = ollama.chat(
+                start = time.perf_counter()
+                response = self.pool.call('chat', lambda client: client.chat(
                     model=self.model,
                     messages=messages,
-                    options={
-                        'temperature': self.temperature,
-                        'num_predict': self.max_tokens
-                    }
-                )
-
-                return response['message']['content']
-
+                    options=self._chat_options(),
+                    **self._chat_kwargs()
+                ), affinity=session_id)
+                elapsed = time.perf_counter() - start
+
+                stats = self._generation_stats(response, elapsed)
+                # Without streaming the first token is only observable via Ollama's own timings
+                load_ns = _response_field(response, 'load_duration') or 0
+                prompt_eval_ns = _response_field(response, 'prompt_eval_duration')
+                if prompt_eval_ns is not None:
+                    stats['time_to_first_token_seconds'] = (load_ns + prompt_eval_ns) / 1e9
+
+                return response['message']['content'], stats
+
+        except OperationCancelled:
+            raise
         except Exception as e:
             error_msg = str(e).lower()
             if 'not found' in error_msg or 'pull' in error_msg:
@@ -117,46 +199,115 @@ class OllamaClient:
                 )
             raise Exception(f"Failed to generate completion: {e}")
 
-    def _generate_streaming(self, messages: List[Dict]) -> str:
+    def _generate_streaming(
+        self,
+        messages: List[Dict],
+        on_token: Optional[Callable[[str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        session_id: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
         """Generate completion with streaming"""
         try:
             full_response = ""
-            stream = ollama.chat(
-                model=self.model,
-                messages=messages,
-                stream=True,
-                options={
-                    'temperature': self.temperature,
-                    'num_predict': self.max_tokens
-                }
-            )
-
-            for chunk in stream:
-                if 'message' in chunk and 'content' in chunk['message']:
-                    content = chunk['message']['content']
-                    full_response += content
-                    print(content, end='', flush=True)
-
-            print()  # New line after streaming
-            return full_response
+            start = time.perf_counter()
+            first_token_at = None
+            last_chunk = None
+            # The endpoint stays reserved (counted as outstanding) until the stream ends
+            with self.pool.session('chat', affinity=session_id) as client:
+                stream = client.chat(
+                    model=self.model,
+                    messages=messages,
+                    stream=True,
+                    options=self._chat_options(),
+                    **self._chat_kwargs()
+                )
 
+                for chunk in stream:
+                    if cancel is not None and cancel.cancelled:
+                        # Closing the response drops the HTTP stream, which stops Ollama generating
+                        if hasattr(stream, 'close'):
+                            stream.close()
+                        raise OperationCancelled("Generation cancelled")
+                    last_chunk = chunk
+                    if 'message' in chunk and 'content' in chunk['message']:
+                        content = chunk['message']['content']
+                        if content and first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        full_response += content
+                        if on_token is not None:
+                            on_token(content)
+                        else:
+                            print(content, end='', flush=True)
+
+            if on_token is None:
+                print()  # New line after streaming
+
+            stats = self._generation_stats(last_chunk, time.perf_counter() - start)
+            if first_token_at is not None:
+                stats['time_to_first_token_seconds'] = first_token_at - start
+            return full_response, stats
+
+        except OperationCancelled:
+            raise
         except Exception as e:
             raise Exception(f"Streaming generation failed: {e}")
 
+    @staticmethod
+    def format_user_message(prompt: str, context: Optional[str] = None) -> str:
+        """User message for a question, with retrieved context when provided"""
+        if context:
+            return f"Context:\n{context}\n\nQuestion: {prompt}"
+        return prompt
+
+    def _chat_kwargs(self) -> Dict[str, Any]:
+        """Extra chat arguments; keep_alive keeps the model (and its KV cache) loaded between turns"""
+        return {'keep_alive': self.keep_alive} if self.keep_alive is not None else {}
+
+    def _chat_options(self) -> Dict[str, Any]:
+        """Sampling and context-window options for chat requests"""
+        return {
+            'temperature': self.temperature,
+            'num_predict': self.max_tokens,
+            'num_ctx': self.num_ctx
+        }
+
+    @staticmethod
+    def _generation_stats(response: Any, elapsed: float) -> Dict[str, Any]:
+        """Extract token counts and throughput from a (final) chat response"""
+        stats = {
+            'generation_seconds': elapsed,
+            'time_to_first_token_seconds': None,
+            'prompt_tokens': None,
+            'completion_tokens': None,
+            'tokens_per_second': None
+        }
+        if response is None:
+            return stats
+
+        stats['prompt_tokens'] = _response_field(response, 'prompt_eval_count')
+        eval_count = _response_field(response, 'eval_count')
+        eval_ns = _response_field(response, 'eval_duration')
+        stats['completion_tokens'] = eval_count
+        if eval_count and eval_ns:
+            stats['tokens_per_second'] = eval_count / (eval_ns / 1e9)
+        return stats
+
     def check_connection(self) -> bool:
-        """Check if Ollama is running and accessible"""
-        try:
-            # Try to list models
-            models = ollama.list()
-            return True
-        except Exception as e:
-            print(f"Failed to connect to Ollama: {e}")
+        """Check that at least one configured Ollama endpoint is running and accessible"""
+        health = self.pool.check_health()
+        for url, ok in health.items():
+            if not ok and len(health) > 1:
+                print(f"Warning: Ollama endpoint {url} is not responding")
+        if not any(health.values()):
+            errors = "; ".join(f"{e['url']}: {e['last_error']}" for e in self.pool.info())
+            print(f"Failed to connect to Ollama: {errors}")
             return False
+        return True
 
     def check_model_available(self) -> bool:
         """Check if the configured models are available"""
         try:
-            models_response = ollama.list()
+            models_response = self.pool.call('list', lambda client: client.list())
 
             # Extract model names from the response
             model_names = []
@@ -279,8 +430,10 @@ class OllamaClient:
         """Pull a model from Ollama"""
         try:
             target_model = model_name if model_name else self.model
-            print(f"Pulling model: {target_model}...")
-            ollama.pull(target_model)
+            # Every endpoint needs the model to take its share of requests
+            for endpoint in self.pool.endpoints:
+                print(f"Pulling model: {target_model} on {endpoint.url}...")
+                endpoint.client.pull(target_model)
             print(f"✓ Model {target_model} pulled successfully")
             return True
 
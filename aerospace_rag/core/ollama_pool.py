@@ -0,0 +1,255 @@
+"""
+Load balancing across Ollama endpoints with health checks and ejection
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import ollama
+
+from .metrics import get_metrics
+from .cancellation import OperationCancelled
+
+
+class OllamaEndpoint:
+    """One Ollama server: a persistent keep-alive client plus its load and health state"""
+
+    def __init__(self, url: str, timeout: float = 300.0, connect_timeout: float = 5.0):
+        self.url = url.rstrip('/')
+        # ollama.Client wraps an httpx.Client, which pools and reuses connections
+        self.client = ollama.Client(host=self.url, timeout=httpx.Timeout(timeout, connect=connect_timeout))
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.last_used = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+
+class OllamaPool:
+    """Spreads Ollama requests over endpoints by least outstanding requests
+
+    An endpoint failing max_failures times in a row (connection errors,
+    timeouts, 5xx) is ejected for eject_seconds; requests then go to the
+    others, and a failed call is retried once on each remaining endpoint.
+    A background health check re-admits recovered endpoints early and
+    ejects dead ones before a request has to find out. With every endpoint
+    ejected, requests still go to the one due back soonest.
+
+    Requests may name an affinity key (a chat session id). They go to the
+    endpoint that key last used while that endpoint is healthy, so a
+    session's turns reuse the model and KV cache kept loaded there
+    (keep_alive) instead of prefilling the whole history again elsewhere.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[OllamaEndpoint],
+        max_failures: int = 3,
+        eject_seconds: float = 30.0,
+        health_check_interval: float = 10.0,
+        max_affinities: int = 1024
+    ):
+        if not endpoints:
+            raise ValueError("At least one Ollama endpoint is required")
+        self.endpoints = endpoints
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.health_check_interval = health_check_interval
+        self.max_affinities = max_affinities
+        # Affinity key -> endpoint it last used, least recently used first
+        self._affinity: "OrderedDict[str, OllamaEndpoint]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        self.metrics = get_metrics()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'OllamaPool':
+        """Pool for ollama.endpoints (URLs or {url, timeout, connect_timeout}), else ollama.base_url"""
+        timeout = config.get('request_timeout', 300)
+        connect_timeout = config.get('connect_timeout', 5)
+        specs = config.get('endpoints') or [config.get('base_url', 'http://localhost:11434')]
+
+        endpoints = []
+        for spec in specs:
+            if isinstance(spec, str):
+                spec = {'url': spec}
+            endpoints.append(OllamaEndpoint(
+                spec['url'],
+                timeout=spec.get('timeout', timeout),
+                connect_timeout=spec.get('connect_timeout', connect_timeout)
+            ))
+
+        return cls(
+            endpoints,
+            max_failures=config.get('max_failures', 3),
+            eject_seconds=config.get('eject_seconds', 30),
+            health_check_interval=config.get('health_check_interval', 10)
+        )
+
+    def acquire(
+        self,
+        exclude: Optional[List[OllamaEndpoint]] = None,
+        affinity: Optional[str] = None
+    ) -> OllamaEndpoint:
+        """Endpoint for one request, reserved until released
+
+        The affinity key's endpoint if it is healthy, else the least-loaded
+        healthy endpoint (which the key then sticks to).
+        """
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in (exclude or [])]
+            if not candidates:
+                raise ConnectionError("No Ollama endpoint left to try")
+
+            pinned = self._affinity.get(affinity) if affinity is not None else None
+            healthy = [e for e in candidates if e.healthy]
+            if pinned in healthy:
+                endpoint = pinned
+            elif healthy:
+                # Ties go to the endpoint idle longest, so equal load still rotates
+                endpoint = min(healthy, key=lambda e: (e.outstanding, e.last_used))
+            else:
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+
+            if affinity is not None:
+                self._affinity[affinity] = endpoint
+                self._affinity.move_to_end(affinity)
+                while len(self._affinity) > self.max_affinities:
+                    self._affinity.popitem(last=False)
+
+            endpoint.outstanding += 1
+            endpoint.last_used = time.monotonic()
+        self.metrics.get('ollama_outstanding_requests').set(endpoint.outstanding, endpoint=endpoint.url)
+        return endpoint
+
+    def release(self, endpoint: OllamaEndpoint, kind: str, seconds: float, error: Optional[Exception] = None) -> None:
+        """Return a reserved endpoint, recording the request's outcome"""
+        failed = error is not None and self._is_endpoint_failure(error)
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.consecutive_failures += 1
+                endpoint.last_error = str(error)
+                if endpoint.consecutive_failures >= self.max_failures:
+                    self._eject(endpoint)
+            elif error is None:
+                endpoint.consecutive_failures = 0
+
+        outcome = 'ok'
+        if isinstance(error, OperationCancelled):
+            outcome = 'cancelled'
+        elif error is not None:
+            outcome = 'error'
+        labels = {'endpoint': endpoint.url, 'kind': kind}
+        self.metrics.get('ollama_request_seconds').observe(seconds, **labels)
+        self.metrics.get('ollama_requests_total').inc(outcome=outcome, **labels)
+        self.metrics.get('ollama_outstanding_requests').set(endpoint.outstanding, endpoint=endpoint.url)
+
+    def _eject(self, endpoint: OllamaEndpoint) -> None:
+        """Take an endpoint out of rotation (caller holds the lock)"""
+        if endpoint.healthy:
+            print(f"Warning: Ollama endpoint {endpoint.url} ejected for {self.eject_seconds:.0f}s "
+                  f"({endpoint.last_error})")
+        endpoint.ejected_until = time.monotonic() + self.eject_seconds
+        self.metrics.get('ollama_endpoint_up').set(0, endpoint=endpoint.url)
+
+    @staticmethod
+    def _is_endpoint_failure(error: Exception) -> bool:
+        """Errors that say the server is unreachable or broken, not that the request was bad"""
+        if isinstance(error, ollama.ResponseError):
+            return (getattr(error, 'status_code', 0) or 0) >= 500
+        return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+    @contextmanager
+    def session(self, kind: str, affinity: Optional[str] = None):
+        """Reserve one endpoint for a multi-step request such as a streamed chat; yields its client"""
+        endpoint = self.acquire(affinity=affinity)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield endpoint.client
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(endpoint, kind, time.perf_counter() - start, error)
+
+    def call(self, kind: str, fn: Callable[[ollama.Client], Any], affinity: Optional[str] = None) -> Any:
+        """Run fn(client) on the affinity key's or the least-loaded endpoint, failing over on endpoint errors"""
+        self._ensure_health_checks()
+        tried: List[OllamaEndpoint] = []
+        while True:
+            endpoint = self.acquire(exclude=tried, affinity=affinity)
+            start = time.perf_counter()
+            try:
+                result = fn(endpoint.client)
+            except Exception as e:
+                self.release(endpoint, kind, time.perf_counter() - start, e)
+                tried.append(endpoint)
+                if not self._is_endpoint_failure(e) or len(tried) >= len(self.endpoints):
+                    raise
+                continue
+            self.release(endpoint, kind, time.perf_counter() - start)
+            return result
+
+    def check_health(self) -> Dict[str, bool]:
+        """Probe every endpoint now, ejecting dead ones and re-admitting recovered ones"""
+        results = {}
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.list()
+                ok = True
+            except Exception as e:
+                ok = False
+                error = e
+
+            with self._lock:
+                if ok:
+                    endpoint.consecutive_failures = 0
+                    endpoint.ejected_until = 0.0
+                    endpoint.last_error = None
+                else:
+                    endpoint.last_error = str(error)
+                    self._eject(endpoint)
+            if ok:
+                self.metrics.get('ollama_endpoint_up').set(1, endpoint=endpoint.url)
+            results[endpoint.url] = ok
+        return results
+
+    def _ensure_health_checks(self) -> None:
+        """Start the background health checker on first use (only worth it with several endpoints)"""
+        if self._health_thread is not None or len(self.endpoints) < 2 or self.health_check_interval <= 0:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(self.health_check_interval)
+                    self.check_health()
+
+            self._health_thread = threading.Thread(target=run, name="ollama-health", daemon=True)
+            self._health_thread.start()
+
+    def info(self) -> List[Dict[str, Any]]:
+        """Per-endpoint load and health"""
+        with self._lock:
+            return [
+                {
+                    'url': e.url,
+                    'healthy': e.healthy,
+                    'outstanding': e.outstanding,
+                    'consecutive_failures': e.consecutive_failures,
+                    'last_error': e.last_error
+                }
+                for e in self.endpoints
+            ]
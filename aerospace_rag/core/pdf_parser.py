@@ -4,17 +4,115 @@ PDF parsing and text chunking utilities
 
 import PyPDF2
 import pdfplumber
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 import re
 
+from .tokenizer import TokenCounter, get_token_counter
+from .extract_cache import PageTextCache
+from .metrics import get_metrics
+
+
+# Bump whenever extraction output changes so cached page text is re-extracted
+EXTRACTOR_VERSION = "2"
+
+
+def _extract_pages_pdfplumber(pdf_path: str, page_numbers: Optional[List[int]] = None) -> List[Tuple[int, str]]:
+    """Extract the given 1-based pages (all when None) with pdfplumber, releasing each page's layout cache
+
+    Module-level so it can run in a worker process.
+    """
+    pages = []
+    with pdfplumber.open(pdf_path, pages=page_numbers) as pdf:
+        for page in pdf.pages:
+            try:
+                text = page.extract_text()
+                if text and text.strip():
+                    pages.append((page.page_number, text))
+            finally:
+                # Parsed layout objects are cached per page and otherwise live until the PDF closes
+                if hasattr(page, 'close'):
+                    page.close()
+                else:
+                    page.flush_cache()
+    return pages
+
+
+# Characters that signal formulas where pdfplumber's layout ordering matters
+_MATH_CHARS = set("∫∑∏√∂∇±×÷≤≥≠≈∞∝∆∈∉⊂⊃∪∩→←↔⇒⇔αβγδεζηθικλμνξπρστυφχψωΓΔΘΛΞΠΣΦΨΩ")
+
+
+def assess_page_text(text: Optional[str], min_chars: int = 40) -> Optional[str]:
+    """Why fast-extracted page text needs the layout-accurate extractor, or None if it looks fine"""
+    if not text or len(text.strip()) < min_chars:
+        return 'empty'
+
+    n = len(text)
+    garbled = text.count('\ufffd') + 5 * text.count('(cid:')
+    garbled += sum(1 for ch in text if ord(ch) < 32 and ch not in '\n\r\t')
+    if garbled / n > 0.02:
+        return 'garbled'
+
+    words = text.split()
+    # Fast extractors often drop inter-word spaces, yielding run-together "words"
+    if words and sum(len(w) for w in words) / len(words) > 15:
+        return 'spacing'
+
+    math = sum(1 for ch in text if ch in _MATH_CHARS)
+    single_char_tokens = sum(1 for w in words if len(w) == 1)
+    if math / n > 0.01 or (words and single_char_tokens / len(words) > 0.3):
+        return 'math'
+
+    return None
+
+
+def compute_file_hash(path: Path, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 class PDFParser:
     """Parse PDF files and extract text with chunking"""
 
-    def __init__(self, chunk_size: int = 512, chunk_overlap: int = 100):
+    def __init__(
+        self,
+        chunk_size: int = 512,
+        chunk_overlap: int = 100,
+        chunk_mode: str = 'characters',
+        chunk_tokens: int = 512,
+        chunk_overlap_tokens: int = 64,
+        token_counter: Optional[TokenCounter] = None,
+        page_cache: Optional[PageTextCache] = None,
+        parallel_min_pages: int = 200,
+        pages_per_range: int = 50,
+        workers: int = 0,
+        extraction_strategy: str = 'adaptive'
+    ):
+        if chunk_mode not in ('characters', 'tokens'):
+            raise ValueError(f"Unknown chunk mode: {chunk_mode}")
+        if extraction_strategy not in ('adaptive', 'pdfplumber'):
+            raise ValueError(f"Unknown extraction strategy: {extraction_strategy}")
+
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.chunk_mode = chunk_mode
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        self.token_counter = token_counter or get_token_counter()
+        self.page_cache = page_cache
+        self.parallel_min_pages = parallel_min_pages
+        self.pages_per_range = max(1, pages_per_range)
+        self.workers = workers
+        self.extraction_strategy = extraction_strategy
+        self.extraction_stats: Optional[Dict] = None
 
     def extract_text_pypdf2(self, pdf_path: Path) -> List[Tuple[int, str]]:
         """Extract text from PDF using PyPDF2"""
@@ -31,27 +129,144 @@ class PDFParser:
 
         return pages
 
-    def extract_text_pdfplumber(self, pdf_path: Path) -> List[Tuple[int, str]]:
-        """Extract text from PDF using pdfplumber (more accurate)"""
-        pages = []
+    def extract_text_pdfplumber(
+        self,
+        pdf_path: Path,
+        page_numbers: Optional[List[int]] = None
+    ) -> List[Tuple[int, str]]:
+        """Extract text from PDF using pdfplumber (more accurate), optionally only some pages"""
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    text = page.extract_text()
-                    if text and text.strip():
-                        pages.append((page_num, text))
+            if page_numbers is None:
+                page_numbers = list(range(1, self._page_count(pdf_path) + 1)) or None
+
+            if page_numbers and len(page_numbers) >= self.parallel_min_pages and self.workers != 1:
+                return self._extract_pdfplumber_parallel(pdf_path, page_numbers)
+            return _extract_pages_pdfplumber(str(pdf_path), page_numbers)
         except Exception as e:
             print(f"Warning: pdfplumber extraction failed for {pdf_path.name}: {e}")
+            return []
+
+    def _page_count(self, pdf_path: Path) -> int:
+        """Number of pages, read from the PDF catalogue without parsing page content"""
+        try:
+            with open(pdf_path, 'rb') as file:
+                return len(PyPDF2.PdfReader(file).pages)
+        except Exception:
+            return 0
+
+    def _extract_pdfplumber_parallel(self, pdf_path: Path, page_numbers: List[int]) -> List[Tuple[int, str]]:
+        """Extract page ranges in worker processes and stitch them back in page order"""
+        ranges = [
+            page_numbers[i:i + self.pages_per_range]
+            for i in range(0, len(page_numbers), self.pages_per_range)
+        ]
+        workers = min(self.workers or os.cpu_count() or 1, len(ranges))
+        print(f"  Extracting {len(page_numbers)} pages in {len(ranges)} ranges on {workers} workers...")
+
+        executor_kwargs = {'max_workers': workers}
+        if sys.version_info >= (3, 11):
+            # Fresh worker per range so memory from one range never accumulates into the next
+            executor_kwargs['max_tasks_per_child'] = 1
+
+        pages = []
+        with ProcessPoolExecutor(**executor_kwargs) as executor:
+            # map() yields in submission order, so results are already in page order
+            for range_pages in executor.map(_extract_pages_pdfplumber, [str(pdf_path)] * len(ranges), ranges):
+                pages.extend(range_pages)
 
         return pages
 
-    def extract_text(self, pdf_path: Path) -> List[Tuple[int, str]]:
-        """Extract text from PDF, trying pdfplumber first, then PyPDF2"""
-        pages = self.extract_text_pdfplumber(pdf_path)
+    def extract_text_adaptive(self, pdf_path: Path) -> List[Tuple[int, str]]:
+        """Fast PyPDF2 pass over every page; pdfplumber only for pages that fail quality checks"""
+        fast_pages = {}
+        retry = {}
 
-        if not pages:
-            print(f"Trying PyPDF2 for {pdf_path.name}...")
-            pages = self.extract_text_pypdf2(pdf_path)
+        try:
+            with open(pdf_path, 'rb') as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                for page_num, page in enumerate(pdf_reader.pages, 1):
+                    try:
+                        text = page.extract_text() or ''
+                    except Exception:
+                        text = ''
+                        reason = 'error'
+                    else:
+                        reason = assess_page_text(text)
+
+                    if reason:
+                        retry[page_num] = reason
+                    if text.strip():
+                        fast_pages[page_num] = text
+        except Exception as e:
+            print(f"Warning: Fast extraction failed for {pdf_path.name}: {e}")
+            pages = self.extract_text_pdfplumber(pdf_path)
+            self._record_extraction_paths(pdf_path, {'layout': len(pages)}, {'error': len(pages)})
+            return pages
+
+        layout_pages = {}
+        if retry:
+            layout_pages = dict(self.extract_text_pdfplumber(pdf_path, sorted(retry)))
+
+        pages = []
+        counts = {'fast': 0, 'layout': 0, 'empty': 0}
+        for page_num in sorted(set(fast_pages) | set(retry)):
+            if page_num in layout_pages:
+                pages.append((page_num, layout_pages[page_num]))
+                counts['layout'] += 1
+            elif page_num in fast_pages:
+                # Layout extractor found nothing better; keep what the fast pass produced
+                pages.append((page_num, fast_pages[page_num]))
+                counts['fast'] += 1
+            else:
+                counts['empty'] += 1
+
+        reasons = {}
+        for reason in retry.values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+        self._record_extraction_paths(pdf_path, counts, reasons)
+
+        return pages
+
+    def _record_extraction_paths(self, pdf_path: Path, counts: Dict[str, int], reasons: Dict[str, int]) -> None:
+        """Remember and report which extractor each page went through"""
+        self.extraction_stats = {'file_name': pdf_path.name, 'paths': counts, 'reasons': reasons}
+
+        metrics = get_metrics()
+        for path, n in counts.items():
+            if n:
+                metrics.get('extraction_pages_total').inc(n, path=path)
+        for reason, n in reasons.items():
+            metrics.get('extraction_fallbacks_total').inc(n, reason=reason)
+
+        if reasons:
+            detail = ', '.join(f"{r} {n}" for r, n in sorted(reasons.items()))
+            print(f"  Pages: {counts.get('fast', 0)} fast, {counts.get('layout', 0)} layout ({detail})")
+
+    def extract_text(self, pdf_path: Path, file_hash: Optional[str] = None) -> List[Tuple[int, str]]:
+        """Extract text from PDF (served from the page cache when possible)"""
+        if self.page_cache is None:
+            return self._extract_text_uncached(pdf_path)
+
+        if file_hash is None:
+            file_hash = compute_file_hash(pdf_path)
+
+        pages = self.page_cache.get(file_hash)
+        if pages is None:
+            pages = self._extract_text_uncached(pdf_path)
+            self.page_cache.put(file_hash, pages)
+        return pages
+
+    def _extract_text_uncached(self, pdf_path: Path) -> List[Tuple[int, str]]:
+        """Extract text from PDF with the configured strategy"""
+        if self.extraction_strategy == 'adaptive':
+            pages = self.extract_text_adaptive(pdf_path)
+        else:
+            # Legacy strategy: pdfplumber for every page, PyPDF2 if that finds nothing
+            pages = self.extract_text_pdfplumber(pdf_path)
+
+            if not pages:
+                print(f"Trying PyPDF2 for {pdf_path.name}...")
+                pages = self.extract_text_pypdf2(pdf_path)
 
         if not pages:
             raise Exception(f"Failed to extract text from {pdf_path.name}")
@@ -72,7 +287,13 @@ class PDFParser:
         return text.strip()
 
     def chunk_text(self, text: str) -> List[str]:
-        """Split text into overlapping chunks"""
+        """Split text into overlapping chunks using the configured chunk mode"""
+        if self.chunk_mode == 'tokens':
+            return self.chunk_text_tokens(text)
+        return self.chunk_text_characters(text)
+
+    def chunk_text_characters(self, text: str) -> List[str]:
+        """Split text into overlapping chunks measured in characters"""
         # Split by sentences first
         sentences = re.split(r'(?<=[.!?])\s+', text)
 
@@ -112,9 +333,68 @@ class PDFParser:
 
         return chunks
 
-    def parse_pdf(self, pdf_path: Path) -> List[Dict]:
-        """Parse PDF and return structured chunks"""
-        pages = self.extract_text(pdf_path)
+    def chunk_text_tokens(self, text: str) -> List[str]:
+        """Split text into overlapping chunks packed to a token budget"""
+        sentences = []
+        for sentence in re.split(r'(?<=[.!?])\s+', text):
+            tokens = self.token_counter.count(sentence)
+            if tokens > self.chunk_tokens:
+                # A single run-on "sentence" (tables, equations) larger than the budget
+                sentences.extend(self._split_long_sentence(sentence))
+            elif sentence:
+                sentences.append((sentence, tokens))
+
+        chunks = []
+        current_chunk = []
+        current_tokens = 0
+
+        for sentence, tokens in sentences:
+            if current_tokens + tokens > self.chunk_tokens and current_chunk:
+                chunks.append(' '.join(s for s, _ in current_chunk))
+
+                # Carry trailing sentences over as overlap
+                overlap = []
+                overlap_tokens = 0
+                for s, t in reversed(current_chunk):
+                    if overlap_tokens + t <= self.chunk_overlap_tokens:
+                        overlap.insert(0, (s, t))
+                        overlap_tokens += t
+                    else:
+                        break
+
+                current_chunk = overlap
+                current_tokens = overlap_tokens
+
+            current_chunk.append((sentence, tokens))
+            current_tokens += tokens
+
+        if current_chunk:
+            chunks.append(' '.join(s for s, _ in current_chunk))
+
+        return chunks
+
+    def _split_long_sentence(self, sentence: str) -> List[Tuple[str, int]]:
+        """Break an over-budget sentence into word groups that fit the token budget"""
+        pieces = []
+        current = []
+        current_tokens = 0
+
+        for word in sentence.split(' '):
+            tokens = self.token_counter.count(word)
+            if current_tokens + tokens > self.chunk_tokens and current:
+                pieces.append((' '.join(current), current_tokens))
+                current = []
+                current_tokens = 0
+            current.append(word)
+            current_tokens += tokens
+
+        if current:
+            pieces.append((' '.join(current), current_tokens))
+
+        return pieces
+
+    def chunk_pages(self, pages: List[Tuple[int, str]], file_name: str) -> List[Dict]:
+        """Clean and chunk extracted pages into structured chunks"""
         all_chunks = []
 
         chunk_index = 0
@@ -132,12 +412,18 @@ class PDFParser:
                         'text': chunk,
                         'chunk_index': chunk_index,
                         'page_number': page_num,
-                        'file_name': pdf_path.name
+                        'file_name': file_name,
+                        'token_count': self.token_counter.count(chunk)
                     })
                     chunk_index += 1
 
         return all_chunks
 
+    def parse_pdf(self, pdf_path: Path) -> List[Dict]:
+        """Parse PDF and return structured chunks"""
+        pages = self.extract_text(pdf_path)
+        return self.chunk_pages(pages, pdf_path.name)
+
     def parse_directory(
         self,
         directory: Path,
@@ -167,6 +453,32 @@ class PDFParser:
         return results
 
 
+def find_course_pdfs(
+    course_code: str,
+    data_dir: Path,
+    content_types: List[str] = None,
+    recursive: bool = True
+) -> List[Tuple[str, Path]]:
+    """List (content_type, pdf_path) pairs for a course, in a stable order"""
+    if content_types is None:
+        content_types = ['coursenotes', 'textbook']
+
+    pattern = "**/*.pdf" if recursive else "*.pdf"
+    pdf_files = []
+
+    for content_type in content_types:
+        content_dir = data_dir / content_type / course_code
+
+        if not content_dir.exists():
+            print(f"Warning: Directory not found: {content_dir}")
+            continue
+
+        for pdf_path in sorted(content_dir.glob(pattern)):
+            pdf_files.append((content_type, pdf_path))
+
+    return pdf_files
+
+
 def parse_course_pdfs(
     course_code: str,
     course_name: str,
@@ -199,7 +511,8 @@ def parse_course_pdfs(
                     'file_name': chunk_data['file_name'],
                     'text': chunk_data['text'],
                     'chunk_index': chunk_data['chunk_index'],
-                    'page_number': chunk_data['page_number']
+                    'page_number': chunk_data['page_number'],
+                    'token_count': chunk_data['token_count']
                 })
 
     return all_documents
@@ -0,0 +1,263 @@
+"""
+CPU and memory profiling of a run, tagged by pipeline stage
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter as TallyCounter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from .config import get_config
+from .metrics import get_metrics
+
+
+class Profiler:
+    """Records cProfile data per stage, optional sampled stacks, and tracemalloc peaks
+
+    Code marks stages with profile_stage(name); while profiling runs, metrics
+    timers do this for their 'stage' label. On the thread running a stage, the stage's own
+    cProfile profile replaces the enclosing one, so each <stage>.prof holds
+    only that stage and run.prof merges them all. From Python 3.12 only one
+    cProfile profile can be enabled at a time, so stages running concurrently
+    on other threads are left to the sampler (sample_interval_ms > 0), which
+    walks every thread's stack and prefixes it with the thread's current
+    stage. Stage memory peaks come from tracemalloc, which is process-wide.
+
+    Output in directory: run.prof and <stage>.prof (pstats; snakeviz,
+    gprof2dot, flameprof), stats.txt, stacks.folded (flamegraph.pl,
+    speedscope, inferno), memory.txt and memory.snapshot (tracemalloc), and
+    summary.json with per-stage calls, wall seconds and peak bytes.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        sample_interval_ms: float = 0,
+        trace_memory: bool = True,
+        profile_thread: bool = True
+    ):
+        self.directory = Path(directory)
+        self.sample_interval = sample_interval_ms / 1000.0
+        self.trace_memory = trace_memory
+        self.profile_thread = profile_thread
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, List[cProfile.Profile]] = {}
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        # thread id -> stack of stage names, read by the sampler
+        self._thread_stages: Dict[int, List[str]] = {}
+        self._samples: TallyCounter = TallyCounter()
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._started = 0.0
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        if self.profile_thread:
+            # Time on the starting thread outside any stage
+            self._local.stack = [self._new_profile('other')]
+            self._enable(self._local.stack[-1])
+        if self.sample_interval > 0:
+            self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def _new_profile(self, stage: str) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.setdefault(stage, []).append(profile)
+        return profile
+
+    @staticmethod
+    def _enable(profile: Optional[cProfile.Profile]) -> Optional[cProfile.Profile]:
+        """Enable a profile; None when another profile is active (Python 3.12+ allows one)"""
+        if profile is None:
+            return None
+        try:
+            profile.enable()
+            return profile
+        except ValueError:
+            return None
+
+    @contextmanager
+    def stage(self, name: str):
+        # Per thread: the stack of enabled profiles and this thread's profile of each stage
+        stack = self._local.__dict__.setdefault('stack', [])
+        profiles = self._local.__dict__.setdefault('profiles', {})
+
+        outer = stack[-1] if stack else None
+        if outer is not None:
+            outer.disable()
+        if name not in profiles:
+            profiles[name] = self._new_profile(name)
+        profile = self._enable(profiles[name])
+        stack.append(profile)
+
+        thread_stages = self._thread_stages.setdefault(threading.get_ident(), [])
+        thread_stages.append(name)
+        base_memory = 0
+        if self.trace_memory and tracemalloc.is_tracing():
+            base_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = 0
+            if self.trace_memory and tracemalloc.is_tracing():
+                peak = max(0, tracemalloc.get_traced_memory()[1] - base_memory)
+            thread_stages.pop()
+            if profile is not None:
+                profile.disable()
+            stack.pop()
+            self._enable(outer)
+
+            with self._lock:
+                summary = self._stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0})
+                summary['calls'] += 1
+                summary['seconds'] += seconds
+                summary['peak_bytes'] = max(summary['peak_bytes'], peak)
+
+    def _sample(self) -> None:
+        """Tally every thread's current stack, stage first, in collapsed-stack form"""
+        own = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stages = self._thread_stages.get(thread_id)
+                root = f"stage:{stages[-1]}" if stages else "stage:none"
+                self._samples[';'.join([root] + frames[::-1]).replace('\n', ' ')] += 1
+
+    def stop(self) -> Path:
+        """Stop profiling and write every output file; returns the output directory"""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        for profile in getattr(self._local, 'stack', None) or []:
+            if profile is not None:
+                profile.disable()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        total_seconds = time.perf_counter() - self._started
+
+        report = io.StringIO()
+        merged: Optional[pstats.Stats] = None
+        for stage, profiles in sorted(self._profiles.items()):
+            stats = None
+            for profile in profiles:
+                try:
+                    stats = pstats.Stats(profile) if stats is None else stats.add(profile)
+                except TypeError:
+                    # A profile that never ran has no data
+                    continue
+            if stats is None:
+                continue
+            stats.dump_stats(self.directory / f"{stage}.prof")
+            merged = pstats.Stats(str(self.directory / f"{stage}.prof")) if merged is None \
+                else merged.add(str(self.directory / f"{stage}.prof"))
+
+            report.write(f"==== {stage} ====\n")
+            stats.stream = report
+            stats.sort_stats('cumulative').print_stats(30)
+
+        if merged is not None:
+            merged.dump_stats(self.directory / "run.prof")
+        (self.directory / "stats.txt").write_text(report.getvalue(), encoding='utf-8')
+
+        if self._samples:
+            with open(self.directory / "stacks.folded", 'w', encoding='utf-8') as f:
+                for stack, count in self._samples.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        summary = {
+            'seconds': total_seconds,
+            'stages': self._stages,
+            'samples': sum(self._samples.values())
+        }
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(str(self.directory / "memory.snapshot"))
+
+            lines = [f"Current: {current / 1e6:.1f} MB  Peak since last stage reset: {peak / 1e6:.1f} MB", ""]
+            lines += [
+                f"{stage:<16} peak {s['peak_bytes'] / 1e6:8.1f} MB  over {s['calls']} call(s)"
+                for stage, s in sorted(self._stages.items())
+            ]
+            lines += ["", "Top allocation sites still held:"]
+            lines += [str(stat) for stat in snapshot.statistics('lineno')[:30]]
+            (self.directory / "memory.txt").write_text("\n".join(lines) + "\n", encoding='utf-8')
+            summary['memory_current_bytes'] = current
+
+        (self.directory / "summary.json").write_text(json.dumps(summary, indent=2), encoding='utf-8')
+        return self.directory
+
+
+_profiler: Optional[Profiler] = None
+
+
+def start_profiling(
+    name: str = "run",
+    directory: Optional[str] = None,
+    sample_interval_ms: Optional[float] = None,
+    profile_thread: bool = True
+) -> Profiler:
+    """Start the process-wide profiler, writing to <profiling.directory>/<name>-<timestamp>"""
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+
+    cfg = get_config().get('profiling', {})
+    base = Path(directory or cfg.get('directory', './data/profiles'))
+    _profiler = Profiler(
+        str(base / f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"),
+        sample_interval_ms=cfg.get('sample_interval_ms', 0) if sample_interval_ms is None else sample_interval_ms,
+        trace_memory=cfg.get('memory', True),
+        profile_thread=profile_thread
+    )
+    _profiler.start()
+    get_metrics().stage_hook = profile_stage
+    return _profiler
+
+
+def stop_profiling() -> Optional[Path]:
+    """Stop the profiler and write its output; returns the output directory (None if not running)"""
+    global _profiler
+    if _profiler is None:
+        return None
+    profiler, _profiler = _profiler, None
+    get_metrics().stage_hook = None
+    return profiler.stop()
+
+
+def profiling_active() -> bool:
+    return _profiler is not None
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Attribute the enclosed work to a stage while profiling (no-op otherwise)"""
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
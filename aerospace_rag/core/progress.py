@@ -0,0 +1,130 @@
+"""
+Indexing progress tracking with throughput and ETA reporting
+"""
+
+import time
+from typing import Dict, Any, Optional
+
+
+class IndexProgress:
+    """Tracks indexing throughput (pages/chunks/embeddings per second) and ETA"""
+
+    def __init__(self, total_files: int = 0, total_bytes: int = 0):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files_done = 0
+        self.files_skipped = 0
+        self.files_failed = 0
+        self.bytes_done = 0
+        self.pages = 0
+        self.chunks = 0
+        self.embeddings = 0
+        self.current_file: Optional[str] = None
+        self.start_time = time.perf_counter()
+
+        # Fraction of the current file's bytes already accounted for
+        self._current_bytes = 0
+        self._current_fraction = 0.0
+
+    def start_file(self, file_name: str, size: int) -> None:
+        """Mark the start of a file"""
+        self.current_file = file_name
+        self._current_bytes = size
+        self._current_fraction = 0.0
+
+    def skip_file(self, size: int) -> None:
+        """Remove an already-indexed file from the remaining work"""
+        self.files_skipped += 1
+        self.total_files -= 1
+        self.total_bytes -= size
+
+    def add_pages(self, n: int) -> None:
+        self.pages += n
+
+    def add_chunks(self, n: int) -> None:
+        self.chunks += n
+
+    def add_embeddings(self, n: int, done: int, total: int) -> None:
+        """Record embedded chunks and how far through the current file we are"""
+        self.embeddings += n
+        if total:
+            self._current_fraction = min(1.0, done / total)
+
+    def finish_file(self, failed: bool = False) -> None:
+        """Mark the current file as finished"""
+        if failed:
+            self.files_failed += 1
+        self.files_done += 1
+        self.bytes_done += self._current_bytes
+        self._current_bytes = 0
+        self._current_fraction = 0.0
+        self.current_file = None
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    @property
+    def completed_bytes(self) -> float:
+        """Bytes done, counting partial progress through the current file"""
+        return self.bytes_done + self._current_bytes * self._current_fraction
+
+    @property
+    def fraction(self) -> float:
+        if self.total_bytes <= 0:
+            return 1.0 if self.files_done >= self.total_files else 0.0
+        return min(1.0, self.completed_bytes / self.total_bytes)
+
+    def rate(self, count: int) -> float:
+        elapsed = self.elapsed
+        return count / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """Estimated seconds remaining, extrapolated from byte throughput"""
+        done = self.completed_bytes
+        if done <= 0:
+            return None
+        remaining = max(0.0, self.total_bytes - done)
+        return remaining * self.elapsed / done
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current progress as a plain dict (safe to hand to other threads)"""
+        return {
+            'current_file': self.current_file,
+            'files_done': self.files_done,
+            'files_skipped': self.files_skipped,
+            'files_failed': self.files_failed,
+            'total_files': self.total_files,
+            'fraction': self.fraction,
+            'pages': self.pages,
+            'chunks': self.chunks,
+            'embeddings': self.embeddings,
+            'pages_per_sec': self.rate(self.pages),
+            'chunks_per_sec': self.rate(self.chunks),
+            'embeddings_per_sec': self.rate(self.embeddings),
+            'elapsed_seconds': self.elapsed,
+            'eta_seconds': self.eta_seconds
+        }
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Format a duration as H:MM:SS"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+def format_rates(snapshot: Dict[str, Any]) -> str:
+    """One-line throughput summary for progress bars and status bars"""
+    return (
+        f"{snapshot['pages_per_sec']:.1f} pages/s | "
+        f"{snapshot['chunks_per_sec']:.1f} chunks/s | "
+        f"{snapshot['embeddings_per_sec']:.1f} emb/s | "
+        f"ETA {format_duration(snapshot['eta_seconds'])}"
+    )
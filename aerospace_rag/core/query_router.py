@@ -0,0 +1,115 @@
+"""
+Routing of unfiltered queries to the courses whose centroids are closest
+"""
+
+import threading
+import time
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import get_metrics
+
+
+class CourseRouter:
+    """Picks the few courses an unfiltered query should search, or None for all of them
+
+    Each course is represented by the mean of its chunk embeddings. The query
+    goes to the max_courses courses with the most similar centroids, plus any
+    other course within min_margin of the last one picked; when that leaves
+    more than max_courses (no clear winner) or the best centroid is below
+    min_similarity, routing declines and the caller searches everything.
+    Centroids are reloaded when corpus_version() changes, checked at most
+    every check_interval seconds.
+    """
+
+    def __init__(
+        self,
+        load_centroids: Callable[[], List[Tuple[str, int, np.ndarray]]],
+        corpus_version: Callable[[], Hashable],
+        max_courses: int = 2,
+        min_margin: float = 0.02,
+        min_similarity: float = 0.0,
+        min_courses: int = 4,
+        check_interval: float = 5.0
+    ):
+        self.load_centroids = load_centroids
+        self.corpus_version = corpus_version
+        self.max_courses = max(1, max_courses)
+        self.min_margin = min_margin
+        self.min_similarity = min_similarity
+        self.min_courses = min_courses
+        self.check_interval = check_interval
+        self._codes: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._version: Optional[Hashable] = None
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+        self.metrics = get_metrics()
+
+    def route(self, query_embedding: np.ndarray) -> Optional[List[str]]:
+        """Course codes to search, best first; None means search every course"""
+        self._check_version()
+        with self._lock:
+            codes, matrix = self._codes, self._matrix
+
+        # With few courses a full search scans little more than a routed one
+        if matrix is None or len(codes) < max(self.min_courses, self.max_courses + 1):
+            self._record('skipped')
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            self._record('skipped')
+            return None
+        similarities = matrix @ (query / norm)
+        order = np.argsort(-similarities)
+
+        if similarities[order[0]] < self.min_similarity:
+            self._record('low_confidence')
+            return None
+
+        cutoff = similarities[order[self.max_courses - 1]] - self.min_margin
+        chosen = [i for i in order if similarities[i] >= cutoff]
+        if len(chosen) > self.max_courses:
+            self._record('low_confidence')
+            return None
+
+        self._record('routed')
+        return [codes[i] for i in chosen]
+
+    def record_fallback(self) -> None:
+        """Count a routed search that came back short and was redone over every course"""
+        self._record('fallback')
+
+    def invalidate(self) -> None:
+        """Reload centroids on the next query"""
+        with self._lock:
+            self._version = None
+            self._version_checked = 0.0
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._version_checked < self.check_interval:
+            return
+        version = self.corpus_version()
+        if version == self._version:
+            self._version_checked = now
+            return
+
+        rows = self.load_centroids()
+        matrix = None
+        if rows:
+            matrix = np.vstack([centroid for _, _, centroid in rows]).astype(np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1.0, norms)
+
+        with self._lock:
+            self._codes = [code for code, _, _ in rows]
+            self._matrix = matrix
+            self._version = version
+            self._version_checked = now
+
+    def _record(self, outcome: str) -> None:
+        self.metrics.get('query_routes_total').inc(outcome=outcome)
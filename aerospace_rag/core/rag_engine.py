@@ -2,14 +2,41 @@
 RAG (Retrieval-Augmented Generation) Engine
 """
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from contextlib import nullcontext
 from pathlib import Path
+import time
 import numpy as np
 
 from .config import get_config
-from .database import DatabaseManager
+from .database import DatabaseManager, EmbeddingModelChanged, StaleBatchError, estimate_index_bytes
+from .metrics import get_metrics, load_metrics_state, flush_metrics
 from .ollama_client import OllamaClient
-from .pdf_parser import parse_course_pdfs
+from .pdf_parser import PDFParser, EXTRACTOR_VERSION, compute_file_hash, find_course_pdfs
+from .extract_cache import PageTextCache
+from .progress import IndexProgress
+from .dedup import ChunkDeduplicator, content_hash
+from .context_builder import ContextBuilder
+from .compression import SentenceCompressor
+from .reranker import CrossEncoderReranker
+from .retrieval_cache import RetrievalCache, embedding_key
+from .query_router import CourseRouter
+from .evaluation import load_eval_set, evidence_recall, load_calibration, save_calibration
+from .tokenizer import get_token_counter
+from .session import SessionManager
+from .embedding_migration import EmbeddingMigration
+from .cancellation import CancelToken, OperationCancelled
+from .snapshot import export_snapshot, import_snapshot
+from .profiling import profile_stage
+
+
+CONTENT_TYPES = ['coursenotes', 'textbook']
+
+SYSTEM_PROMPT = """You are an expert aerospace engineering assistant.
+            Use the provided context from MIT aerospace course materials to answer questions accurately and helpfully.
+            If the context doesn't contain enough information, say so.
+            Explain concepts clearly and include relevant equations, principles, or examples when appropriate.
+            Always cite which source you're using in your answer."""
 
 
 class RAGEngine:
@@ -19,31 +46,58 @@ class RAGEngine:
         self.config = get_config()
         self.db = DatabaseManager()
         self.ollama = OllamaClient()
+        self.db.on_embedding_model_change = self._follow_embedding_model
+        self.metrics = load_metrics_state(get_metrics())
+        self._dedup: Optional[ChunkDeduplicator] = None
+        self.reranker = self._make_reranker()
+        self.retrieval_cache = self._make_retrieval_cache()
+        self.router = self._make_router()
+
+        session_cfg = self.config.get('session', {})
+        self.sessions = SessionManager(
+            idle_timeout=session_cfg.get('idle_timeout', 3600),
+            max_sessions=session_cfg.get('max_sessions', 100)
+        )
 
-    def initialize(self) -> None:
-        """Initialize the RAG system"""
+    def initialize(self, check_ollama: bool = True) -> None:
+        """Initialize the RAG system (check_ollama=False for database-only work such as snapshots)"""
         print("Initializing Aerospace RAG System...")
 
         # Check Ollama connection
-        if not self.ollama.check_connection():
+        if check_ollama and not self.ollama.check_connection():
             raise ConnectionError("Failed to connect to Ollama. Make sure Ollama is running.")
 
         # Connect to database
         self.db.connect()
 
         # Initialize schema
-        self.db.init_schema()
+        self.db.init_schema(default_embedding_model=self.ollama.embedding_model)
+
+        # Stored vectors decide the embedding model: queries must be embedded by the
+        # model version the active column was filled with
+        active_model = self.db.embedding_model['model']
+        if active_model != self.ollama.embedding_model:
+            print(f"Note: using embedding model '{active_model}' (active in the database) instead of "
+                  f"the configured '{self.ollama.embedding_model}'; run migrate-embeddings to switch")
+            self.ollama.embedding_model = active_model
 
         print("✓ RAG system initialized successfully")
 
     def index_documents(
         self,
         course_code: Optional[str] = None,
-        content_types: List[str] = None
+        content_types: List[str] = None,
+        resume: bool = True,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        cancel: Optional[CancelToken] = None
     ) -> None:
-        """Index documents from PDFs into the database"""
+        """Index documents from PDFs into the database, committing per batch and resuming from checkpoints
+
+        Cancelling `cancel` stops after the current batch (committed batches
+        resume next run) and raises OperationCancelled.
+        """
         if content_types is None:
-            content_types = ['coursenotes', 'textbook']
+            content_types = CONTENT_TYPES
 
         courses = self.config.courses
         data_dir = Path(self.config.paths['data_dir'])
@@ -54,151 +108,1078 @@ class RAGEngine:
                 raise ValueError(f"Unknown course code: {course_code}")
             courses = {course_code: courses[course_code]}
 
-        total_indexed = 0
-
-        for code, name in courses.items():
-            print(f"\n{'='*60}")
-            print(f"Indexing: {code} - {name}")
-            print(f"{'='*60}")
+        indexing_cfg = self.config.get('indexing', {})
+        # A full re-index of a course builds a new generation beside the live one and
+        # swaps it in when complete, so queries never see a half-loaded course
+        blue_green = (
+            not resume
+            and indexing_cfg.get('blue_green', True)
+            and set(CONTENT_TYPES) <= set(content_types)
+        )
 
-            try:
-                # Parse PDFs
-                documents = parse_course_pdfs(code, name, data_dir, content_types)
+        if not resume and not blue_green:
+            for code in courses:
+                # Re-indexing a whole course empties its partition instead of deleting file by file
+                if set(CONTENT_TYPES) <= set(content_types):
+                    self.db.truncate_course(code)
+                else:
+                    self.db.clear_checkpoints(code)
 
-                if not documents:
-                    print(f"No documents found for {code}")
-                    continue
+        # Discover all work up front so throughput and ETA cover the whole run
+        work = []
+        for code, name in courses.items():
+            for content_type, pdf_path in find_course_pdfs(code, data_dir, content_types):
+                work.append((code, name, content_type, pdf_path))
 
-                print(f"\nGenerating embeddings for {len(documents)} chunks...")
+        progress = IndexProgress(
+            total_files=len(work),
+            total_bytes=sum(pdf_path.stat().st_size for _, _, _, pdf_path in work)
+        )
+        parser = self._make_parser()
+        batch_size = indexing_cfg.get('batch_size', 32)
+        # Signatures of courses being rebuilt belong to the generation about to be replaced
+        rebuilt = list(courses) if blue_green else None
+        self._dedup = self._make_deduplicator(exclude_courses=rebuilt)
 
-                # Generate embeddings
-                texts = [doc['text'] for doc in documents]
-                embeddings = self.ollama.generate_embeddings_batch(texts)
+        def report():
+            if progress_callback:
+                progress_callback(progress.snapshot())
 
-                # Prepare batch insert
-                batch_data = []
-                for doc, embedding in zip(documents, embeddings):
-                    embedding_list = embedding.tolist() if isinstance(embedding, np.ndarray) else embedding
+        total_indexed = 0
+        indexed_by_course: Dict[str, int] = {}
+        current_course = None
+        generation = None
 
-                    batch_data.append((
-                        doc['course_code'],
-                        doc['course_name'],
-                        doc['content_type'],
-                        doc['file_name'],
-                        doc['text'],
-                        doc['chunk_index'],
-                        doc['page_number'],
-                        embedding_list,
-                        None  # metadata
-                    ))
+        # Cancelling also interrupts the statement in flight, e.g. a vector index build
+        with cancel.hook(self.db.canceller()) if cancel else nullcontext():
+            try:
+                for code, name, content_type, pdf_path in work:
+                    if cancel is not None:
+                        cancel.check()
+                    if code != current_course:
+                        # Swap each course in as soon as it is built, so at most one shadow exists at a time
+                        if generation is not None:
+                            self._activate_generation(generation, rebuilt)
+                            generation = None
+                        current_course = code
+                        print(f"\n{'='*60}")
+                        print(f"Indexing: {code} - {name}")
+                        print(f"{'='*60}")
+                        if blue_green:
+                            generation = self.db.create_shadow(code, name)
+                            print(f"Building new generation in {generation['table']}")
 
-                # Insert into database
-                print(f"Inserting {len(batch_data)} chunks into database...")
-                self.db.insert_documents_batch(batch_data)
+                    try:
+                        inserted = self._index_file(
+                            parser, code, name, content_type, pdf_path, batch_size, progress, report,
+                            generation=generation, cancel=cancel
+                        )
+                        total_indexed += inserted
+                        indexed_by_course[code] = indexed_by_course.get(code, 0) + inserted
+                    except OperationCancelled:
+                        raise
+                    except Exception as e:
+                        if cancel is not None and cancel.cancelled:
+                            raise OperationCancelled("Indexing cancelled") from e
+                        print(f"✗ Error indexing {pdf_path.name} ({code}): {e}")
+                        progress.finish_file(failed=True)
+                        if generation is not None:
+                            generation['failed_files'] = generation.get('failed_files', 0) + 1
+                    report()
 
-                total_indexed += len(batch_data)
-                print(f"✓ Successfully indexed {len(batch_data)} chunks for {code}")
+                if generation is not None:
+                    self._activate_generation(generation, rebuilt)
+                    generation = None
 
             except Exception as e:
-                print(f"✗ Error indexing {code}: {e}")
+                if not isinstance(e, OperationCancelled) and not (cancel is not None and cancel.cancelled):
+                    raise
+                if generation is not None and generation.get('status') != 'active':
+                    # The cancelled statement left the transaction aborted
+                    self.db.conn.rollback()
+                    self.db.discard_shadow(generation)
+                    print(f"✗ Indexing cancelled; {current_course} keeps its current generation")
+                else:
+                    print("✗ Indexing cancelled; completed batches resume on the next run")
+                raise OperationCancelled("Indexing cancelled") from e
+
+        # Each course partition gets an IVFFlat index sized to its new contents
+        # (shadow generations were indexed before they went live)
+        for code, inserted in indexed_by_course.items():
+            if inserted and not blue_green:
+                with self.metrics.timer('index_stage_seconds', stage='vector_index'):
+                    self.db.build_vector_index(code)
+        self._on_corpus_changed()
 
         print(f"\n{'='*60}")
         print(f"Total documents indexed: {total_indexed}")
+        if self._dedup is not None and (self._dedup.exact_hits or self._dedup.near_hits):
+            print(f"Deduplicated {self._dedup.exact_hits} exact and {self._dedup.near_hits} "
+                  f"near-duplicate chunk(s) (not embedded)")
+        if progress.files_skipped:
+            print(f"Skipped {progress.files_skipped} unchanged file(s) already indexed")
+        if progress.files_failed:
+            print(f"Failed {progress.files_failed} file(s); re-run to resume them")
         print(f"{'='*60}")
 
+    def index_file(
+        self,
+        course_code: str,
+        content_type: str,
+        pdf_path: Path,
+        cancel: Optional[CancelToken] = None
+    ) -> Optional[int]:
+        """Index (or re-index) one new or modified PDF into the live partition
+
+        Returns the number of chunks inserted, or None when the file was
+        unchanged and skipped by its checkpoint. A modified file has its old
+        rows replaced, even if it now yields no chunks (0). Call
+        finish_incremental() once a burst of files is done.
+        """
+        if course_code not in self.config.courses:
+            raise ValueError(f"Unknown course code: {course_code}")
+        if self._dedup is None:
+            self._dedup = self._make_deduplicator()
+
+        progress = IndexProgress(total_files=1, total_bytes=pdf_path.stat().st_size)
+        inserted = self._index_file(
+            self._make_parser(), course_code, self.config.courses[course_code], content_type, pdf_path,
+            self.config.get('indexing', {}).get('batch_size', 32), progress, lambda: None, cancel=cancel
+        )
+        return None if progress.files_skipped else inserted
+
+    def retire_file(self, course_code: str, content_type: str, file_name: str) -> int:
+        """Remove a deleted PDF's chunks from the index; returns the number removed"""
+        removed = self.db.retire_file(course_code, content_type, file_name)
+        # MinHash signatures of the removed chunks would otherwise still match
+        if self._dedup is not None and self._dedup.near_duplicates:
+            self._dedup = None
+        return removed
+
+    def finish_incremental(self, course_codes: List[str], rebuilt_rows: Dict[str, int]) -> Dict[str, int]:
+        """Bring vector indexes and centroids up to date after incremental changes
+
+        IVFFlat indexes absorb inserts, but their lists were sized and trained
+        for the rows at build time, so a course's index is rebuilt once its
+        row count has moved by indexing.rebuild_ratio since then (rebuilt_rows
+        holds those counts and is returned updated); otherwise only the
+        centroids are refreshed. The rebuild is concurrent (see
+        build_vector_index), so the course keeps serving queries meanwhile.
+        """
+        ratio = self.config.get('indexing', {}).get('rebuild_ratio', 0.2)
+        for code in course_codes:
+            rows = self.db.get_document_count(code)
+            built = rebuilt_rows.get(code)
+            if built is None or abs(rows - built) > ratio * max(built, 1):
+                with self.metrics.timer('index_stage_seconds', stage='vector_index'):
+                    self.db.build_vector_index(code)
+                rebuilt_rows[code] = rows
+            else:
+                self.db.refresh_centroids(code)
+        self._on_corpus_changed()
+        return rebuilt_rows
+
+    def compare_chunking(
+        self,
+        course_code: Optional[str] = None,
+        content_types: List[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """Compare character and token chunking on the corpus without embedding anything"""
+        courses = self.config.courses
+        if course_code:
+            if course_code not in courses:
+                raise ValueError(f"Unknown course code: {course_code}")
+            courses = {course_code: courses[course_code]}
+
+        data_dir = Path(self.config.paths['data_dir'])
+        base = self._make_parser()
+        parsers = {
+            'characters': PDFParser(
+                chunk_size=base.chunk_size, chunk_overlap=base.chunk_overlap, chunk_mode='characters'
+            ),
+            'tokens': PDFParser(
+                chunk_mode='tokens', chunk_tokens=base.chunk_tokens,
+                chunk_overlap_tokens=base.chunk_overlap_tokens
+            )
+        }
+        totals = {mode: {'chunks': 0, 'tokens': 0, 'text_bytes': 0, 'max_tokens': 0} for mode in parsers}
+
+        for code in courses:
+            for _, pdf_path in find_course_pdfs(code, data_dir, content_types):
+                try:
+                    pages = base.extract_text(pdf_path)
+                except Exception as e:
+                    print(f"  ✗ Error parsing {pdf_path.name}: {e}")
+                    continue
+
+                for mode, parser in parsers.items():
+                    for chunk in parser.chunk_pages(pages, pdf_path.name):
+                        totals[mode]['chunks'] += 1
+                        totals[mode]['tokens'] += chunk['token_count']
+                        totals[mode]['text_bytes'] += len(chunk['text'].encode('utf-8'))
+                        totals[mode]['max_tokens'] = max(totals[mode]['max_tokens'], chunk['token_count'])
+
+        for mode, t in totals.items():
+            t['avg_tokens'] = t['tokens'] / t['chunks'] if t['chunks'] else 0.0
+            t['estimated_bytes'] = estimate_index_bytes(t['chunks'], t['text_bytes'])
+
+        return totals
+
+    def _activate_generation(self, generation: Dict[str, Any], rebuilt: Optional[List[str]] = None) -> bool:
+        """Validate a fully loaded shadow generation, then swap it in or discard it"""
+        cfg = self.config.get('indexing', {})
+        code = generation['course_code']
+        stats = self.db.shadow_stats(generation)
+        live_rows = self.db.get_document_count(code)
+
+        problems = []
+        if generation.get('failed_files'):
+            problems.append(f"{generation['failed_files']} file(s) failed")
+        if stats['rows'] != generation['expected_chunks']:
+            problems.append(f"{stats['rows']} rows stored, {generation['expected_chunks']} chunks extracted")
+        if stats['unembedded']:
+            problems.append(f"{stats['unembedded']} canonical chunk(s) without an embedding")
+        min_ratio = cfg.get('min_generation_ratio', 0.5)
+        if live_rows and stats['rows'] < min_ratio * live_rows:
+            problems.append(f"{stats['rows']} rows is under {min_ratio:.0%} of the live {live_rows}")
+
+        if problems:
+            print(f"✗ Keeping the current generation of {code}: {'; '.join(problems)}")
+            self.db.discard_shadow(generation)
+            # In-memory signatures may point at the discarded rows
+            if self._dedup is not None and self._dedup.near_duplicates:
+                self._dedup = self._make_deduplicator(exclude_courses=rebuilt)
+            return False
+
+        with self.metrics.timer('index_stage_seconds', stage='vector_index'):
+            self.db.finalize_shadow(generation, stats)
+        self.db.activate_shadow(generation, keep_generations=cfg.get('keep_generations', 1))
+        generation['status'] = 'active'
+        print(f"✓ Activated {generation['table']} for {code} ({stats['rows']} chunks, "
+              f"previously {live_rows})")
+        return True
+
+    def migrate_embeddings(
+        self,
+        model: str,
+        cutover: bool = True,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """Re-embed the corpus with another model while queries keep using the active one"""
+        batch_size = self.config.get('embedding_migration', {}).get('batch_size', 64)
+        migration = EmbeddingMigration(self.db, self.ollama, model, batch_size=batch_size)
+        version = migration.prepare()
+        print(f"Embedding with {model} ({version['dimension']} dimensions) into {version['column']}")
+
+        with self.metrics.timer('index_stage_seconds', stage='reembed'):
+            result = migration.run(cutover=cutover, progress_callback=progress_callback)
+        if result['activated']:
+            self.ollama.embedding_model = model
+            self._on_corpus_changed()
+        return result
+
+    def rollback_course(self, course_code: str) -> str:
+        """Put a course's previous index generation back in service; returns its table name"""
+        if course_code not in self.config.courses:
+            raise ValueError(f"Unknown course code: {course_code}")
+        table = self.db.rollback_generation(course_code)
+        self._on_corpus_changed()
+        return table
+
+    def export_snapshot(
+        self,
+        directory: str,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """Write the index (chunks, metadata, active-model embeddings) to a snapshot directory"""
+        rag = self.config.rag
+        chunking = {key: rag[key] for key in (
+            'chunk_mode', 'chunk_size', 'chunk_overlap', 'chunk_tokens', 'chunk_overlap_tokens'
+        ) if key in rag}
+        return export_snapshot(self.db, directory, chunking=chunking, progress_callback=progress_callback)
+
+    def import_snapshot(
+        self,
+        directory: str,
+        replace: bool = False,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """Load a snapshot into the database without embedding anything"""
+        batch_size = self.config.get('snapshot', {}).get('copy_batch_size', 5000)
+        result = import_snapshot(
+            self.db, directory, replace=replace, batch_size=batch_size, progress_callback=progress_callback
+        )
+        self.ollama.embedding_model = self.db.embedding_model['model']
+        self._on_corpus_changed()
+        return result
+
+    def _follow_embedding_model(self, model: Dict[str, Any]) -> None:
+        """Embed queries and new chunks with the model another process cut over to
+
+        Cached results are dropped on the next corpus_version() check, which
+        reports the new version.
+        """
+        self.ollama.embedding_model = model['model']
+
+    def _on_corpus_changed(self) -> None:
+        """Drop cached search results and centroids after this process changed the corpus"""
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.invalidate()
+        if self.router is not None:
+            self.router.invalidate()
+
+    def _make_deduplicator(self, exclude_courses: Optional[List[str]] = None) -> Optional[ChunkDeduplicator]:
+        """Create the chunk deduplicator from the dedup configuration (None when disabled)"""
+        cfg = self.config.get('dedup', {})
+        if not cfg.get('enabled', True):
+            return None
+
+        dedup = ChunkDeduplicator(
+            near_duplicates=cfg.get('near_duplicates', False),
+            num_perm=cfg.get('minhash_permutations', 64),
+            bands=cfg.get('minhash_bands', 16),
+            threshold=cfg.get('near_duplicate_threshold', 0.9)
+        )
+        if dedup.near_duplicates:
+            print("Loading MinHash signatures for near-duplicate detection...")
+            dedup.load_signatures(self.db.iter_minhash_signatures(exclude_courses=exclude_courses))
+            print(f"✓ Loaded {len(dedup.lsh)} signatures")
+        return dedup
+
+    def _make_parser(self) -> PDFParser:
+        """Create a PDF parser from the RAG configuration"""
+        return PDFParser(
+            chunk_size=self.config.rag.get('chunk_size', 512),
+            chunk_overlap=self.config.rag.get('chunk_overlap', 100),
+            chunk_mode=self.config.rag.get('chunk_mode', 'characters'),
+            chunk_tokens=self.config.rag.get('chunk_tokens', 512),
+            chunk_overlap_tokens=self.config.rag.get('chunk_overlap_tokens', 64),
+            page_cache=self._make_page_cache(),
+            parallel_min_pages=self.config.get('extraction', {}).get('parallel_min_pages', 200),
+            pages_per_range=self.config.get('extraction', {}).get('pages_per_range', 50),
+            workers=self.config.get('extraction', {}).get('workers', 0),
+            extraction_strategy=self.config.get('extraction', {}).get('strategy', 'adaptive')
+        )
+
+    def _make_page_cache(self) -> Optional[PageTextCache]:
+        """Create the extracted page-text cache from the extraction configuration"""
+        cfg = self.config.get('extraction', {})
+        if not cfg.get('cache', True):
+            return None
+        # Strategies produce different text for the same PDF, so each gets its own entries
+        version = f"{EXTRACTOR_VERSION}-{cfg.get('strategy', 'adaptive')}"
+        return PageTextCache(cfg.get('cache_dir', './data/.cache/pages'), version)
+
+    def _index_file(
+        self,
+        parser: PDFParser,
+        course_code: str,
+        course_name: str,
+        content_type: str,
+        pdf_path: Path,
+        batch_size: int,
+        progress: IndexProgress,
+        report: Callable[[], None],
+        generation: Optional[Dict[str, Any]] = None,
+        cancel: Optional[CancelToken] = None
+    ) -> int:
+        """Index one PDF in checkpointed batches; returns the number of chunks inserted
+
+        With a shadow generation the file is loaded into the shadow table instead,
+        in full, and its checkpoint is recorded on the generation for activation.
+        """
+        file_name = pdf_path.name
+        file_hash = compute_file_hash(pdf_path)
+        checkpoint = None if generation else self.db.get_checkpoint(course_code, content_type, file_name)
+
+        if checkpoint and checkpoint['file_hash'] == file_hash and checkpoint['status'] == 'complete':
+            progress.skip_file(pdf_path.stat().st_size)
+            return 0
+
+        progress.start_file(file_name, pdf_path.stat().st_size)
+        report()
+
+        print(f"Parsing: {file_name}")
+        with self.metrics.timer('index_stage_seconds', stage='extract'):
+            pages = parser.extract_text(pdf_path, file_hash=file_hash)
+        progress.add_pages(len(pages))
+        self.metrics.get('index_pages_total').inc(len(pages))
+
+        with self.metrics.timer('index_stage_seconds', stage='chunk'):
+            chunks = parser.chunk_pages(pages, file_name)
+        progress.add_chunks(len(chunks))
+        self.metrics.get('index_chunks_total').inc(len(chunks))
+        print(f"  ✓ Extracted {len(chunks)} chunks")
+
+        # Chunking is deterministic for an unchanged file, so a partial checkpoint
+        # tells us exactly which chunks are already in the database
+        if checkpoint and checkpoint['file_hash'] == file_hash and checkpoint['chunks_total'] == len(chunks):
+            start = checkpoint['chunks_done']
+            if start:
+                print(f"  Resuming at chunk {start}/{len(chunks)}")
+        elif generation is None:
+            self.db.reset_file(course_code, content_type, file_name, file_hash, len(chunks))
+            start = 0
+        else:
+            start = 0
+
+        course_id, file_id = self.db.ensure_file(course_code, course_name, content_type, file_name)
+
+        inserted = 0
+        for batch_start in range(start, len(chunks), batch_size):
+            if cancel is not None:
+                cancel.check()
+            batch = chunks[batch_start:batch_start + batch_size]
+            done = batch_start + len(batch)
+            for attempt in range(3):
+                try:
+                    n_new, n_duplicates = self._store_batch(
+                        batch, course_id, file_id, course_code, content_type, file_name, file_hash,
+                        done, len(chunks), generation
+                    )
+                    break
+                except StaleBatchError as e:
+                    # A canonical went away after classification; classifying again embeds those chunks
+                    if attempt == 2:
+                        raise
+                    print(f"  {e}; storing the batch again")
+                except EmbeddingModelChanged as e:
+                    # Another process cut over to a new embedding model. The live path embeds the
+                    # batch again with it; a shadow's earlier batches are in the old column, so it fails
+                    if generation is not None or attempt == 2:
+                        raise
+                    print(f"  {e}; re-embedding the batch with {self.ollama.embedding_model}")
+
+            inserted += len(batch)
+            progress.add_embeddings(n_new, done, len(chunks))
+            self.metrics.get('index_embeddings_total').inc(n_new)
+            if n_duplicates:
+                self.metrics.get('index_duplicates_total').inc(n_duplicates)
+            report()
+
+        if generation is not None:
+            generation['expected_chunks'] += len(chunks)
+            generation['checkpoints'].append((content_type, file_name, file_hash, len(chunks)))
+        elif not chunks:
+            # Nothing to embed, but remember the file so it isn't re-parsed next time
+            self.db.insert_documents_checkpointed([], course_code, content_type, file_name, file_hash, 0, 0)
+
+        progress.finish_file()
+        print(f"  ✓ Indexed {inserted} chunks from {file_name}")
+        return inserted
+
+    def _store_batch(
+        self,
+        batch: List[Dict[str, Any]],
+        course_id: int,
+        file_id: int,
+        course_code: str,
+        content_type: str,
+        file_name: str,
+        file_hash: str,
+        done: int,
+        total: int,
+        generation: Optional[Dict[str, Any]] = None
+    ) -> Tuple[int, int]:
+        """Deduplicate, embed and store one batch of a file's chunks; returns (embedded, duplicates)"""
+        texts = [c['text'] for c in batch]
+
+        # Decide what is new content before paying for embeddings
+        if self._dedup is not None:
+            decisions = self._dedup.classify(
+                texts, self.db.find_canonical_hashes([content_hash(t) for t in texts], generation)
+            )
+        else:
+            decisions = [{'hash': content_hash(t), 'canonical': None, 'signature': None} for t in texts]
+
+        new_chunks = [c for c, d in zip(batch, decisions) if d['canonical'] is None]
+        with self.metrics.timer('index_stage_seconds', stage='embed'):
+            embeddings = iter(self.ollama.generate_embeddings_batch([c['text'] for c in new_chunks]))
+
+        batch_data = []
+        duplicate_data = []
+        for chunk, decision in zip(batch, decisions):
+            if decision['canonical'] is not None:
+                duplicate_data.append((
+                    course_id,
+                    file_id,
+                    chunk['text'],
+                    chunk['chunk_index'],
+                    chunk['page_number'],
+                    None,  # metadata
+                    chunk['token_count'],
+                    decision['hash'],
+                    decision['canonical']
+                ))
+                continue
+
+            embedding = next(embeddings)
+            embedding_list = embedding.tolist() if isinstance(embedding, np.ndarray) else embedding
+            signature = decision['signature']
+
+            batch_data.append((
+                course_id,
+                file_id,
+                chunk['text'],
+                chunk['chunk_index'],
+                chunk['page_number'],
+                embedding_list,
+                None,  # metadata
+                chunk['token_count'],
+                decision['hash'],
+                signature.tobytes() if signature is not None else None
+            ))
+
+        with self.metrics.timer('index_stage_seconds', stage='insert'):
+            if generation is not None:
+                self.db.insert_documents_shadow(generation, batch_data, duplicate_data)
+            else:
+                self.db.insert_documents_checkpointed(
+                    batch_data, course_code, content_type, file_name, file_hash, done, total,
+                    duplicates=duplicate_data
+                )
+        if self._dedup is not None:
+            self._dedup.commit(decisions)
+
+        return len(new_chunks), len(duplicate_data)
+
     def query(
         self,
         question: str,
         course_code: Optional[str] = None,
         top_k: int = None,
-        stream: bool = False
+        stream: bool = False,
+        session_id: Optional[str] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+        cancel: Optional[CancelToken] = None
     ) -> Dict[str, Any]:
-        """Query the RAG system"""
+        """Query the RAG system
+
+        With a session_id, earlier turns of that session are sent as chat history
+        and this turn is appended to it. on_token receives the answer as it
+        streams; cancelling `cancel` aborts the search or generation in flight
+        and raises OperationCancelled.
+        """
         if top_k is None:
             top_k = self.config.rag['top_k']
 
+        # A running statement is interrupted by cancelling it on the server
+        with cancel.hook(self.db.canceller()) if cancel else nullcontext():
+            if session_id is None:
+                return self._query(question, course_code, top_k, stream, on_token=on_token, cancel=cancel)
+
+            session = self.sessions.get(session_id)
+            # One turn at a time per session, so turns are appended in order
+            with session.lock:
+                return self._query(
+                    question, course_code, top_k, stream, session, on_token=on_token, cancel=cancel
+                )
+
+    def _query(
+        self,
+        question: str,
+        course_code: Optional[str],
+        top_k: int,
+        stream: bool,
+        session=None,
+        on_token: Optional[Callable[[str], None]] = None,
+        cancel: Optional[CancelToken] = None
+    ) -> Dict[str, Any]:
+        check_cancelled = cancel.check if cancel else (lambda: None)
+
         similarity_threshold = self.config.rag['similarity_threshold']
+        query_start = time.perf_counter()
+        timings = {
+            'embed_seconds': None,
+            'search_seconds': None,
+            'rerank_seconds': None,
+            'context_build_seconds': None,
+            'generation_seconds': None,
+            'time_to_first_token_seconds': None,
+            'tokens_per_second': None,
+            'prompt_tokens': None,
+            'completion_tokens': None,
+            'retrieved_rows': 0,
+            'cache_hits': 0,
+            'routed_courses': None,
+            'total_seconds': None
+        }
+
+        system_prompt = SYSTEM_PROMPT
+        history = None
+        history_tokens = 0
+        retrieval_text = question
+        if session is not None:
+            session_cfg = self.config.get('session', {})
+            counter = get_token_counter()
+            session.fold(
+                counter,
+                max_turns=session_cfg.get('max_turns', 8),
+                max_tokens=session_cfg.get('max_history_tokens', 2048)
+            )
+            system_prompt = session.system_message(SYSTEM_PROMPT)
+            history = session.history_messages()
+            history_tokens = session.history_tokens(counter)
+            # Follow-ups like "why?" retrieve poorly alone, so prepend the previous question
+            if session_cfg.get('condense_retrieval', True):
+                retrieval_text = ' '.join(session.recent_questions(1) + [question])
 
         try:
             # Generate query embedding
             print("Generating query embedding...")
-            query_embedding = self.ollama.generate_embedding(question)
+            with self.metrics.timer('stage_seconds', stage='embed') as t:
+                query_embedding = self._embed_query(retrieval_text, timings)
+            timings['embed_seconds'] = t['seconds']
+            check_cancelled()
 
             # Search for similar documents
             print("Searching for relevant documents...")
-            results = self.db.similarity_search(
-                query_embedding,
-                top_k=top_k,
-                course_code=course_code,
-                similarity_threshold=similarity_threshold
-            )
+            with self.metrics.timer('stage_seconds', stage='search') as t:
+                # With re-ranking, retrieve a wider pool and let the cross-encoder pick top_k
+                fetch_k = top_k
+                if self.reranker:
+                    fetch_k = max(top_k, self.config.get('rerank', {}).get('candidate_pool', 30))
+                include_embeddings = self.config.get('context', {}).get('mmr', True)
+                routed = self.router.route(query_embedding) if self.router and not course_code else None
+                results = None
+                if routed:
+                    results = self._search(
+                        query_embedding, fetch_k, None, similarity_threshold,
+                        include_embeddings=include_embeddings, timings=timings, course_codes=routed
+                    )
+                    timings['routed_courses'] = routed
+                    # Too few hits in the routed courses: the question may belong elsewhere
+                    if len(results) < top_k:
+                        self.router.record_fallback()
+                        timings['routed_courses'] = None
+                        results = None
+                if results is None:
+                    results = self._search(
+                        query_embedding, fetch_k, course_code, similarity_threshold,
+                        include_embeddings=include_embeddings, timings=timings
+                    )
+            timings['search_seconds'] = t['seconds']
+            check_cancelled()
+            timings['retrieved_rows'] = len(results)
+            self.metrics.get('retrieved_rows').observe(len(results))
+
+            if self.reranker and results:
+                with self.metrics.timer('stage_seconds', stage='rerank') as t:
+                    results, rerank_stats = self.reranker.rerank(question, results, top_k)
+                timings['rerank_seconds'] = t['seconds']
+                timings['cache_hits'] += rerank_stats['cache_hits']
 
             if not results:
-                return {
+                return self._finish_query({
                     'question': question,
                     'answer': "I couldn't find any relevant information in the aerospace course materials for your question.",
                     'sources': [],
                     'context_used': False
-                }
+                }, timings, query_start, session)
 
             # Build context from retrieved documents
-            context_parts = []
-            sources = []
-
-            for i, result in enumerate(results, 1):
-                context_parts.append(
-                    f"[Source {i}] From {result['course_name']} "
-                    f"({result['content_type']}, {result['file_name']}, page {result['page_number']}):\n"
-                    f"{result['text']}\n"
+            with self.metrics.timer('stage_seconds', stage='context_build') as t:
+                builder = self._make_context_builder(
+                    question,
+                    system_prompt=system_prompt,
+                    history_tokens=history_tokens
                 )
-
-                sources.append({
-                    'course_code': result['course_code'],
-                    'course_name': result['course_name'],
-                    'content_type': result['content_type'],
-                    'file_name': result['file_name'],
-                    'page_number': result['page_number'],
-                    'similarity': result['similarity']
-                })
-
-            context = "\n".join(context_parts)
-
-            # Generate answer using context
-            system_prompt = """You are an expert aerospace engineering assistant.
-            Use the provided context from MIT aerospace course materials to answer questions accurately and helpfully.
-            If the context doesn't contain enough information, say so.
-            Explain concepts clearly and include relevant equations, principles, or examples when appropriate.
-            Always cite which source you're using in your answer."""
+                context, sources, context_stats = builder.build(results, query_embedding)
+            timings['context_build_seconds'] = t['seconds']
+            self.metrics.get('context_tokens_saved_total').inc(context_stats['tokens_saved'])
+            self.metrics.get('context_tokens').observe(context_stats['context_tokens'])
+            check_cancelled()
 
             print("\nGenerating answer...\n")
-            answer = self.ollama.generate_completion(
-                prompt=question,
-                context=context,
-                system_prompt=system_prompt,
-                stream=stream
-            )
+            with profile_stage('generate'):
+                answer, gen_stats = self.ollama.generate_completion_with_stats(
+                    prompt=question,
+                    context=context,
+                    system_prompt=system_prompt,
+                    stream=stream or on_token is not None,
+                    history=history,
+                    on_token=on_token,
+                    cancel=cancel,
+                    session_id=session.id if session is not None else None
+                )
+            self._record_generation(gen_stats, timings)
 
-            return {
+            if session is not None:
+                # Stored exactly as sent so the next turn's prompt starts with this one's
+                session.add_turn(question, self.ollama.format_user_message(question, context), answer)
+
+            return self._finish_query({
                 'question': question,
                 'answer': answer,
                 'sources': sources,
-                'context_used': True
-            }
+                'context_used': True,
+                'context_stats': context_stats
+            }, timings, query_start, session)
 
+        except OperationCancelled:
+            raise
         except Exception as e:
+            # A statement cancelled on the server surfaces as a database error
+            if cancel is not None and cancel.cancelled:
+                raise OperationCancelled("Query cancelled") from e
             raise Exception(f"Query failed: {e}")
 
+    def _embed_query(self, text: str, timings: Dict[str, Any]) -> np.ndarray:
+        """Query embedding, from the retrieval cache when the same text was embedded before"""
+        cache = self.retrieval_cache
+        model = self.ollama.embedding_model
+        if cache is not None:
+            cached = cache.get_embedding(model, text)
+            if cached is not None:
+                timings['cache_hits'] += 1
+                return cached
+
+        embedding = self.ollama.generate_embedding(text)
+        if cache is not None:
+            cache.put_embedding(model, text, embedding)
+        return embedding
+
+    def _search(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        course_code: Optional[str],
+        similarity_threshold: float,
+        include_embeddings: bool,
+        timings: Dict[str, Any],
+        course_codes: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Similarity search through the retrieval cache
+
+        A miss fetches max_k rows (or top_k if larger), so later requests for
+        the same retrieval with any smaller top_k are slices of that one fetch.
+        """
+        hierarchical = self.config.get('hierarchical', {})
+        search = {
+            'course_code': course_code,
+            'similarity_threshold': similarity_threshold,
+            'include_embeddings': include_embeddings,
+            'course_codes': course_codes,
+            'top_files': hierarchical.get('top_files', 20) if hierarchical.get('enabled', False) else 0
+        }
+
+        cache = self.retrieval_cache
+        if cache is None:
+            return self.db.similarity_search(query_embedding, top_k=top_k, **search)
+
+        key = (embedding_key(query_embedding), tuple(course_codes or ())) + tuple(
+            search[name] for name in ('course_code', 'similarity_threshold', 'include_embeddings', 'top_files')
+        )
+        results = cache.get(key, top_k)
+        if results is not None:
+            timings['cache_hits'] += 1
+            return results
+
+        fetch_k = cache.fetch_size(top_k)
+        results = self.db.similarity_search(query_embedding, top_k=fetch_k, **search)
+        cache.put(key, fetch_k, results)
+        return results[:top_k]
+
+    def _make_retrieval_cache(self) -> Optional[RetrievalCache]:
+        """Query embedding and search result cache per the retrieval_cache configuration (None when disabled)"""
+        cfg = self.config.get('retrieval_cache', {})
+        if not cfg.get('enabled', True):
+            return None
+        return RetrievalCache(
+            self.db.corpus_version,
+            max_entries=cfg.get('max_entries', 256),
+            max_k=cfg.get('max_k', 20),
+            embedding_entries=cfg.get('embedding_entries', 1024),
+            check_interval=cfg.get('corpus_check_interval', 1.0)
+        )
+
+    def _make_router(self) -> Optional[CourseRouter]:
+        """Course-centroid router per the routing configuration (None when disabled)"""
+        cfg = self.config.get('routing', {})
+        if not cfg.get('enabled', True):
+            return None
+        return CourseRouter(
+            self.db.get_course_centroids,
+            self.db.corpus_version,
+            max_courses=cfg.get('max_courses', 2),
+            min_margin=cfg.get('min_margin', 0.02),
+            min_similarity=cfg.get('min_similarity', 0.0),
+            min_courses=cfg.get('min_courses', 4),
+            check_interval=cfg.get('centroid_check_interval', 5.0)
+        )
+
+    def _make_reranker(self) -> Optional[CrossEncoderReranker]:
+        """Cross-encoder re-ranker per the rerank configuration (None when disabled)"""
+        cfg = self.config.get('rerank', {})
+        if not cfg.get('enabled', False):
+            return None
+        return CrossEncoderReranker(
+            model_name=cfg.get('model', 'cross-encoder/ms-marco-MiniLM-L-6-v2'),
+            batch_size=cfg.get('batch_size', 32),
+            max_latency_ms=cfg.get('max_latency_ms', 400),
+            cache_size=cfg.get('cache_size', 10000)
+        )
+
+    def _make_context_builder(
+        self,
+        question: str,
+        compress: Optional[bool] = None,
+        system_prompt: str = SYSTEM_PROMPT,
+        history_tokens: int = 0
+    ) -> ContextBuilder:
+        """Context builder whose token budget is what the model's context window leaves for sources"""
+        cfg = self.config.get('context', {})
+        counter = get_token_counter()
+
+        # Prompt = system prompt + history + question + sources; the answer needs num_predict tokens on top
+        reserved = (
+            self.ollama.max_tokens
+            + counter.count(system_prompt)
+            + history_tokens
+            + counter.count(question)
+            + 32  # chat template and "Context:/Question:" framing
+        )
+        budget = max(256, self.ollama.num_ctx - reserved)
+        if cfg.get('max_tokens'):
+            budget = min(budget, cfg['max_tokens'])
+
+        return ContextBuilder(
+            counter,
+            budget,
+            use_mmr=cfg.get('mmr', True),
+            mmr_lambda=cfg.get('mmr_lambda', 0.7),
+            redundancy_threshold=cfg.get('redundancy_threshold', 0.95),
+            merge_adjacent=cfg.get('merge_adjacent', True),
+            compressor=self._make_compressor(compress),
+            expander=self._make_expander()
+        )
+
+    def _make_expander(self) -> Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]]:
+        """Neighbour-window lookup per rag.neighbor_window (None when disabled)"""
+        window = self.config.rag.get('neighbor_window', 0)
+        if not window:
+            return None
+        return lambda hits: self.db.fetch_neighbors(hits, window)
+
+    def _make_compressor(
+        self,
+        enabled: Optional[bool] = None,
+        keep_ratio: Optional[float] = None
+    ) -> Optional[SentenceCompressor]:
+        """Sentence compressor per the compression configuration (None when disabled)"""
+        cfg = self.config.get('compression', {})
+        if enabled is None:
+            enabled = cfg.get('enabled', False)
+        if not enabled:
+            return None
+
+        if keep_ratio is None:
+            # A calibration run picks the smallest ratio within the accuracy-loss cap
+            calibration = load_calibration(cfg.get('calibration_file'))
+            if calibration and calibration.get('max_accuracy_loss') == cfg.get('max_accuracy_loss', 0.05):
+                keep_ratio = calibration['keep_ratio']
+            else:
+                keep_ratio = cfg.get('keep_ratio', 0.5)
+
+        return SentenceCompressor(
+            self.ollama.embed_many,
+            keep_ratio=keep_ratio,
+            min_sentences_per_block=cfg.get('min_sentences_per_block', 1)
+        )
+
+    def _record_generation(self, gen_stats: Dict[str, Any], timings: Dict[str, Any]) -> None:
+        """Copy generation stats into the per-query timings and the metric histograms"""
+        for key in ('generation_seconds', 'time_to_first_token_seconds', 'tokens_per_second',
+                    'prompt_tokens', 'completion_tokens'):
+            timings[key] = gen_stats.get(key)
+
+        self.metrics.get('stage_seconds').observe(gen_stats['generation_seconds'], stage='generation')
+        if gen_stats.get('time_to_first_token_seconds') is not None:
+            self.metrics.get('time_to_first_token_seconds').observe(gen_stats['time_to_first_token_seconds'])
+        if gen_stats.get('tokens_per_second') is not None:
+            self.metrics.get('generation_tokens_per_second').observe(gen_stats['tokens_per_second'])
+
+    def _finish_query(
+        self,
+        result: Dict[str, Any],
+        timings: Dict[str, Any],
+        query_start: float,
+        session=None
+    ) -> Dict[str, Any]:
+        """Attach per-query metrics to a result and record the end-to-end latency"""
+        timings['total_seconds'] = time.perf_counter() - query_start
+        self.metrics.get('query_seconds').observe(timings['total_seconds'])
+        self.metrics.get('queries_total').inc()
+        result['metrics'] = timings
+        if session is not None:
+            result['session_id'] = session.id
+            result['turn'] = session.turn_count
+        return result
+
+    def start_session(self) -> str:
+        """Start a multi-turn chat session and return its id"""
+        return self.sessions.create().id
+
+    def end_session(self, session_id: str) -> None:
+        """Discard a chat session and its history"""
+        self.sessions.end(session_id)
+
+    def evaluate_compression(
+        self,
+        eval_set_path: Optional[str] = None,
+        keep_ratios: List[float] = None,
+        save: bool = True
+    ) -> Dict[str, Any]:
+        """Measure evidence recall and prompt size per keep ratio, and pick the smallest within the loss cap"""
+        cfg = self.config.get('compression', {})
+        eval_set_path = eval_set_path or cfg.get('eval_set', './data/eval_set.jsonl')
+        keep_ratios = sorted(set(keep_ratios or [0.2, 0.3, 0.4, 0.5, 0.7]) | {1.0})
+        max_loss = cfg.get('max_accuracy_loss', 0.05)
+        items = load_eval_set(eval_set_path)
+
+        # Sentence embeddings are identical across ratios; embed each sentence once
+        embedding_cache: Dict[str, np.ndarray] = {}
+
+        def embed_cached(texts: List[str]) -> np.ndarray:
+            missing = [t for t in dict.fromkeys(texts) if t not in embedding_cache]
+            if missing:
+                for text, vector in zip(missing, self.ollama.embed_many(missing)):
+                    embedding_cache[text] = vector
+            return np.vstack([embedding_cache[t] for t in texts])
+
+        totals = {ratio: {'recall': 0.0, 'tokens': 0} for ratio in keep_ratios}
+        for item in items:
+            query_embedding = self.ollama.generate_embedding(item['question'])
+            results = self.db.similarity_search(
+                query_embedding,
+                top_k=item.get('top_k', self.config.rag['top_k']),
+                course_code=item.get('course_code'),
+                similarity_threshold=self.config.rag['similarity_threshold'],
+                include_embeddings=True
+            )
+
+            for ratio in keep_ratios:
+                builder = self._make_context_builder(item['question'], compress=False)
+                if ratio < 1.0:
+                    builder.compressor = SentenceCompressor(
+                        embed_cached, keep_ratio=ratio,
+                        min_sentences_per_block=cfg.get('min_sentences_per_block', 1)
+                    )
+                context, _, stats = builder.build(results, query_embedding)
+                totals[ratio]['recall'] += evidence_recall(context, item['expected'])
+                totals[ratio]['tokens'] += stats['context_tokens']
+
+        n = max(1, len(items))
+        rows = [
+            {'keep_ratio': ratio, 'recall': t['recall'] / n, 'avg_context_tokens': t['tokens'] / n}
+            for ratio, t in totals.items()
+        ]
+        baseline = next(r for r in rows if r['keep_ratio'] == 1.0)
+        for row in rows:
+            row['accuracy_loss'] = baseline['recall'] - row['recall']
+
+        within_cap = [r for r in rows if r['accuracy_loss'] <= max_loss]
+        chosen = min(within_cap, key=lambda r: r['keep_ratio'])
+
+        calibration = {
+            'keep_ratio': chosen['keep_ratio'],
+            'max_accuracy_loss': max_loss,
+            'eval_set': str(eval_set_path),
+            'questions': len(items),
+            'results': rows
+        }
+        if save and cfg.get('calibration_file'):
+            save_calibration(cfg['calibration_file'], calibration)
+        return calibration
+
+    def evaluate_hierarchical(
+        self,
+        eval_set_path: Optional[str] = None,
+        depths: List[int] = None,
+        top_k: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Compare hierarchical (file-then-chunk) retrieval at several depths with flat search
+
+        For each depth, recall is the share of the flat search's top_k chunks
+        the hierarchical search also returns; evidence recall checks the eval
+        set's expected phrases against the retrieved text. Searches bypass the
+        retrieval cache and course routing so each mode is timed on the database.
+        """
+        eval_set_path = eval_set_path or self.config.get('compression', {}).get('eval_set', './data/eval_set.jsonl')
+        depths = sorted(set(depths or [5, 10, 20, 50]))
+        top_k = top_k or self.config.rag['top_k']
+        threshold = self.config.rag['similarity_threshold']
+        items = load_eval_set(eval_set_path)
+
+        modes = [0] + depths
+        latencies: Dict[int, List[float]] = {depth: [] for depth in modes}
+        totals = {depth: {'recall': 0.0, 'evidence': 0.0} for depth in modes}
+
+        for item in items:
+            query_embedding = self.ollama.generate_embedding(item['question'])
+            flat_ids = None
+            for depth in modes:
+                start = time.perf_counter()
+                results = self.db.similarity_search(
+                    query_embedding,
+                    top_k=top_k,
+                    course_code=item.get('course_code'),
+                    similarity_threshold=threshold,
+                    top_files=depth
+                )
+                latencies[depth].append(time.perf_counter() - start)
+
+                ids = {r['id'] for r in results}
+                if flat_ids is None:
+                    flat_ids = ids
+                totals[depth]['recall'] += len(ids & flat_ids) / len(flat_ids) if flat_ids else 1.0
+                totals[depth]['evidence'] += evidence_recall(
+                    '\n'.join(r['text'] for r in results), item['expected']
+                )
+
+        n = max(1, len(items))
+        rows = []
+        for depth in modes:
+            times = sorted(latencies[depth])
+            rows.append({
+                'top_files': depth,
+                'recall': totals[depth]['recall'] / n,
+                'evidence_recall': totals[depth]['evidence'] / n,
+                'mean_seconds': sum(times) / len(times) if times else None,
+                'p95_seconds': times[min(len(times) - 1, int(0.95 * len(times)))] if times else None
+            })
+
+        return {'eval_set': str(eval_set_path), 'questions': len(items), 'top_k': top_k, 'results': rows}
+
     def get_statistics(self) -> Dict[str, Any]:
         """Get system statistics"""
         total_docs = self.db.get_document_count()
         courses = self.db.get_all_courses()
 
+        cache_hits = self.metrics.get('cache_hits_total')
+        cache_misses = self.metrics.get('cache_misses_total')
+        # Hit ratios only mean something per cache (page text, query embeddings, retrieval, rerank pairs)
+        cache_names = sorted({
+            labels['cache'] for labels in cache_hits.label_sets() + cache_misses.label_sets() if 'cache' in labels
+        })
+
         return {
             'total_documents': total_docs,
             'courses': courses,
-            'configured_courses': len(self.config.courses)
+            'configured_courses': len(self.config.courses),
+            'dedup': self.db.get_dedup_stats(),
+            'latency': self.metrics.stage_summary(),
+            'query_latency': self.metrics.get('query_seconds').summary(),
+            'time_to_first_token': self.metrics.get('time_to_first_token_seconds').summary(),
+            'tokens_per_second': self.metrics.get('generation_tokens_per_second').summary(),
+            'retrieved_rows': self.metrics.get('retrieved_rows').summary(),
+            'caches': {
+                name: {'hits': cache_hits.value(cache=name), 'misses': cache_misses.value(cache=name)}
+                for name in cache_names
+            }
         }
 
     def close(self) -> None:
         """Close connections"""
+        flush_metrics(self.metrics)
         self.db.disconnect()
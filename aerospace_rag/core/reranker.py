@@ -0,0 +1,144 @@
+"""
+CPU cross-encoder re-ranking of similarity-search candidates
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple
+
+from .metrics import get_metrics
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:  # Optional: re-ranking needs sentence-transformers
+    CrossEncoder = None
+
+# Scoring runs in sub-batches of about this fraction of the latency cap, so the
+# deadline is checked several times per query instead of once before one big batch
+SUB_BATCH_BUDGET = 0.25
+
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a small cross-encoder, under a latency cap
+
+    The model is loaded and warmed up when the re-ranker is created, so no
+    query pays for it, and the warm-up gives the first per-pair cost estimate
+    that sizes the scoring sub-batches.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        batch_size: int = 32,
+        max_latency_ms: float = 400,
+        cache_size: int = 10000
+    ):
+        if CrossEncoder is None:
+            raise ImportError(
+                "Re-ranking requires sentence-transformers. Install it with: pip install sentence-transformers"
+            )
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = get_metrics()
+
+        print(f"Loading re-ranker model {model_name}...")
+        self.model = CrossEncoder(model_name, device='cpu')
+        # The first predict pays one-off setup; the second measures the per-pair cost
+        pairs = [("warm-up query", "warm-up passage")] * min(batch_size, 8)
+        self.model.predict(pairs[:1], show_progress_bar=False)
+        warm_start = time.perf_counter()
+        self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        self._pair_seconds = (time.perf_counter() - warm_start) / len(pairs)
+
+    def _sub_batch_size(self, remaining: float) -> int:
+        """Pairs to score next: a SUB_BATCH_BUDGET share of the cap, and no more than fit in remaining"""
+        per_pair = max(self._pair_seconds, 1e-6)
+        size = min(self.batch_size, max(1, int(self.max_latency * SUB_BATCH_BUDGET / per_pair)))
+        return min(size, int(remaining / per_pair))
+
+    def _cache_get(self, key: Tuple[str, int]):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key: Tuple[str, int], score: float) -> None:
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def rerank(
+        self,
+        query: str,
+        candidates: List[Dict[str, Any]],
+        top_n: int
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Return the top_n candidates by cross-encoder score, plus stats"""
+        start = time.perf_counter()
+        query_key = hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+        scores: Dict[int, float] = {}
+        pending = []
+        for i, candidate in enumerate(candidates):
+            cached = self._cache_get((query_key, candidate['id']))
+            if cached is None:
+                pending.append(i)
+            else:
+                scores[i] = cached
+
+        hits = len(scores)
+        if hits:
+            self.metrics.get('cache_hits_total').inc(hits, cache='rerank_pairs')
+        if pending:
+            self.metrics.get('cache_misses_total').inc(len(pending), cache='rerank_pairs')
+
+        # Candidates arrive in first-stage order, so if the cap cuts scoring short
+        # the best first-stage candidates are the ones that got scored
+        timed_out = False
+        position = 0
+        while position < len(pending):
+            size = self._sub_batch_size(self.max_latency - (time.perf_counter() - start))
+            if size < 1:
+                # Not even one more pair fits in what is left of the cap
+                timed_out = True
+                break
+            batch = pending[position:position + size]
+            position += len(batch)
+            batch_start = time.perf_counter()
+            batch_scores = self.model.predict(
+                [(query, candidates[i]['text']) for i in batch],
+                batch_size=len(batch),
+                show_progress_bar=False
+            )
+            # Moving average, so the sub-batch size follows the machine's current load
+            per_pair = (time.perf_counter() - batch_start) / len(batch)
+            self._pair_seconds = 0.8 * self._pair_seconds + 0.2 * per_pair
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+                self._cache_put((query_key, candidates[i]['id']), float(score))
+
+        # Scored candidates first (by cross-encoder score), then any unscored in first-stage order
+        scored = sorted(scores, key=lambda i: -scores[i])
+        unscored = [i for i in range(len(candidates)) if i not in scores]
+        ranked = []
+        for i in (scored + unscored)[:top_n]:
+            ranked.append(dict(candidates[i], rerank_score=scores.get(i)))
+
+        stats = {
+            'candidates': len(candidates),
+            'scored': len(scores),
+            'cache_hits': hits,
+            'timed_out': timed_out,
+            'seconds': time.perf_counter() - start
+        }
+        return ranked, stats
@@ -0,0 +1,112 @@
+"""
+Caching of query embeddings and similarity-search results
+"""
+
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import get_metrics
+
+
+def embedding_key(embedding: np.ndarray) -> str:
+    """Stable hash of a query vector"""
+    return hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+
+
+class RetrievalCache:
+    """LRU caches for query text -> embedding and (embedding, filters, corpus) -> search results
+
+    Searches are over-fetched to max_k, so a repeat of the same retrieval with
+    any top_k up to max_k (a moved Top-K slider, a different --top-k) is served
+    by slicing one stored result list. Entries carry the corpus version they
+    were fetched at; when corpus_version() reports a change, the result cache
+    is cleared. The version is re-read at most every check_interval seconds.
+    """
+
+    def __init__(
+        self,
+        corpus_version: Callable[[], Hashable],
+        max_entries: int = 256,
+        max_k: int = 20,
+        embedding_entries: int = 1024,
+        check_interval: float = 1.0
+    ):
+        self.corpus_version = corpus_version
+        self.max_entries = max_entries
+        self.max_k = max_k
+        self.embedding_entries = embedding_entries
+        self.check_interval = check_interval
+        self._results: "OrderedDict[Tuple, Tuple[int, List[Dict[str, Any]]]]" = OrderedDict()
+        self._embeddings: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._version: Optional[Hashable] = None
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+        self.metrics = get_metrics()
+
+    def fetch_size(self, top_k: int) -> int:
+        """How many rows to request from the database for a top_k miss"""
+        return max(top_k, self.max_k)
+
+    def get_embedding(self, model: str, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._embeddings.get((model, text))
+            if vector is not None:
+                self._embeddings.move_to_end((model, text))
+        self._count('query_embedding', vector is not None)
+        return vector
+
+    def put_embedding(self, model: str, text: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._embeddings[(model, text)] = vector
+            self._embeddings.move_to_end((model, text))
+            while len(self._embeddings) > self.embedding_entries:
+                self._embeddings.popitem(last=False)
+
+    def get(self, key: Tuple, top_k: int) -> Optional[List[Dict[str, Any]]]:
+        """The first top_k stored results for key, if the stored fetch covers top_k"""
+        self._check_version()
+        with self._lock:
+            entry = self._results.get(key)
+            # A list shorter than its fetch size is everything above the threshold
+            if entry is not None and (top_k <= entry[0] or len(entry[1]) < entry[0]):
+                self._results.move_to_end(key)
+                rows = entry[1][:top_k]
+            else:
+                rows = None
+        self._count('retrieval', rows is not None)
+        # Callers annotate and merge hits, so they get their own copies
+        return copy.deepcopy(rows) if rows is not None else None
+
+    def put(self, key: Tuple, fetched_k: int, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._results[key] = (fetched_k, copy.deepcopy(rows))
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Drop cached results (embeddings stay valid: they depend only on model and text)"""
+        with self._lock:
+            self._results.clear()
+            self._version_checked = 0.0
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._version_checked < self.check_interval:
+            return
+        version = self.corpus_version()
+        with self._lock:
+            if version != self._version:
+                self._results.clear()
+                self._version = version
+            self._version_checked = now
+
+    def _count(self, cache: str, hit: bool) -> None:
+        name = 'cache_hits_total' if hit else 'cache_misses_total'
+        self.metrics.get(name).inc(cache=cache)
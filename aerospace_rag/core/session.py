@@ -0,0 +1,137 @@
+"""
+Multi-turn chat sessions laid out for model KV-cache reuse
+"""
+
+import re
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Optional
+
+from .tokenizer import TokenCounter
+
+
+def _first_sentence(text: str, max_chars: int = 240) -> str:
+    sentence = re.split(r'(?<=[.!?])\s+', text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "..."
+
+
+class ChatSession:
+    """Conversation state whose message prefix only changes when old turns are folded away
+
+    Ollama reuses the KV cache for the longest prompt prefix it has already
+    evaluated, so every turn is appended verbatim (including the context it
+    was answered with) and earlier messages are never rewritten, except when
+    the history outgrows its budget and the oldest turns are folded into the
+    summary at the end of the system message.
+    """
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.id = session_id or uuid.uuid4().hex
+        self.turns: List[Dict[str, str]] = []
+        self.summary_lines: List[str] = []
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.lock = threading.Lock()
+
+    @property
+    def turn_count(self) -> int:
+        return len(self.turns) + len(self.summary_lines)
+
+    def system_message(self, system_prompt: str) -> str:
+        """System prompt, followed by the summary of folded turns"""
+        if not self.summary_lines:
+            return system_prompt
+        return (
+            system_prompt
+            + "\n\nEarlier in this conversation:\n"
+            + "\n".join(f"- {line}" for line in self.summary_lines)
+        )
+
+    def history_messages(self) -> List[Dict[str, str]]:
+        """Retained turns as chat messages, oldest first"""
+        messages = []
+        for turn in self.turns:
+            messages.append({'role': 'user', 'content': turn['user']})
+            messages.append({'role': 'assistant', 'content': turn['assistant']})
+        return messages
+
+    def recent_questions(self, n: int = 1) -> List[str]:
+        return [turn['question'] for turn in self.turns[-n:]] if n else []
+
+    def add_turn(self, question: str, user_message: str, answer: str) -> None:
+        self.turns.append({'question': question, 'user': user_message, 'assistant': answer})
+        self.last_used = time.time()
+
+    def history_tokens(self, counter: TokenCounter) -> int:
+        return sum(counter.count(t['user']) + counter.count(t['assistant']) for t in self.turns)
+
+    def fold(self, counter: TokenCounter, max_turns: int, max_tokens: int) -> int:
+        """Fold the oldest turns into the summary until the history fits; returns turns folded
+
+        Folds at least half of the retained turns at once, so the prefix (and
+        the model's cached prefill) is invalidated rarely rather than every turn.
+        """
+        if len(self.turns) <= max_turns and self.history_tokens(counter) <= max_tokens:
+            return 0
+
+        n_fold = max(1, len(self.turns) // 2)
+        while n_fold < len(self.turns) and (
+            len(self.turns) - n_fold > max_turns
+            or sum(counter.count(t['user']) + counter.count(t['assistant']) for t in self.turns[n_fold:])
+            > max_tokens
+        ):
+            n_fold += 1
+
+        for turn in self.turns[:n_fold]:
+            self.summary_lines.append(f"Q: {turn['question']} A: {_first_sentence(turn['assistant'])}")
+        self.turns = self.turns[n_fold:]
+        return n_fold
+
+
+class SessionManager:
+    """Thread-safe registry of chat sessions with idle expiry"""
+
+    def __init__(self, idle_timeout: float = 3600, max_sessions: int = 100):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, ChatSession] = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> ChatSession:
+        """Start a new session"""
+        with self._lock:
+            self._expire_locked()
+            # Oldest sessions go first when the registry is full
+            while len(self._sessions) >= self.max_sessions:
+                oldest = min(self._sessions.values(), key=lambda s: s.last_used)
+                del self._sessions[oldest.id]
+            session = ChatSession()
+            self._sessions[session.id] = session
+            return session
+
+    def get(self, session_id: str) -> ChatSession:
+        """Look up a live session"""
+        with self._lock:
+            self._expire_locked()
+            session = self._sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"Unknown or expired session: {session_id}")
+        return session
+
+    def end(self, session_id: str) -> None:
+        """Discard a session"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _expire_locked(self) -> None:
+        now = time.time()
+        for sid in [sid for sid, s in self._sessions.items() if now - s.last_used > self.idle_timeout]:
+            del self._sessions[sid]
+
+    def info(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {'id': s.id, 'turns': s.turn_count, 'last_used': s.last_used}
+                for s in self._sessions.values()
+            ]
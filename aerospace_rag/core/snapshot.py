@@ -0,0 +1,273 @@
+"""
+Portable snapshots of the index: export to a directory, import with bulk COPY
+"""
+
+import csv
+import hashlib
+import io
+import json
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable
+
+import numpy as np
+
+from .database import DatabaseManager, parse_vector
+
+SNAPSHOT_FORMAT = 'aerospace-rag-snapshot'
+SNAPSHOT_VERSION = 1
+
+# Fixed-width columns: name -> (dtype, value stored for NULL)
+INT_COLUMNS = {
+    'id': ('<i8', None),
+    'course_id': ('<i4', None),
+    'file_id': ('<i4', None),
+    'chunk_index': ('<i4', None),
+    'page_number': ('<i4', -1),
+    'token_count': ('<i4', -1),
+    'canonical_id': ('<i8', -1)
+}
+# Variable-width columns, one JSON value per line
+JSON_COLUMNS = ('chunk_text', 'metadata', 'content_hash', 'minhash')
+
+EMBEDDINGS_FILE = 'embeddings.f32'
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_snapshot(
+    db: DatabaseManager,
+    directory: str,
+    chunking: Optional[Dict[str, Any]] = None,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    """Write every chunk, its metadata and active-model embedding to a new snapshot directory
+
+    Layout: manifest.json (format version, embedding model, counts and a
+    SHA-256 per file), catalog.json (courses, files, checkpoints), one file
+    per document column under columns/ (.npy for integers, JSON lines
+    otherwise) and embeddings.f32, the raw little-endian float32 vectors of
+    the rows whose has_embedding flag is set, in row order.
+    """
+    root = Path(directory)
+    if root.exists() and any(root.iterdir()):
+        raise ValueError(f"{root} is not empty")
+    (root / 'columns').mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+
+    catalog = db.snapshot_catalog()
+    (root / 'catalog.json').write_text(json.dumps(catalog, indent=1), encoding='utf-8')
+
+    ints = {name: [] for name in INT_COLUMNS}
+    has_embedding = []
+    dimension = None
+    text_files = {
+        name: open(root / 'columns' / f'{name}.jsonl', 'w', encoding='utf-8') for name in JSON_COLUMNS
+    }
+    try:
+        with open(root / EMBEDDINGS_FILE, 'wb') as vectors:
+            for n, row in enumerate(db.iter_snapshot_documents(), 1):
+                (doc_id, course_id, file_id, text, chunk_index, page_number,
+                 metadata, token_count, content_hash, canonical_id, minhash, embedding) = row
+
+                for name, value in (('id', doc_id), ('course_id', course_id), ('file_id', file_id),
+                                    ('chunk_index', chunk_index), ('page_number', page_number),
+                                    ('token_count', token_count), ('canonical_id', canonical_id)):
+                    ints[name].append(INT_COLUMNS[name][1] if value is None else value)
+
+                for name, value in (('chunk_text', text), ('metadata', metadata),
+                                    ('content_hash', content_hash.strip() if content_hash else None),
+                                    ('minhash', bytes(minhash).hex() if minhash is not None else None)):
+                    text_files[name].write(json.dumps(value) + '\n')
+
+                vector = parse_vector(embedding)
+                has_embedding.append(vector is not None)
+                if vector is not None:
+                    if dimension is None:
+                        dimension = len(vector)
+                    vectors.write(vector.astype('<f4').tobytes())
+
+                if progress_callback and n % 5000 == 0:
+                    progress_callback({'rows': n})
+    finally:
+        for f in text_files.values():
+            f.close()
+
+    for name, (dtype, _) in INT_COLUMNS.items():
+        np.save(root / 'columns' / f'{name}.npy', np.asarray(ints[name], dtype=dtype))
+    np.save(root / 'columns' / 'has_embedding.npy', np.asarray(has_embedding, dtype=bool))
+
+    files = {}
+    for path in sorted(p for p in root.rglob('*') if p.is_file()):
+        files[path.relative_to(root).as_posix()] = {'sha256': _sha256(path), 'bytes': path.stat().st_size}
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'embedding_model': {
+            'model': db.embedding_model['model'],
+            'dimension': dimension or db.embedding_model['dimension']
+        },
+        'chunking': chunking or {},
+        'counts': {
+            'courses': len(catalog['courses']),
+            'files': len(catalog['files']),
+            'documents': len(has_embedding),
+            'embeddings': int(sum(has_embedding))
+        },
+        'files': files
+    }
+    (root / 'manifest.json').write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+
+    manifest['seconds'] = time.perf_counter() - start
+    return manifest
+
+
+def read_manifest(directory: str, verify: bool = True) -> Dict[str, Any]:
+    """A snapshot's manifest, after checking its format version and (optionally) every checksum"""
+    root = Path(directory)
+    path = root / 'manifest.json'
+    if not path.exists():
+        raise FileNotFoundError(f"No snapshot manifest in {root}")
+
+    manifest = json.loads(path.read_text(encoding='utf-8'))
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"{root} is not an index snapshot")
+    if manifest.get('version', 0) > SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Snapshot format version {manifest['version']} is newer than supported ({SNAPSHOT_VERSION})"
+        )
+
+    if verify:
+        bad = []
+        for name, expected in manifest['files'].items():
+            file_path = root / name
+            if not file_path.exists() or file_path.stat().st_size != expected['bytes'] \
+                    or _sha256(file_path) != expected['sha256']:
+                bad.append(name)
+        if bad:
+            raise ValueError(f"Snapshot files missing or corrupt: {', '.join(bad)}")
+
+    return manifest
+
+
+def import_snapshot(
+    db: DatabaseManager,
+    directory: str,
+    replace: bool = False,
+    batch_size: int = 5000,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    """Load a snapshot into the database with COPY and build its indexes; no embedding calls
+
+    The database must hold no documents unless replace is set, which clears
+    them first. Course and file ids are remapped onto this database's rows;
+    document ids are kept, so duplicate chunks still point at their canonicals.
+    A snapshot of another embedding model is loaded into that model's version
+    column and activated.
+    """
+    root = Path(directory)
+    manifest = read_manifest(directory)
+    start = time.perf_counter()
+
+    model = manifest['embedding_model']['model']
+    dimension = manifest['embedding_model']['dimension']
+    version = None
+    if model == db.embedding_model['model']:
+        if dimension != db.embedding_model['dimension']:
+            raise ValueError(
+                f"Snapshot {model} vectors have {dimension} dimensions, the database expects "
+                f"{db.embedding_model['dimension']}"
+            )
+        column = db.embedding_column
+    else:
+        version = db.register_embedding_model(model, dimension)
+        column = version['column']
+
+    if not db.documents_empty():
+        if not replace:
+            raise ValueError("The database already holds documents; import with --replace to overwrite them")
+        db.clear_all_documents()
+
+    catalog = json.loads((root / 'catalog.json').read_text(encoding='utf-8'))
+    courses = {c['id']: c for c in catalog['courses']}
+    course_ids = {c['id']: db.ensure_course(c['course_code'], c['course_name']) for c in catalog['courses']}
+    file_ids = {}
+    for f in catalog['files']:
+        course = courses[f['course_id']]
+        file_ids[f['id']] = db.ensure_file(
+            course['course_code'], course['course_name'], f['content_type'], f['file_name']
+        )[1]
+
+    columns = {name: np.load(root / 'columns' / f'{name}.npy', mmap_mode='r') for name in INT_COLUMNS}
+    has_embedding = np.load(root / 'columns' / 'has_embedding.npy', mmap_mode='r')
+    n_rows = len(has_embedding)
+    n_vectors = manifest['counts']['embeddings']
+    vectors = (
+        np.memmap(root / EMBEDDINGS_FILE, dtype='<f4', mode='r', shape=(n_vectors, dimension))
+        if n_vectors else None
+    )
+    text_files = {name: open(root / 'columns' / f'{name}.jsonl', encoding='utf-8') for name in JSON_COLUMNS}
+
+    vector_row = 0
+    try:
+        buffer = io.StringIO()
+        # Every string is quoted, so only the FORCE_NULL columns' empty fields become NULL
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n')
+        for i in range(n_rows):
+            ints = {}
+            for name, (_, null) in INT_COLUMNS.items():
+                value = int(columns[name][i])
+                ints[name] = None if null is not None and value == null else value
+            text, metadata, content_hash, minhash = (json.loads(next(text_files[name])) for name in JSON_COLUMNS)
+
+            embedding = None
+            if has_embedding[i]:
+                embedding = '[' + ','.join('%.9g' % x for x in vectors[vector_row]) + ']'
+                vector_row += 1
+
+            writer.writerow([
+                ints['id'], course_ids[ints['course_id']], file_ids[ints['file_id']], text,
+                ints['chunk_index'], ints['page_number'],
+                json.dumps(metadata) if metadata is not None else None,
+                ints['token_count'], content_hash, ints['canonical_id'],
+                '\\x' + minhash if minhash is not None else None,
+                embedding
+            ])
+
+            if (i + 1) % batch_size == 0 or i + 1 == n_rows:
+                db.copy_documents(column, buffer)
+                buffer.seek(0)
+                buffer.truncate()
+                if progress_callback:
+                    progress_callback({'rows': i + 1, 'total': n_rows})
+
+    except Exception as e:
+        db.conn.rollback()
+        raise Exception(f"Snapshot import failed: {e}")
+    finally:
+        for f in text_files.values():
+            f.close()
+
+    loaded = time.perf_counter()
+    db.finish_import(column, catalog['checkpoints'])
+    if version is not None:
+        # Every canonical chunk now has a vector in the snapshot's column
+        db.activate_embedding_model(version['id'])
+
+    return {
+        'documents': n_rows,
+        'embeddings': n_vectors,
+        'model': model,
+        'column': column,
+        'load_seconds': loaded - start,
+        'index_seconds': time.perf_counter() - loaded
+    }
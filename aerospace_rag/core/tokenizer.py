@@ -0,0 +1,74 @@
+"""
+Token counting for chunking and prompt budgeting
+"""
+
+import re
+from pathlib import Path
+from typing import List, Optional
+
+from .config import get_config
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # Optional: exact counts need the HuggingFace tokenizers package
+    Tokenizer = None
+
+
+# Words, single digits and single punctuation marks
+_PIECE_RE = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+
+
+class TokenCounter:
+    """Counts tokens with a real tokenizer.json when available, else a fast approximation
+
+    The approximation mimics SentencePiece vocabularies used by Gemma models:
+    common words are one token, long words split roughly every 6 characters,
+    every digit is its own token and punctuation is one token per mark.
+    """
+
+    def __init__(self, tokenizer_path: Optional[str] = None):
+        self._tokenizer = None
+
+        if tokenizer_path and tokenizer_path != 'approx':
+            if Tokenizer is None:
+                print("Warning: 'tokenizers' package not installed; using approximate token counts")
+            elif not Path(tokenizer_path).exists():
+                print(f"Warning: Tokenizer file not found: {tokenizer_path}; using approximate token counts")
+            else:
+                self._tokenizer = Tokenizer.from_file(str(tokenizer_path))
+
+    @property
+    def exact(self) -> bool:
+        """Whether counts come from the model's real tokenizer"""
+        return self._tokenizer is not None
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text"""
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+        tokens = 0
+        for piece in _PIECE_RE.findall(text):
+            tokens += 1 + (len(piece) - 1) // 6 if piece[0].isalpha() else 1
+        return tokens
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        """Token counts for several texts"""
+        if self._tokenizer is not None and texts:
+            encodings = self._tokenizer.encode_batch(texts, add_special_tokens=False)
+            return [len(e.ids) for e in encodings]
+        return [self.count(t) for t in texts]
+
+
+# Global token counter
+_token_counter = None
+
+
+def get_token_counter() -> TokenCounter:
+    """Get global token counter configured from rag.tokenizer"""
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = TokenCounter(get_config().rag.get('tokenizer'))
+    return _token_counter
@@ -0,0 +1,187 @@
+"""
+Polling watcher that keeps the index in step with the course PDF directories
+"""
+
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .cancellation import CancelToken, OperationCancelled
+
+# (course_code, content_type, file_name) identifies a file, as in the checkpoints
+FileKey = Tuple[str, str, str]
+
+
+class IndexWatcher:
+    """Polls data_dir/<content_type>/<course>/ for PDFs and indexes changes in the background
+
+    Polling (size and mtime per file) keeps it portable across platforms and
+    network shares. A new or modified file is queued only after its size and
+    mtime have held still for debounce_seconds, so half-copied PDFs are not
+    parsed; a file missing that long is retired. A single worker thread owns
+    the database connection and drains the queue, then refreshes the vector
+    indexes (concurrently) and centroids of the courses it touched. Rows are
+    committed per batch into the live partitions, so other processes keep
+    querying throughout.
+    """
+
+    def __init__(
+        self,
+        engine,
+        data_dir: Path,
+        courses: Dict[str, str],
+        content_types: List[str],
+        poll_interval: float = 2.0,
+        debounce_seconds: float = 5.0,
+        on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None
+    ):
+        self.engine = engine
+        self.data_dir = Path(data_dir)
+        self.courses = courses
+        self.content_types = content_types
+        self.poll_interval = poll_interval
+        self.debounce = debounce_seconds
+        self.on_event = on_event or (lambda kind, info: None)
+        self._known: Dict[Path, Tuple[int, int]] = {}
+        self._pending: Dict[Path, Tuple[Tuple[int, int], float]] = {}
+        self._missing: Dict[Path, float] = {}
+        self._keys: Dict[Path, FileKey] = {}
+        self._jobs: "queue.Queue[Optional[Tuple[str, FileKey, Optional[Path]]]]" = queue.Queue()
+        self._token = CancelToken()
+        self._worker: Optional[threading.Thread] = None
+
+    def scan(self) -> Dict[Path, Tuple[FileKey, Tuple[int, int]]]:
+        """Every watched PDF with its (size, mtime_ns) signature"""
+        found = {}
+        for code in self.courses:
+            for content_type in self.content_types:
+                content_dir = self.data_dir / content_type / code
+                if not content_dir.is_dir():
+                    continue
+                for pdf_path in sorted(content_dir.glob("**/*.pdf")):
+                    try:
+                        stat = pdf_path.stat()
+                    except OSError:
+                        # Deleted between listing and stat
+                        continue
+                    found[pdf_path] = ((code, content_type, pdf_path.name), (stat.st_size, stat.st_mtime_ns))
+        return found
+
+    def reconcile(self) -> None:
+        """Queue retirement of indexed files that disappeared while nobody was watching
+
+        Every file on disk starts out pending, so changes made meanwhile are
+        picked up too (unchanged files are skipped by their checkpoint hash).
+        """
+        on_disk = {key for key, _ in self.scan().values()}
+        for cp in self.engine.db.list_checkpoints():
+            key = (cp['course_code'], cp['content_type'], cp['file_name'])
+            if cp['course_code'] in self.courses and cp['content_type'] in self.content_types \
+                    and key not in on_disk:
+                self._jobs.put(('retire', key, None))
+
+    def poll(self, now: Optional[float] = None) -> int:
+        """Compare one scan with the last; returns the number of jobs queued"""
+        now = time.monotonic() if now is None else now
+        current = self.scan()
+        queued = 0
+
+        for path, (key, signature) in current.items():
+            self._keys[path] = key
+            self._missing.pop(path, None)
+            if self._known.get(path) == signature:
+                self._pending.pop(path, None)
+                continue
+            seen = self._pending.get(path)
+            if seen is None or seen[0] != signature:
+                # New or still being written: restart its quiet period
+                self._pending[path] = (signature, now)
+            elif now - seen[1] >= self.debounce:
+                del self._pending[path]
+                self._known[path] = signature
+                self._jobs.put(('index', key, path))
+                queued += 1
+
+        for path in set(self._known) | set(self._pending):
+            if path in current:
+                continue
+            self._pending.pop(path, None)
+            since = self._missing.setdefault(path, now)
+            if now - since >= self.debounce and path in self._known:
+                del self._known[path]
+                del self._missing[path]
+                self._jobs.put(('retire', self._keys[path], path))
+                queued += 1
+            elif path not in self._known:
+                # Appeared and vanished before it was ever indexed
+                self._missing.pop(path, None)
+
+        return queued
+
+    def _work(self) -> None:
+        """Drain the job queue; after each burst, refresh indexes of the touched courses"""
+        rebuilt_rows = {code: self.engine.db.get_document_count(code) for code in self.courses}
+        touched: List[str] = []
+        while True:
+            job = self._jobs.get()
+            if job is None or self._token.cancelled:
+                return
+            action, (code, content_type, file_name), path = job
+            # Replacing or retiring a file changes the partition even when no chunks are added
+            # or removed (a modified file may now yield none), and so may a job that failed midway
+            changed = True
+            try:
+                if action == 'index':
+                    self.on_event('indexing', {'course_code': code, 'file_name': file_name})
+                    inserted = self.engine.index_file(code, content_type, path, cancel=self._token)
+                    if inserted is None:
+                        changed = False
+                        self.on_event('unchanged', {'course_code': code, 'file_name': file_name})
+                    else:
+                        self.on_event('indexed', {'course_code': code, 'file_name': file_name, 'chunks': inserted})
+                else:
+                    removed = self.engine.retire_file(code, content_type, file_name)
+                    self.on_event('retired', {'course_code': code, 'file_name': file_name, 'chunks': removed})
+            except OperationCancelled:
+                return
+            except Exception as e:
+                if self._token.cancelled:
+                    return
+                self.on_event('error', {'course_code': code, 'file_name': file_name, 'error': str(e)})
+            if changed:
+                touched.append(code)
+
+            if self._jobs.empty() and touched:
+                try:
+                    courses = sorted(set(touched))
+                    rebuilt_rows = self.engine.finish_incremental(courses, rebuilt_rows)
+                    self.on_event('refreshed', {'courses': courses})
+                except Exception as e:
+                    self.on_event('error', {'course_code': None, 'file_name': None, 'error': str(e)})
+                touched = []
+
+    def run(self, stop_event: Optional[threading.Event] = None) -> None:
+        """Watch until stop_event is set (or KeyboardInterrupt), then stop the worker"""
+        stop_event = stop_event or threading.Event()
+        self.reconcile()
+        self._worker = threading.Thread(target=self._work, name="index-watcher", daemon=True)
+        self._worker.start()
+        try:
+            while not stop_event.is_set():
+                self.poll()
+                stop_event.wait(self.poll_interval)
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """Interrupt the file being indexed (its committed batches resume later) and end the worker"""
+        self._token.cancel()
+        self._jobs.put(None)
+        if self._worker is not None:
+            self._worker.join()
+
+    @property
+    def queued(self) -> int:
+        return self._jobs.qsize()
@@ -4,7 +4,7 @@ GUI interface for Aerospace RAG application using CustomTkinter
 
 import customtkinter as ctk
 from tkinter import scrolledtext, messagebox, filedialog
-import threading
+import multiprocessing
 import sys
 from pathlib import Path
 from typing import Optional
@@ -14,6 +14,9 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 from aerospace_rag.core.rag_engine import RAGEngine
 from aerospace_rag.core.config import get_config
+from aerospace_rag.core.progress import format_rates
+from aerospace_rag.core.profiling import start_profiling, stop_profiling
+from aerospace_rag.gui.task_executor import Task, TaskExecutor
 
 
 class AerospaceRAGGUI:
@@ -37,7 +40,20 @@ class AerospaceRAGGUI:
 
         # Initialize RAG engine
         self.rag: Optional[RAGEngine] = None
+        self.session_id: Optional[str] = None
         self.config = get_config()
+        # Running tasks the user can cancel, each from its own button
+        self.query_task: Optional[Task] = None
+        self.index_task: Optional[Task] = None
+
+        # All background work runs here; widgets are only touched on the Tk thread
+        gui_cfg = self.config.get('gui', {})
+        self.executor = TaskExecutor(
+            self.root,
+            workers=gui_cfg.get('workers', 2),
+            frame_rate=gui_cfg.get('frame_rate', 30)
+        )
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Setup UI
         self.setup_ui()
@@ -140,6 +156,16 @@ class AerospaceRAGGUI:
         )
         self.clear_button.grid(row=9, column=0, padx=20, pady=10)
 
+        # CPU/memory profiling of everything run while switched on
+        self.profile_var = ctk.BooleanVar(value=False)
+        self.profile_switch = ctk.CTkSwitch(
+            sidebar,
+            text="Profile",
+            variable=self.profile_var,
+            command=self.toggle_profiling
+        )
+        self.profile_switch.grid(row=10, column=0, padx=20, pady=10, sticky="s")
+
         # System status indicator
         self.status_indicator = ctk.CTkLabel(
             sidebar,
@@ -190,6 +216,19 @@ class AerospaceRAGGUI:
         )
         self.ask_button.grid(row=0, column=1, padx=0, pady=10)
 
+        # Cancel stops the running query (the index button stops an indexing run)
+        self.cancel_button = ctk.CTkButton(
+            input_frame,
+            text="Cancel",
+            command=self.cancel_query,
+            width=100,
+            height=40,
+            fg_color="#8B3A3A",
+            hover_color="#A04545",
+            state="disabled"
+        )
+        self.cancel_button.grid(row=0, column=2, padx=(10, 0), pady=10)
+
         # Add welcome message
         self.add_system_message(
             "Welcome to Aerospace RAG Assistant!\n\n"
@@ -211,20 +250,24 @@ class AerospaceRAGGUI:
 
     def initialize_rag(self):
         """Initialize RAG engine in background"""
-        def init():
-            try:
-                self.update_status("Initializing RAG system...")
-                self.rag = RAGEngine()
-                self.rag.initialize()
-                self.update_status("Ready")
-                self.update_status_indicator("● Connected", "green")
-            except Exception as e:
-                self.update_status(f"Initialization failed: {e}")
-                self.update_status_indicator("● Error", "orange")
-                messagebox.showerror("Initialization Error", str(e))
-
-        thread = threading.Thread(target=init, daemon=True)
-        thread.start()
+        def init(token, emit):
+            rag = RAGEngine()
+            rag.initialize()
+            return rag
+
+        def on_done(rag):
+            self.rag = rag
+            self.session_id = rag.start_session()
+            self.update_status("Ready")
+            self.update_status_indicator("● Connected", "green")
+
+        def on_error(e):
+            self.update_status(f"Initialization failed: {e}")
+            self.update_status_indicator("● Error", "orange")
+            messagebox.showerror("Initialization Error", str(e))
+
+        self.update_status("Initializing RAG system...")
+        self.executor.submit("initialize", init, on_done=on_done, on_error=on_error)
 
     def ask_question(self):
         """Handle question submission"""
@@ -247,39 +290,69 @@ class AerospaceRAGGUI:
         # Clear input
         self.question_entry.delete(0, "end")
 
-        # Process query in background
-        def query():
-            try:
-                self.update_status("Searching for relevant information...")
-
-                # Get filter settings
-                course = None if self.course_var.get() == "All Courses" else self.course_var.get()
-                top_k = self.topk_var.get()
-
-                # Query RAG
-                result = self.rag.query(
-                    question,
-                    course_code=course,
-                    top_k=top_k,
-                    stream=False
-                )
-
-                self.update_status("Ready")
-
-                # Add answer to chat
+        # Widget values are read here, on the Tk thread
+        course = None if self.course_var.get() == "All Courses" else self.course_var.get()
+        top_k = self.topk_var.get()
+        session_id = self.session_id
+
+        def query(token, emit):
+            return self.rag.query(
+                question,
+                course_code=course,
+                top_k=top_k,
+                session_id=session_id,
+                on_token=lambda text: emit('token', text),
+                cancel=token
+            )
+
+        streamed = {'started': False}
+
+        def on_event(kind, payload):
+            if kind == 'token':
+                if not streamed['started']:
+                    streamed['started'] = True
+                    self.update_status("Generating answer...")
+                    self.begin_assistant_message()
+                self.append_assistant_text(payload)
+
+        def on_done(result):
+            if streamed['started']:
+                self.finish_assistant_message(result['sources'])
+            else:
                 self.add_assistant_message(result['answer'], result['sources'])
+            self.update_status("Ready")
+            self.finish_query()
+
+        def on_error(e):
+            self.update_status("Query failed")
+            self.add_error_message(f"Error: {e}")
+            self.finish_query()
+
+        def on_cancelled():
+            if streamed['started']:
+                self.append_assistant_text("\n")
+            self.update_status("Query cancelled")
+            self.add_system_message("Query cancelled.")
+            self.finish_query()
+
+        self.update_status("Searching for relevant information...")
+        self.cancel_button.configure(state="normal")
+        self.query_task = self.executor.submit(
+            "query", query, on_event=on_event, on_done=on_done, on_error=on_error, on_cancelled=on_cancelled
+        )
 
-            except Exception as e:
-                self.update_status("Query failed")
-                self.add_error_message(f"Error: {e}")
-
-            finally:
-                # Re-enable input
-                self.ask_button.configure(state="normal")
-                self.question_entry.configure(state="normal")
+    def finish_query(self):
+        """Re-enable input after a query ends"""
+        self.query_task = None
+        self.ask_button.configure(state="normal")
+        self.question_entry.configure(state="normal")
+        self.cancel_button.configure(state="disabled")
 
-        thread = threading.Thread(target=query, daemon=True)
-        thread.start()
+    def cancel_query(self):
+        """Abort the running query; an indexing run carries on"""
+        if self.query_task is not None:
+            self.update_status("Cancelling query...")
+            self.query_task.cancel()
 
     def add_user_message(self, message: str):
         """Add user message to chat"""
@@ -294,9 +367,30 @@ class AerospaceRAGGUI:
 
     def add_assistant_message(self, message: str, sources: list):
         """Add assistant message to chat"""
+        self.begin_assistant_message()
+        self.append_assistant_text(message)
+        self.finish_assistant_message(sources)
+
+    def begin_assistant_message(self):
+        """Start an assistant message whose text is appended as it streams"""
         self.chat_display.configure(state="normal")
         self.chat_display.insert("end", "\nAssistant: ", "assistant_tag")
-        self.chat_display.insert("end", message + "\n", "assistant_message")
+        self.chat_display.tag_config("assistant_tag", foreground="#4AFF8C", font=("Arial", 13, "bold"))
+        self.chat_display.see("end")
+        self.chat_display.configure(state="disabled")
+
+    def append_assistant_text(self, text: str):
+        """Append streamed answer text"""
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("end", text, "assistant_message")
+        self.chat_display.tag_config("assistant_message", foreground="#FFFFFF")
+        self.chat_display.see("end")
+        self.chat_display.configure(state="disabled")
+
+    def finish_assistant_message(self, sources: list):
+        """End an assistant message with its sources"""
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("end", "\n", "assistant_message")
 
         if sources:
             self.chat_display.insert("end", "\n📚 Sources:\n", "sources_tag")
@@ -309,8 +403,6 @@ class AerospaceRAGGUI:
                 )
                 self.chat_display.insert("end", source_text, "source_item")
 
-        self.chat_display.tag_config("assistant_tag", foreground="#4AFF8C", font=("Arial", 13, "bold"))
-        self.chat_display.tag_config("assistant_message", foreground="#FFFFFF")
         self.chat_display.tag_config("sources_tag", foreground="#FFB84A", font=("Arial", 12, "bold"))
         self.chat_display.tag_config("source_item", foreground="#CCCCCC", font=("Arial", 11))
         self.chat_display.see("end")
@@ -342,10 +434,23 @@ class AerospaceRAGGUI:
         self.chat_display.configure(state="normal")
         self.chat_display.delete("1.0", "end")
         self.chat_display.configure(state="disabled")
+
+        # A cleared chat is a new conversation for the model too
+        if self.rag:
+            if self.session_id:
+                self.rag.end_session(self.session_id)
+            self.session_id = self.rag.start_session()
+
         self.add_system_message("Chat cleared. Ready for new questions!")
 
     def index_documents(self):
-        """Index documents from PDFs"""
+        """Index documents from PDFs, or cancel the indexing run in progress"""
+        if self.index_task is not None:
+            self.update_status("Cancelling indexing...")
+            self.index_button.configure(state="disabled")
+            self.index_task.cancel()
+            return
+
         if not self.rag:
             messagebox.showwarning("Not Ready", "System is still initializing. Please wait.")
             return
@@ -361,22 +466,45 @@ class AerospaceRAGGUI:
         if not response:
             return
 
-        self.index_button.configure(state="disabled")
+        self.index_button.configure(text="Cancel Indexing")
 
-        def index():
-            try:
-                self.update_status("Indexing documents...")
-                self.rag.index_documents(course_code=course)
-                self.update_status("Ready")
-                messagebox.showinfo("Success", "Documents indexed successfully!")
-            except Exception as e:
-                self.update_status("Indexing failed")
-                messagebox.showerror("Indexing Error", str(e))
-            finally:
-                self.index_button.configure(state="normal")
-
-        thread = threading.Thread(target=index, daemon=True)
-        thread.start()
+        def index(token, emit):
+            self.rag.index_documents(
+                course_code=course,
+                progress_callback=lambda snapshot: emit('progress', snapshot),
+                cancel=token
+            )
+
+        def on_event(kind, snapshot):
+            if kind == 'progress':
+                self.update_status(
+                    f"Indexing {snapshot['files_done']}/{snapshot['total_files']} files "
+                    f"({snapshot['fraction'] * 100:.0f}%) | {format_rates(snapshot)}"
+                )
+
+        def on_done(_):
+            self.update_status("Ready")
+            self.finish_indexing()
+            messagebox.showinfo("Success", "Documents indexed successfully!")
+
+        def on_error(e):
+            self.update_status("Indexing failed")
+            self.finish_indexing()
+            messagebox.showerror("Indexing Error", str(e))
+
+        def on_cancelled():
+            self.update_status("Indexing cancelled; re-run to resume")
+            self.finish_indexing()
+
+        self.update_status("Indexing documents...")
+        self.index_task = self.executor.submit(
+            "index", index, on_event=on_event, on_done=on_done, on_error=on_error, on_cancelled=on_cancelled
+        )
+
+    def finish_indexing(self):
+        """Restore the index button after an indexing run ends"""
+        self.index_task = None
+        self.index_button.configure(text="Index Documents", state="normal")
 
     def show_statistics(self):
         """Show system statistics"""
@@ -384,11 +512,8 @@ class AerospaceRAGGUI:
             messagebox.showwarning("Not Ready", "System is still initializing. Please wait.")
             return
 
-        def get_stats():
-            try:
-                stats = self.rag.get_statistics()
-
-                stats_text = f"""
+        def on_done(stats):
+            stats_text = f"""
 Aerospace RAG System Statistics
 
 Total Documents: {stats['total_documents']}
@@ -397,25 +522,66 @@ Indexed Courses: {len(stats['courses'])}
 
 Course Breakdown:
 """
-                for course in stats['courses']:
-                    stats_text += f"  • {course['course_code']}: {course['course_name']}\n"
-                    stats_text += f"    Documents: {course['document_count']}\n"
-
-                messagebox.showinfo("System Statistics", stats_text)
-
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to get statistics: {e}")
-
-        thread = threading.Thread(target=get_stats, daemon=True)
-        thread.start()
+            for course in stats['courses']:
+                stats_text += f"  • {course['course_code']}: {course['course_name']}\n"
+                stats_text += f"    Documents: {course['document_count']}\n"
+
+            if stats['latency']:
+                stats_text += "\nQuery Latency (p50 / p95):\n"
+                for stage, summary in stats['latency'].items():
+                    stats_text += (
+                        f"  • {stage}: {summary['p50'] * 1000:.0f} ms / "
+                        f"{summary['p95'] * 1000:.0f} ms ({summary['count']} samples)\n"
+                    )
+
+            messagebox.showinfo("System Statistics", stats_text)
+
+        self.executor.submit(
+            "statistics",
+            lambda token, emit: self.rag.get_statistics(),
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Failed to get statistics: {e}")
+        )
 
     def update_status(self, message: str):
-        """Update status bar"""
-        self.root.after(0, lambda: self.status_label.configure(text=message))
+        """Update status bar (Tk thread only)"""
+        self.status_label.configure(text=message)
 
     def update_status_indicator(self, text: str, color: str):
-        """Update status indicator"""
-        self.root.after(0, lambda: self.status_indicator.configure(text=text, text_color=color))
+        """Update status indicator (Tk thread only)"""
+        self.status_indicator.configure(text=text, text_color=color)
+
+    def toggle_profiling(self):
+        """Start profiling, or stop it and write the profile"""
+        if self.profile_var.get():
+            # Stages run on worker threads; the Tk thread itself is mostly idle
+            profiler = start_profiling("gui", profile_thread=False)
+            self.update_status(f"Profiling to {profiler.directory}...")
+            return
+
+        try:
+            output = stop_profiling()
+        except Exception as e:
+            self.add_error_message(f"Failed to write profile: {e}")
+            return
+        if output is not None:
+            self.add_system_message(f"Profile written to {output}")
+            self.update_status("Ready")
+
+    def on_close(self):
+        """Cancel background work and release connections before closing"""
+        self.executor.shutdown()
+        if self.profile_var.get():
+            try:
+                stop_profiling()
+            except Exception:
+                pass
+        if self.rag:
+            try:
+                self.rag.close()
+            except Exception:
+                pass
+        self.root.destroy()
 
     def center_window(self):
         """Center the window on the screen"""
@@ -435,6 +601,8 @@ Course Breakdown:
 
 def main():
     """Main entry point for GUI"""
+    # Parallel PDF extraction uses worker processes; required for frozen executables
+    multiprocessing.freeze_support()
     app = AerospaceRAGGUI()
     app.run()
 
@@ -0,0 +1,148 @@
+"""
+Background task execution for the GUI, with results delivered on the Tk thread
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aerospace_rag.core.cancellation import CancelToken, OperationCancelled
+
+
+class Task:
+    """Handle for a submitted task: cancel it, or check whether it is still running"""
+
+    def __init__(
+        self,
+        name: str,
+        on_event: Optional[Callable[[str, Any], None]] = None,
+        on_done: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        on_cancelled: Optional[Callable[[], None]] = None
+    ):
+        self.name = name
+        self.token = CancelToken()
+        self.on_event = on_event
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancelled = on_cancelled
+        self.finished = False
+
+    def cancel(self) -> None:
+        """Stop the task's in-flight Ollama and database work"""
+        self.token.cancel()
+
+
+class TaskExecutor:
+    """Fixed worker pool whose tasks only ever touch widgets through callbacks on the Tk thread
+
+    Workers put events on a queue that the Tk thread drains once per frame
+    via after(). Events arriving within a frame are coalesced: consecutive
+    'token' events of a task become one text insert and only the newest
+    'progress' event of a task is delivered, so a fast token stream or
+    progress callback cannot flood the event loop.
+    """
+
+    def __init__(self, root, workers: int = 2, frame_rate: int = 30):
+        self.root = root
+        self.frame_ms = max(1, int(1000 / frame_rate))
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gui-task")
+        self._events: "queue.SimpleQueue[Tuple[Task, str, Any]]" = queue.SimpleQueue()
+        self._active: List[Task] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.root.after(self.frame_ms, self._drain)
+
+    def submit(
+        self,
+        name: str,
+        fn: Callable[[CancelToken, Callable[[str, Any], None]], Any],
+        on_event: Optional[Callable[[str, Any], None]] = None,
+        on_done: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        on_cancelled: Optional[Callable[[], None]] = None
+    ) -> Task:
+        """Run fn(token, emit) on a worker; emit(kind, payload) sends events to on_event"""
+        task = Task(name, on_event, on_done, on_error, on_cancelled)
+        with self._lock:
+            self._active.append(task)
+
+        def emit(kind: str, payload: Any = None) -> None:
+            self._events.put((task, kind, payload))
+
+        def run() -> None:
+            try:
+                result = fn(task.token, emit)
+            except OperationCancelled:
+                self._events.put((task, 'cancelled', None))
+            except Exception as e:
+                # Interrupted work may fail with its own error rather than OperationCancelled
+                self._events.put((task, 'cancelled' if task.token.cancelled else 'error', e))
+            else:
+                self._events.put((task, 'done', result))
+
+        self._pool.submit(run)
+        return task
+
+    def active(self) -> List[Task]:
+        with self._lock:
+            return list(self._active)
+
+    def cancel_all(self) -> None:
+        for task in self.active():
+            task.cancel()
+
+    def _drain(self) -> None:
+        """Deliver this frame's events, coalesced, on the Tk thread"""
+        events: List[List[Any]] = []
+        latest_progress: Dict[int, List[Any]] = {}
+        while True:
+            try:
+                task, kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == 'token' and events and events[-1][0] is task and events[-1][1] == 'token':
+                events[-1][2] += payload
+            elif kind == 'progress' and id(task) in latest_progress:
+                latest_progress[id(task)][2] = payload
+            else:
+                event = [task, kind, payload]
+                if kind == 'progress':
+                    latest_progress[id(task)] = event
+                events.append(event)
+
+        for task, kind, payload in events:
+            try:
+                self._dispatch(task, kind, payload)
+            except Exception as e:
+                print(f"Warning: GUI callback for {task.name} failed: {e}")
+
+        if not self._closed:
+            self.root.after(self.frame_ms, self._drain)
+
+    def _dispatch(self, task: Task, kind: str, payload: Any) -> None:
+        if kind in ('done', 'error', 'cancelled'):
+            task.finished = True
+            with self._lock:
+                if task in self._active:
+                    self._active.remove(task)
+
+        if kind == 'done':
+            if task.on_done:
+                task.on_done(payload)
+        elif kind == 'error':
+            if task.on_error:
+                task.on_error(payload)
+        elif kind == 'cancelled':
+            if task.on_cancelled:
+                task.on_cancelled()
+        elif task.on_event:
+            task.on_event(kind, payload)
+
+    def shutdown(self) -> None:
+        """Cancel running tasks and stop delivering events"""
+        self._closed = True
+        self.cancel_all()
+        self._pool.shutdown(wait=False)